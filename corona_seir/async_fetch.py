@@ -0,0 +1,75 @@
+"""
+Refresh all data sources at once. Downloads run concurrently on a bounded pool of worker threads
+(DownloadCache.download is blocking urllib), each with the cache timeout, retries with exponential backoff
+for transient errors, and the last good cached copy as fallback. A full refresh costs about the slowest
+download instead of the sum of all of them.
+"""
+import asyncio
+import os
+import random
+import socket
+import urllib.error
+
+import fetch_data
+from country_data import CountryData
+
+SOURCES = (CountryData.us_url, CountryData.states_virus_url, CountryData.counties_url)
+MAX_CONNECTIONS = 8
+RETRIES = 3
+# seconds before the first retry, doubled for every further one
+BACKOFF = 0.5
+
+
+def is_transient(error):
+    """
+    Errors worth retrying: timeouts, connection problems, rate limits and server errors
+    """
+    if isinstance(error, urllib.error.HTTPError):
+        return error.code == 429 or error.code >= 500
+    return isinstance(error, (urllib.error.URLError, socket.timeout, ConnectionError))
+
+
+async def fetch_one(url, cache, update=True, semaphore=None, retries=RETRIES, backoff=BACKOFF):
+    """
+    :param url: http(s) or file:// address
+    :param cache: DownloadCache
+    :param update: see DownloadCache.fetch
+    :param semaphore: asyncio.Semaphore bounding the concurrent downloads
+    :param retries: retries after the first attempt, for transient errors
+    :param backoff: seconds before the first retry
+    :return: path of the local copy, raises CSVFileReadError if the download fails and there is no cached copy
+    """
+    path = cache.path(url)
+    if os.path.exists(path) and (not update or cache.is_fresh(url)):
+        return path
+    semaphore = semaphore if semaphore is not None else asyncio.Semaphore(1)
+    for attempt in range(retries + 1):
+        try:
+            async with semaphore:
+                return await asyncio.to_thread(cache.download, url)
+        except (urllib.error.URLError, IOError) as error:
+            if attempt == retries or not is_transient(error):
+                return cache.use_cached(url, error)
+            await asyncio.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.0))
+
+
+async def fetch_all(urls=SOURCES, cache=None, update=True, max_connections=MAX_CONNECTIONS, retries=RETRIES,
+                    backoff=BACKOFF):
+    """
+    Download all urls concurrently
+    :param urls: http(s) or file:// addresses
+    :param cache: DownloadCache, defaults to fetch_data.download_cache
+    :return: dict of url -> local path, or the CSVFileReadError of urls without any copy
+    """
+    cache = cache if cache is not None else fetch_data.download_cache
+    semaphore = asyncio.Semaphore(max_connections)
+    paths = await asyncio.gather(*[fetch_one(url, cache, update, semaphore, retries, backoff) for url in urls],
+                                 return_exceptions=True)
+    return dict(zip(urls, paths))
+
+
+def refresh(urls=SOURCES, cache=None, update=True, **options):
+    """
+    Blocking wrapper of fetch_all, for scripts. See fetch_all for the options
+    """
+    return asyncio.run(fetch_all(urls, cache, update, **options))
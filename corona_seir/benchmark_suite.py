@@ -0,0 +1,216 @@
+"""
+Offline benchmarks of the model and data paths, asv style: plain functions timed with perf_counter,
+on synthetic NYT shaped data of 1k to 5M rows. Results are saved as JSON and compared against a baseline file,
+run with: python benchmark_suite.py
+Only the measured call is timed; fixtures, region lists and the csv files for the streaming path are made up front.
+"""
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas
+
+import data_utilities
+import fetch_data
+import seir_model
+from corona_virus import CoronaVirus
+from country_data import CountryData
+from region_index import RegionIndex
+
+SIZES = (1000, 10000, 100000, 1000000, 5000000)
+# Days per region of the synthetic files, about the length of the NYT files in 2020
+FIXTURE_DAYS = 300
+# A benchmark is a regression once it is this much slower than the baseline
+TOLERANCE = 1.25
+
+
+def synthetic_frame(rows, county=False, days=FIXTURE_DAYS, seed=0):
+    """
+    Data frame shaped like us-states.csv (date, state, fips, cases, deaths) or us-counties.csv
+    (date, county, state, fips, cases, deaths), with logistic cumulative curves
+    :param rows: number of rows, rounded down to whole regions
+    :param county: counties file layout
+    :param days: days per region
+    :param seed: random seed
+    :return: pandas data frame
+    """
+    rng = np.random.default_rng(seed)
+    days = min(days, rows)
+    regions = rows // days
+    states = fetch_data.get_region_names()
+    dates = np.datetime_as_string(np.datetime64('2020-01-21') + np.arange(days))
+
+    size = rng.lognormal(8, 2, regions)
+    midpoint = rng.uniform(0.2, 0.6, regions) * days
+    curve = 1.0 / (1.0 + np.exp(-(np.arange(days) - midpoint[:, np.newaxis]) / 12.0))
+    cases = np.floor(size[:, np.newaxis] * curve).astype('int64')
+    deaths = np.floor(cases * 0.015).astype('int64')
+
+    columns = {'date': np.tile(dates, regions)}
+    region = np.arange(regions)
+    if county:
+        columns['county'] = np.repeat(np.array(['County {}'.format(k // len(states)) for k in region], dtype=object),
+                                      days)
+        columns['state'] = np.repeat(np.array([states[k % len(states)] for k in region], dtype=object), days)
+    else:
+        # state names repeat past the 52 real ones, number them to keep every region unique
+        names = [states[k % len(states)] + ('' if k < len(states) else ' {}'.format(k // len(states)))
+                 for k in region]
+        columns['state'] = np.repeat(np.array(names, dtype=object), days)
+    columns['fips'] = np.repeat(1000 + region, days)
+    columns['cases'] = cases.ravel()
+    columns['deaths'] = deaths.ravel()
+    return pandas.DataFrame(columns)
+
+
+def measure(function, repeat=5, number=1):
+    """
+    :param function: callable without arguments
+    :param repeat: timing runs
+    :param number: calls per run
+    :return: dict of min, median and mean seconds per call
+    """
+    times = []
+    for run in range(repeat):
+        start = time.perf_counter()
+        for call in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    return {'min': min(times), 'median': statistics.median(times), 'mean': statistics.mean(times),
+            'repeat': repeat, 'number': number}
+
+
+def _region(name, county=False, state=None):
+    # CountryData without fetching anything, for timing the fix_raw_* methods alone
+    country_data = CountryData.__new__(CountryData)
+    country_data.name, country_data.county, country_data.state = name, county, state
+    return country_data
+
+
+def model_benchmarks(repeat=5):
+    """
+    Benchmarks that don't depend on the data size
+    :return: dict of benchmark name -> timings
+    """
+    virus = CoronaVirus()
+    population = 3.3e8
+    days, s, e, i, r = seir_model.solve(seir_model.model_changing_beta, population, 1, virus)
+    model_deaths = seir_model.calculate_deaths(days, r, virus)
+    # offset search against one region of the synthetic states file
+    deaths = synthetic_frame(FIXTURE_DAYS).deaths.values
+    offset = measure(lambda: data_utilities.get_offset_x(deaths, model_deaths), repeat, 20)
+    names = fetch_data.get_region_names()
+    return {'data_utilities.get_offset_x': offset,
+            'seir_model.solve': measure(lambda: seir_model.solve(seir_model.model_changing_beta, population, 1,
+                                                                 virus), repeat),
+            'calculate_deaths': measure(lambda: seir_model.calculate_deaths(days, r, virus), repeat, 20),
+            'calculate_reported_cases': measure(lambda: seir_model.calculate_reported_cases(i, virus), repeat, 20),
+            'fetch_data.get_population': measure(lambda: [fetch_data.get_population(name) for name in names],
+                                                 repeat)}
+
+
+def data_benchmarks(rows, repeat=5):
+    """
+    Benchmarks on synthetic data of the given size
+    :param rows: rows of the synthetic files
+    :return: dict of benchmark name -> timings
+    """
+    results = {}
+    virus = CoronaVirus()
+    days, s, e, i, r = seir_model.solve(seir_model.model_changing_beta, 3.3e8, 1, virus)
+
+    # states: parsed once into the cache's RegionIndex, then looked up per region
+    states = synthetic_frame(rows)
+    results['RegionIndex.from_frame'] = measure(lambda: RegionIndex.from_frame(states), repeat)
+    state_index = RegionIndex.from_frame(states)
+    state_data = _region(states.state.iloc[0])
+    results['CountryData.fix_raw_state_data'] = measure(lambda: state_data.fix_raw_state_data(state_index),
+                                                        repeat, 100)
+
+    # counties: CountryData streams the csv and keeps only its county
+    counties = synthetic_frame(rows, county=True)
+    region = counties.state.iloc[0], counties.county.iloc[0]
+    folder = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        path = os.path.join(folder, 'us-counties.csv')
+        counties[['date', 'county', 'state', 'fips', 'cases', 'deaths']].to_csv(path, index=False)
+        del counties
+        results['RegionIndex.from_csv_chunks'] = measure(
+            lambda: RegionIndex.from_csv_chunks(path, regions=[region]), repeat)
+        county_index = RegionIndex.from_csv_chunks(path, regions=[region])
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    county_data = _region(region[1], county=True, state=region[0])
+    results['CountryData.fix_raw_county_data'] = measure(lambda: county_data.fix_raw_county_data(county_index),
+                                                         repeat, 100)
+
+    # dates of the whole synthetic file, the shape a multi region run sees
+    results['data_utilities.model_to_world_time'] = measure(
+        lambda: data_utilities.model_to_world_time(days, states.date.values), repeat)
+    return results
+
+
+def run_benchmarks(sizes=SIZES, repeat=5):
+    """
+    :param sizes: synthetic file sizes in rows
+    :param repeat: timing runs per benchmark
+    :return: dict with the machine description and 'results': benchmark name -> timings, data benchmarks are
+    named 'name[rows]'
+    """
+    results = model_benchmarks(repeat)
+    for rows in sizes:
+        for name, timings in data_benchmarks(rows, repeat).items():
+            results['{}[{}]'.format(name, rows)] = timings
+    return {'machine': {'python': platform.python_version(), 'numpy': np.__version__,
+                        'pandas': pandas.__version__, 'platform': platform.platform()},
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': results}
+
+
+def save_results(file_name, results):
+    with open(file_name, 'w') as json_file:
+        json.dump(results, json_file, indent=1, sort_keys=True)
+
+
+def load_results(file_name):
+    with open(file_name) as json_file:
+        return json.load(json_file)
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Compare the min times of two benchmark runs
+    :param results: run_benchmarks output
+    :param baseline: run_benchmarks output of the reference run
+    :param tolerance: slowdown ratio above which a benchmark counts as a regression
+    :return: dict of benchmark name -> ratio new / baseline, for the benchmarks of both runs;
+    and the list of regressed benchmark names
+    """
+    ratios = {name: timings['min'] / baseline['results'][name]['min']
+              for name, timings in results['results'].items() if name in baseline['results']}
+    regressions = sorted(name for name, ratio in ratios.items() if ratio > tolerance)
+    return ratios, regressions
+
+
+if __name__ == '__main__':
+    # Where to save this run, and the run to compare against (created by the first run)
+    results_file = 'benchmarks.json'
+    baseline_file = 'benchmarks_baseline.json'
+    results = run_benchmarks()
+    save_results(results_file, results)
+    if not os.path.exists(baseline_file):
+        save_results(baseline_file, results)
+        print('saved baseline', baseline_file)
+        sys.exit(0)
+
+    ratios, regressions = compare(results, load_results(baseline_file))
+    for name in sorted(ratios):
+        print('{:60s} {:10.6f}s {:6.2f}x{}'.format(name, results['results'][name]['min'], ratios[name],
+                                                   '  REGRESSION' if name in regressions else ''))
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,295 @@
+"""
+Fit R0, the lockdown R0 and start day, the infection fatality rate and the find factor to reported data.
+The error is the same log relative error get_offset_x uses to align the model with the data, for deaths
+and (weighted) reported cases, at the best offset for each candidate.
+
+Every start is a cross entropy search: each generation samples candidates from the start's mean and covariance,
+solves all candidates of all starts in one solve_batch call and moves mean and covariance part of the way to
+the best candidates. The covariance lets a start follow the narrow diagonal valley of R0, lockdown day and data
+offset. Starts that fall behind the best one are dropped early. A previous fit can be used as a warm start.
+Several regions are fitted in parallel on a process pool.
+
+The IFR is held at the virus value by default. Deaths only fix IFR * infections and reported cases only
+find ratio * infections, so a lower IFR with a higher find factor and more infections (herd immunity instead of
+the lockdown) fits the data almost as well, and a free IFR drifts towards its bounds. Fit it too with
+fit=FIT_PARAMETERS when the data covers the decline of an outbreak.
+"""
+import os
+import json
+import concurrent.futures
+import numpy as np
+
+import data_utilities
+import seir_model
+from model_config import DEFAULT_CONFIG
+from corona_virus import CoronaVirus
+from intervention import InterventionSchedule
+from country_data import CountryData
+from population_registry import UnknownRegionError
+
+FIT_PARAMETERS = ('r0', 'quarantine_r1', 'days0', 'fatality_rate', 'find_factor')
+# Parameters fitted by default, the others keep the value of the virus and the config
+DEFAULT_FIT = ('r0', 'quarantine_r1', 'days0', 'find_factor')
+DEFAULT_BOUNDS = {'r0': (1.5, 6.0),
+                  'quarantine_r1': (0.3, 1.5),
+                  'days0': (20.0, 150.0),
+                  'fatality_rate': (0.001, 0.02),
+                  'find_factor': (1.0, 50.0)}
+# Share of the way mean and covariance of a start move to the best candidates in one generation
+SMOOTHING = 0.5
+
+
+class CalibrationResult(object):
+
+    def __init__(self, params, error, data_offset, generations=0, evaluations=0):
+        self.params = params
+        self.error = error
+        self.data_offset = data_offset
+        self.generations = generations
+        self.evaluations = evaluations
+
+    def virus(self, base_virus=None):
+        """
+        CoronaVirus with the fitted r0, fatality_rate and find_factor, other values from base_virus
+        """
+        virus = CoronaVirus() if base_virus is None else base_virus
+        fitted = CoronaVirus(fatality_rate=self.params['fatality_rate'], generation_time=virus.generation_time,
+                             incubation_period=virus.incubation_period, no_symptoms=virus.no_symptoms,
+                             r0=self.params['r0'], time_presymptom=virus.time_presymptom,
+                             find_factor=self.params['find_factor'])
+        return fitted
+
+    def config(self, base_config=DEFAULT_CONFIG):
+        """
+        ModelConfig with the fitted lockdown R0, start day and data offset, other values from base_config.
+        The lockdown keeps its length and the lifted R0 its difference to the lockdown R0, as in the fit.
+        The lockdown days are whole days, as in the fit.
+        """
+        quarantine_r1 = self.params['quarantine_r1']
+        days0 = int(round(self.params['days0']))
+        return base_config.replace(quarantine_r1=quarantine_r1,
+                                   lifted_q_r2=quarantine_r1 + (base_config.lifted_q_r2 - base_config.quarantine_r1),
+                                   days0=days0,
+                                   days_q_lifted=days0 + int(round(base_config.days_q_lifted - base_config.days0)),
+                                   data_offset=self.data_offset)
+
+    def schedule(self, base_config=DEFAULT_CONFIG, steps_per_day=24):
+        """
+        InterventionSchedule of the fitted R0 values and lockdown
+        """
+        return InterventionSchedule.from_config(self.params['r0'], self.config(base_config), steps_per_day)
+
+    def to_dict(self):
+        return {'params': self.params, 'error': self.error, 'data_offset': self.data_offset,
+                'generations': self.generations, 'evaluations': self.evaluations}
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(values['params'], values['error'], values['data_offset'], values.get('generations', 0),
+                   values.get('evaluations', 0))
+
+
+def candidate_params(values, population, virus, config=DEFAULT_CONFIG):
+    """
+    solve_batch parameter array for fit candidates. The lockdown starts on a whole day and keeps its length,
+    the lifted R0 keeps its difference to the lockdown R0 from config.
+    :param values: (N, len(FIT_PARAMETERS)) array
+    :param population: Total population
+    :param virus: Virus object with the values that aren't fitted
+    :param config: ModelConfig
+    :return: (N, len(BATCH_COLUMNS)) array
+    """
+    r0, quarantine_r1, days0, fatality_rate, find_factor = values.T
+    days0 = np.round(days0)
+    params = np.tile(seir_model.batch_params(population, virus, config=config), (len(values), 1))
+    column = seir_model.BATCH_COLUMNS.index
+    params[:, column('r0')] = r0
+    params[:, column('quarantine_r1')] = quarantine_r1
+    params[:, column('lifted_q_r2')] = quarantine_r1 + (config.lifted_q_r2 - config.quarantine_r1)
+    params[:, column('days0')] = days0
+    params[:, column('days_q_lifted')] = days0 + (config.days_q_lifted - config.days0)
+    params[:, column('fatality_rate')] = fatality_rate
+    params[:, column('find_ratio')] = (1.0 - virus.no_symptoms) / find_factor
+    return params
+
+
+def fit_errors(values, country_data, virus, cases_weight=0.5, steps_per_day=2, config=DEFAULT_CONFIG):
+    """
+    Error of every candidate against the reported data
+    :param values: (N, len(FIT_PARAMETERS)) array
+    :param country_data: CountryData() object
+    :param virus: Virus object with the values that aren't fitted
+    :param cases_weight: weight of the reported cases error, 0 fits deaths only
+    :param steps_per_day: RK4 steps per day of the batch solver
+    :param config: ModelConfig
+    :return: errors (N,), best data offset (N,)
+    """
+    params = candidate_params(values, country_data.population, virus, config)
+    days, susceptible, exposed, infected, recovered = seir_model.solve_batch(params, steps_per_day=steps_per_day,
+                                                                             config=config)
+    batch = seir_model.VirusBatch(params)
+    deaths = seir_model.calculate_deaths(days, recovered, batch, config)
+    offsets, errors = data_utilities.find_offset(country_data.deaths, deaths, window=config.offset_window)
+    errors = np.min(errors, axis=-1)
+    if cases_weight:
+        cases = seir_model.calculate_reported_cases(infected, batch, config)
+        cases_errors = data_utilities.offset_errors(country_data.reported_cases, cases, window=config.offset_window)
+        errors = errors + cases_weight * np.take_along_axis(cases_errors, offsets[:, None], axis=-1)[:, 0]
+    # solver blow ups, i.e. R0 and days0 far out of range, never win
+    return np.where(np.isfinite(errors), errors, np.inf), offsets
+
+
+def calibrate(country_data, virus=None, bounds=None, starts=12, population_size=24, generations=30, elite=0.25,
+              warm_start=None, drop_after=10, drop_ratio=1.5, tolerance=1e-3, cases_weight=0.5, seed=None,
+              config=DEFAULT_CONFIG, fit=DEFAULT_FIT, smoothing=SMOOTHING):
+    """
+    Fit FIT_PARAMETERS to the data of one region
+    :param country_data: CountryData() object
+    :param virus: Virus object with the values that aren't fitted, default CoronaVirus()
+    :param bounds: dict of parameter -> (low, high), defaults to DEFAULT_BOUNDS
+    :param starts: number of independent starts
+    :param population_size: candidates per start and generation
+    :param generations: maximum number of generations
+    :param elite: share of the candidates the next generation is built from
+    :param warm_start: CalibrationResult or params dict to start the first search from, i.e. yesterday's fit
+    :param drop_after: generations before poor starts are dropped
+    :param drop_ratio: drop starts whose best error is more than drop_ratio times the best error of all starts
+    :param tolerance: stop once the spread of every remaining start is below this, in units of the bounds
+    :param cases_weight: weight of the reported cases error, 0 fits deaths only
+    :param seed: random seed
+    :param config: ModelConfig, also gives quarantine_r1 and days0 when they aren't fitted
+    :param fit: the FIT_PARAMETERS to fit, the others keep the value of virus and config
+    :param smoothing: share of the way mean and covariance of a start move to the best candidates per generation
+    :return: CalibrationResult
+    """
+    virus = CoronaVirus() if virus is None else virus
+    bounds = dict(DEFAULT_BOUNDS, **(bounds or {}))
+    fixed = {'r0': virus.r0, 'quarantine_r1': config.quarantine_r1, 'days0': config.days0,
+             'fatality_rate': virus.fatality_rate, 'find_factor': virus.find_factor}
+    fitted = np.array([name in fit for name in FIT_PARAMETERS])
+    low = np.array([bounds[name][0] if name in fit else fixed[name] for name in FIT_PARAMETERS], dtype='float64')
+    high = np.array([bounds[name][1] if name in fit else fixed[name] for name in FIT_PARAMETERS], dtype='float64')
+    dimensions = int(fitted.sum())
+    rng = np.random.default_rng(seed)
+    num_elite = max(int(population_size * elite), 2)
+
+    # searches run in [0, 1] per fitted parameter
+    means = rng.random((starts, dimensions))
+    covariances = np.tile(np.eye(dimensions) * 0.3 ** 2, (starts, 1, 1))
+    if warm_start is not None:
+        previous = warm_start.params if isinstance(warm_start, CalibrationResult) else warm_start
+        means[0] = np.clip((np.array([previous[name] for name in FIT_PARAMETERS]) - low) / (high - low),
+                           0.0, 1.0)[fitted]
+        covariances[0] = np.eye(dimensions) * 0.05 ** 2
+
+    def values(samples):
+        unit = np.zeros(samples.shape[:-1] + (len(FIT_PARAMETERS),))
+        unit[..., fitted] = samples
+        return low + unit * (high - low)
+
+    best_values = np.zeros((starts, dimensions))
+    best_errors = np.full(starts, np.inf)
+    best_offsets = np.zeros(starts, dtype='int64')
+    active = np.arange(starts)
+    evaluations = 0
+    generation = 0
+    for generation in range(1, generations + 1):
+        factors = np.linalg.cholesky(covariances[active] + 1e-12 * np.eye(dimensions))
+        samples = np.clip(means[active, None, :] + np.einsum('aij,apj->api', factors, rng.standard_normal(
+            (len(active), population_size, dimensions))), 0.0, 1.0)
+        # keep each current best in the population so a start never gets worse
+        samples[:, 0, :] = np.where(np.isfinite(best_errors[active, None]), best_values[active], samples[:, 0, :])
+        errors, offsets = fit_errors(values(samples).reshape(-1, len(FIT_PARAMETERS)), country_data,
+                                     virus, cases_weight=cases_weight, config=config)
+        evaluations += errors.size
+        errors = errors.reshape(len(active), population_size)
+        offsets = offsets.reshape(len(active), population_size)
+
+        order = np.argsort(errors, axis=1)
+        for row, start in enumerate(active):
+            winners = samples[row, order[row, :num_elite]]
+            means[start] += smoothing * (winners.mean(axis=0) - means[start])
+            covariances[start] += smoothing * (np.cov(winners, rowvar=False).reshape(dimensions, dimensions) -
+                                               covariances[start])
+            if errors[row, order[row, 0]] < best_errors[start]:
+                best_errors[start] = errors[row, order[row, 0]]
+                best_values[start] = samples[row, order[row, 0]]
+                best_offsets[start] = offsets[row, order[row, 0]]
+
+        if generation >= drop_after and len(active) > 1:
+            active = active[best_errors[active] <= drop_ratio * best_errors.min()]
+        spreads = np.sqrt(np.diagonal(covariances[active], axis1=1, axis2=2))
+        if np.all(spreads < tolerance):
+            break
+
+    winner = int(np.argmin(best_errors))
+    result = values(best_values[winner])
+    result[FIT_PARAMETERS.index('days0')] = np.round(result[FIT_PARAMETERS.index('days0')])
+    return CalibrationResult({name: float(value) for name, value in zip(FIT_PARAMETERS, result)},
+                             float(best_errors[winner]), int(best_offsets[winner]), generation, evaluations)
+
+
+def load_fits(file_name):
+    """
+    Previous fits, i.e. to warm start today's fit
+    :param file_name: json file written by save_fits
+    :return: dict of fit key (see fit_key) -> CalibrationResult, empty if the file doesn't exist
+    """
+    if not os.path.exists(file_name):
+        return {}
+    with open(file_name, mode='r') as fits_file:
+        return {name: CalibrationResult.from_dict(values) for name, values in json.load(fits_file).items()}
+
+
+def save_fits(file_name, fits):
+    """
+    :param file_name: json file
+    :param fits: dict of region name, (state, county) tuple or fit key -> CalibrationResult
+    """
+    with open(file_name, mode='w') as fits_file:
+        json.dump({fit_key(region): fit.to_dict() for region, fit in fits.items()}, fits_file, indent=1)
+
+
+def fit_key(region):
+    """
+    Name of a region in a fits file
+    :param region: region name, or (state, county) for counties
+    :return: str, 'county, state' for counties
+    """
+    if isinstance(region, tuple):
+        state, name = region
+        return '{}, {}'.format(name, state)
+    return region
+
+
+def _calibrate_region(region, county, warm_start, options):
+    state, name = region if isinstance(region, tuple) else (None, region)
+    country_data = CountryData(name=name, county=county, state=state)
+    return calibrate(country_data, warm_start=warm_start, **options)
+
+
+def calibrate_regions(names, county=False, fits_file=None, max_workers=None, **options):
+    """
+    Fit several regions in parallel, warm started from (and saved to) fits_file. Regions without a population
+    (i.e. counties when the county population file isn't there) are skipped with a message.
+    :param names: list of region names, or (state, county) tuples for counties whose name exists in several states
+    :param county: regions are counties
+    :param fits_file: json file with previous fits, updated with the new ones
+    :param max_workers: number of processes, defaults to the number of CPUs
+    :param options: passed to calibrate
+    :return: dict of region (as given in names) -> CalibrationResult
+    """
+    previous = load_fits(fits_file) if fits_file else {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(_calibrate_region, name, county, previous.get(fit_key(name)), options)
+                   for name in names}
+        fits = {}
+        for name, future in futures.items():
+            try:
+                fits[name] = future.result()
+            except UnknownRegionError as error:
+                print('skipped {}: {}'.format(name, error.args[0]))
+    if fits_file:
+        previous.update((fit_key(name), fit) for name, fit in fits.items())
+        save_fits(fits_file, previous)
+    return fits
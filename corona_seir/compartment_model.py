@@ -0,0 +1,160 @@
+"""
+Age stratified SEIR model with hospital, ICU and death compartments.
+K age groups mix through a contact matrix (dense numpy or scipy.sparse), compartments per group:
+    S  susceptible
+    E  exposed
+    I_a infectious without symptoms, share no_symptoms of the exposed
+    I_s infectious with symptoms
+    H  in hospital, share hospital_rate of the symptomatic
+    C  in ICU, share icu_rate of those in hospital, after HOSPITAL_ICU_LAG days
+    R  recovered
+    D  dead, share icu_fatality of those in ICU
+The right hand side is a few matrix products over (K,) vectors and the Jacobian is analytic, so 16 age bands x 8
+compartments stay close to the cost of the scalar model.
+"""
+import numpy as np
+import scipy.integrate
+import scipy.sparse
+
+from intervention import InterventionSchedule
+from model_config import DEFAULT_CONFIG
+
+COMPARTMENTS = ('S', 'E', 'I_a', 'I_s', 'H', 'C', 'R', 'D')
+S, E, I_A, I_S, H, C, R, D = range(len(COMPARTMENTS))
+
+
+def normalize_contacts(contacts):
+    """
+    Scale a contact matrix to spectral radius 1, then beta = r0 * gamma gives the virus r0
+    :param contacts: (K, K) dense or sparse contact matrix, contacts[i, j] rate of group i meeting group j
+    :return: scaled matrix of the same type
+    """
+    dense = contacts.toarray() if scipy.sparse.issparse(contacts) else np.asarray(contacts, dtype='float64')
+    radius = np.max(np.abs(np.linalg.eigvals(dense)))
+    return contacts / radius
+
+
+class AgeStructuredModel(object):
+
+    def __init__(self, populations, contacts, virus, hospital_rate=0.05, icu_rate=0.3, icu_fatality=0.4,
+                 schedule=None, config=DEFAULT_CONFIG):
+        """
+        :param populations: (K,) population of each age group
+        :param contacts: (K, K) contact matrix, dense or scipy.sparse, see normalize_contacts
+        :param virus: Virus object for sigma, gamma, r0 and no_symptoms
+        :param hospital_rate: share of symptomatic cases that go to hospital, scalar or per group
+        :param icu_rate: share of hospital cases that go to ICU, scalar or per group
+        :param icu_fatality: share of ICU cases that die, scalar or per group
+        :param schedule: InterventionSchedule, defaults to the lockdown of config
+        :param config: ModelConfig, for the days and the hospital times
+        """
+        self.populations = np.asarray(populations, dtype='float64')
+        self.groups = len(self.populations)
+        self.contacts = normalize_contacts(contacts)
+        # force of infection is (contacts / populations) @ infectious, without the beta factor
+        if scipy.sparse.issparse(self.contacts):
+            self._mixing = scipy.sparse.csr_matrix(self.contacts.multiply(1.0 / self.populations[np.newaxis, :]))
+        else:
+            self._mixing = self.contacts / self.populations[np.newaxis, :]
+        self.virus = virus
+        self.schedule = schedule if schedule is not None else InterventionSchedule.from_config(virus.r0, config)
+        self.config = config
+        ones = np.ones(self.groups)
+        self.hospital_rate = hospital_rate * ones
+        self.icu_rate = icu_rate * ones
+        self.icu_fatality = icu_fatality * ones
+        # leave hospital (to ICU or home) after HOSPITAL_ICU_LAG days, leave ICU after the rest of the hospital stay
+        self.hospital_exit = 1.0 / config.hospital_icu_lag
+        self.icu_exit = 1.0 / max(config.time_in_hospital - config.hospital_icu_lag, 1)
+        self._linear = self._linear_jacobian()
+
+    def _linear_jacobian(self):
+        """
+        Part of the Jacobian that doesn't depend on the state
+        """
+        k = self.groups
+        sigma, gamma, no_symptoms = self.virus.sigma, self.virus.gamma, self.virus.no_symptoms
+        jacobian = np.zeros((len(COMPARTMENTS) * k, len(COMPARTMENTS) * k))
+        diagonal = np.arange(k)
+
+        def block(row, column, values):
+            jacobian[row * k + diagonal, column * k + diagonal] += values
+
+        block(E, E, -sigma)
+        block(I_A, E, no_symptoms * sigma)
+        block(I_A, I_A, -gamma)
+        block(I_S, E, (1.0 - no_symptoms) * sigma)
+        block(I_S, I_S, -gamma)
+        block(H, I_S, self.hospital_rate * gamma)
+        block(H, H, -self.hospital_exit)
+        block(C, H, self.icu_rate * self.hospital_exit)
+        block(C, C, -self.icu_exit)
+        block(R, I_A, gamma)
+        block(R, I_S, (1.0 - self.hospital_rate) * gamma)
+        block(R, H, (1.0 - self.icu_rate) * self.hospital_exit)
+        block(R, C, (1.0 - self.icu_fatality) * self.icu_exit)
+        block(D, C, self.icu_fatality * self.icu_exit)
+        return jacobian
+
+    def beta(self, t):
+        return self.schedule.r0_at(t) * self.virus.gamma
+
+    def rhs(self, y, t):
+        """
+        :param y: flat state, compartment major: y[c * K:(c + 1) * K] is compartment c
+        :param t: day
+        :return: flat derivative
+        """
+        state = y.reshape(len(COMPARTMENTS), self.groups)
+        infections = state[S] * (self.beta(t) * (self._mixing @ (state[I_A] + state[I_S])))
+        derivative = self._linear @ y
+        derivative[S * self.groups:(S + 1) * self.groups] -= infections
+        derivative[E * self.groups:(E + 1) * self.groups] += infections
+        return derivative
+
+    def jacobian(self, y, t):
+        """
+        Analytic Jacobian of rhs, d rhs[i] / d y[j]
+        """
+        k = self.groups
+        state = y.reshape(len(COMPARTMENTS), k)
+        beta = self.beta(t)
+        force = beta * (self._mixing @ (state[I_A] + state[I_S]))
+        mixing = self._mixing.toarray() if scipy.sparse.issparse(self._mixing) else self._mixing
+        infected_block = beta * state[S][:, np.newaxis] * mixing
+        jacobian = self._linear.copy()
+        diagonal = np.arange(k)
+        jacobian[S * k + diagonal, S * k + diagonal] -= force
+        jacobian[E * k + diagonal, S * k + diagonal] += force
+        for column in (I_A, I_S):
+            jacobian[S * k:(S + 1) * k, column * k:(column + 1) * k] -= infected_block
+            jacobian[E * k:(E + 1) * k, column * k:(column + 1) * k] += infected_block
+        return jacobian
+
+    def solve(self, init_infected=None, use_jacobian=True):
+        """
+        :param init_infected: exposed people at the start, scalar (spread by population) or per group.
+        Defaults to config.init_infected
+        :param use_jacobian: pass the analytic Jacobian to odeint
+        :return: days, dict of compartment name -> (K, days_total) array
+        """
+        init_infected = self.config.init_infected if init_infected is None else init_infected
+        if np.ndim(init_infected) == 0:
+            init_infected = init_infected * self.populations / self.populations.sum()
+        y0 = np.zeros((len(COMPARTMENTS), self.groups))
+        y0[S] = self.populations - init_infected
+        y0[E] = init_infected
+
+        days = np.arange(self.config.days_total)
+        solution = scipy.integrate.odeint(self.rhs, y0.ravel(), days, Dfun=self.jacobian if use_jacobian else None)
+        compartments = solution.T.reshape(len(COMPARTMENTS), self.groups, len(days))
+        return days, dict(zip(COMPARTMENTS, compartments))
+
+
+def totals(compartments):
+    """
+    Sum a solve() result over the age groups
+    :param compartments: dict of compartment name -> (K, T) array
+    :return: dict of compartment name -> (T,) array
+    """
+    return {name: values.sum(axis=0) for name, values in compartments.items()}
@@ -18,10 +18,12 @@ DAYS_Q_LIFTED = DAYS0 + 75
 ### -------------------------------------------------------------------- ###
 
 INIT_INFECTED = 1
-DELTA_R0 = 0.0025 # Decrement R0 a little at a time during week before full lockdown or after lockdown ends
+DELTA_R0 = 0.0025 # Increment R0 a little each day after lockdown ends, see intervention.reproduction
 DATA_OFFSET = 'auto'  # position of real world data relative to model in whole days. 'auto' will choose optimal offset based on matching of deaths curves
+OFFSET_WINDOW = 150  # number of whole day offsets tried when DATA_OFFSET is 'auto'
 TIME_IN_HOSPITAL = 12
 COMMUNICATION_LAG = 2
 TEST_LAG = 3
 SYMPTOM_HOSPITAL_LAG = 5
-HOSPITAL_ICU_LAG = 5
\ No newline at end of file
+HOSPITAL_ICU_LAG = 5
+SOLVER = 'odeint'  # integrator used by seir_model.solve, see solver_backends.BACKENDS
\ No newline at end of file
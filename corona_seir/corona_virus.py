@@ -41,9 +41,18 @@ class CoronaVirus(object):
         self._r1 = 0.5 * (-(self._sigma + self._gamma) +
                           math.sqrt((self._sigma + self._gamma) ** 2 + 4 * self._sigma * self._gamma * (
                         self._r0 - 1)))
-        self.doubling_time = (math.log(2.0, math.e) / self._r1)
+        # with r0 = 1 the epidemic neither grows nor shrinks
+        self.doubling_time = (math.log(2.0, math.e) / self._r1) if self._r1 != 0 else math.inf
 
 
+    def parameters(self):
+        """
+        All values that affect the model, i.e. to use as a cache key
+        :return: tuple
+        """
+        return (self._fatality_rate, self._generation_time, self._incubation_period, self._no_symptoms, self._r0,
+                self._time_presymptom, self._find_factor, self._sigma, self._gamma, self._find_ratio, self._beta)
+
     @property
     def beta(self):
         return self._beta
@@ -94,6 +103,24 @@ class CoronaVirus(object):
         self._generation_time = value
         self.gamma = 1.0 / (2.0 * (self._generation_time - 1.0 / self.sigma))
 
+    @property
+    def incubation_period(self):
+        return self._incubation_period
+
+    @incubation_period.setter
+    def incubation_period(self, days):
+        self._incubation_period = days
+        self.sigma = 1.0 / (self._incubation_period - self._time_presymptom)
+
+    @property
+    def no_symptoms(self):
+        return self._no_symptoms
+
+    @no_symptoms.setter
+    def no_symptoms(self, share):
+        self._no_symptoms = share
+        self.find_ratio = (1.0 - self._no_symptoms) / self._find_factor
+
     @property
     def r0(self):
         return self._r0
@@ -119,4 +146,4 @@ class CoronaVirus(object):
     @time_presymptom.setter
     def time_presymptom(self, days):
         self._time_presymptom = days
-        self.sigma = 1.0 / (5.2 - self._time_presymptom)
\ No newline at end of file
+        self.sigma = 1.0 / (self._incubation_period - self._time_presymptom)
\ No newline at end of file
@@ -3,29 +3,37 @@ This class contains the data for the country/state.
 Data such as population and actual reported data for the Virus
 Deaths, number of cases, etc.
 """
-import os
-import datetime
+import numpy as np
 import fetch_data
-USA = 'United States'
+import snapshot
+from instrumentation import NO_METRICS
+from region_index import RegionIndex, USA
 
 class CountryData(object):
     states_virus_url = 'https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-states.csv'
     us_url = 'https://raw.githubusercontent.com/nytimes/covid-19-data/master/us.csv'
     counties_url ='https://raw.githubusercontent.com/nytimes/covid-19-data/master/us-counties.csv'
     states_population_url = 'https://raw.githubusercontent.com/jakevdp/data-USstates/master/state-population.csv'
-    # Use a local copy just in case github is down
-    local_states = r'C:\Users\ngent\Documents\Coronavirus_Modeling\Data\covid-19-data\us-states.csv'
-    local_usa = r'C:\Users\ngent\Documents\Coronavirus_Modeling\Data\covid-19-data\us.csv'
     CSV_HEADER = ['name', 'date', 'cases', 'deaths']
 
-    def __init__(self, name='United States', county=False, update_data=False):
+    def __init__(self, name='United States', county=False, update_data=False, raw_data=None, cache=None, state=None,
+                 snapshot=None, metrics=None):
         self.name = name
         self.county = county
+        # State of a county, only needed if the county name exists in several states
+        self.state = state
+        # False: use any cached copy of the data, True: refresh it once it is older than the cache ttl
         self.update_data = update_data
+        self.cache = cache if cache is not None else fetch_data.download_cache
+        # Already loaded NYT data (us, states or counties file) as a RegionIndex, shared between many regions
+        self.raw_data = raw_data
+        # Binary snapshot folder to load the data from instead of the csv, see snapshot.py
+        self.snapshot = snapshot
+        # instrumentation.Metrics timing the download, csv parse and region filter stages
+        self.metrics = metrics if metrics is not None else NO_METRICS
         self.deaths = []
         self.cases = []
         self.dates = []
-        self.csv_data = []
         # Corona virus data
         self.get_reported_data()
         # Population
@@ -33,109 +41,93 @@ class CountryData(object):
 
     def get_reported_data(self):
         """
-        Get the recorded corona virus data from either a local copy or github.
+        Get the recorded corona virus data from either the download cache or github.
         Store the data in the appropriate class variables
         """
         # USA Country Data
         if self.name == USA:
-            if os.path.exists(self.local_usa) and not self.update_data:
-                data = fetch_data.fetch_us_data(self.local_usa)
-
-            else:
-                # Fetch corona virus data from github
-                data = fetch_data.fetch_us_data(self.us_url)
-            self.dates = [datetime.datetime.strptime(date, '%Y-%m-%d') for date in list(data.date)]
-            self.reported_cases = list(data.cases)
-            self.deaths = list(data.deaths)
-
+            url = self.us_url
         # States
         elif not self.county:
-            if os.path.exists(self.local_states) and not self.update_data:
-                raw_data = fetch_data.fetch_us_data(self.local_states)
-
-            else:
-                raw_data = fetch_data.fetch_us_data(self.states_virus_url)
-            # Remove unnecessary states, and set deaths, cases, etc
-            self.fix_raw_state_data(raw_data)
-
+            url = self.states_virus_url
         # Counties are weird, need special case to handle
         else:
-            raw_data = fetch_data.fetch_us_data(self.counties_url)
-            self.fix_raw_county_data(raw_data)
+            url = self.counties_url
+
+        metrics = self.metrics
+        if self.raw_data is not None:
+            raw_data = self.raw_data
+        elif self.snapshot is not None:
+            with metrics.stage('snapshot_load'):
+                raw_data = snapshot.load_snapshot(self.snapshot)
+        elif self.county:
+            # The counties file is big, stream it and keep only this county
+            with metrics.stage('download'):
+                path = self.cache.fetch(url, update=self.update_data)
+            region = self.name if self.state is None else (self.state, self.name)
+            with metrics.stage('csv_parse'):
+                raw_data = RegionIndex.from_csv_chunks(path, regions=[region])
+        else:
+            # Fetch corona virus data from github
+            with metrics.stage('download'):
+                self.cache.fetch(url, update=self.update_data)
+            with metrics.stage('csv_parse'):
+                raw_data = self.cache.read_index(url, update=False)
+
+        with metrics.stage('region_filter'):
+            if self.county:
+                self.fix_raw_county_data(raw_data)
+            else:
+                # Remove unnecessary states, and set deaths, cases, etc
+                self.fix_raw_state_data(raw_data)
 
     def fix_raw_state_data(self, raw_data):
         """
-        Parse the raw data, and remove states that don't match the "name"
-        we're looking for. Add data to appropriate class variables.
+        Look up the data of the state (or whole country) matching "name".
+        Add data to appropriate class variables.
         Create csv formatted data for writing output later
-        :param raw_data: Full csv delimited data of all states
+        :param raw_data: RegionIndex, or full csv data of all states as a pandas data frame
         :return:
         """
-        ret_deaths = list(raw_data.deaths)
-        ret_cases = list(raw_data.cases)
-        ret_dates = list(raw_data.date)
-        states = list(raw_data.state)
-
-        self.csv_data.append(self.CSV_HEADER)
-        # Start at end, remove unnecessary elements
-        for i in range(len(list(raw_data.state)) - 1, -1, -1):
-            if states[i] != self.name:
-                del ret_deaths[i]
-                del ret_cases[i]
-                del ret_dates[i]
-                del states[i]
-
-            else:
-                csv_row = []
-                csv_row.append(self.name)
-                csv_row.append(ret_dates[i])
-                csv_row.append(ret_cases[i])
-                csv_row.append(ret_deaths[i])
-
-                # Insertion after header to account for backwards indexing of the for loop
-                self.csv_data.insert(1, csv_row)
-                ret_dates[i] = datetime.datetime.strptime(ret_dates[i], '%Y-%m-%d')
-
-        self.deaths = ret_deaths
-        self.reported_cases = ret_cases
-        self.dates = ret_dates
+        if not isinstance(raw_data, RegionIndex):
+            raw_data = RegionIndex.from_frame(raw_data)
+        self.set_region_data(*raw_data.lookup(self.name))
 
     def fix_raw_county_data(self, raw_data):
-        ret_deaths = list(raw_data.deaths)
-        ret_cases = list(raw_data.cases)
-        ret_dates = list(raw_data.date)
-        states = list(raw_data.state)
-        counties = list(raw_data.county)
-
-        self.csv_data.append(self.CSV_HEADER)
-        # Start at end, remove unnecessary elements
-        for i in range(len(counties) - 1, -1, -1):
-            if counties[i] != self.name:
-                del ret_deaths[i]
-                del ret_cases[i]
-                del ret_dates[i]
-                del states[i]
-                del counties[i]
-
-            else:
-                csv_row = []
-                csv_row.append(self.name)
-                csv_row.append(ret_dates[i])
-                csv_row.append(ret_cases[i])
-                csv_row.append(ret_deaths[i])
+        """
+        Look up the data of the county matching "name" (and "state", county names aren't unique).
+        :param raw_data: RegionIndex, or full csv data of all counties as a pandas data frame
+        :return:
+        """
+        if not isinstance(raw_data, RegionIndex):
+            raw_data = RegionIndex.from_frame(raw_data)
+        self.set_region_data(*raw_data.lookup(self.name, state=self.state))
 
-                # Insertion after header to account for backwards indexing of the for loop
-                self.csv_data.insert(1, csv_row)
-                ret_dates[i] = datetime.datetime.strptime(ret_dates[i], '%Y-%m-%d')
+    def set_region_data(self, dates, cases, deaths):
+        """
+        Store the date sorted data of this region
+        :param dates: datetime64[D] array
+        :param cases: array of cumulative cases
+        :param deaths: array of cumulative deaths
+        """
+        self.dates = dates
+        self.reported_cases = cases
+        self.deaths = deaths
 
-        self.deaths = ret_deaths
-        self.reported_cases = ret_cases
-        self.dates = ret_dates
+    @property
+    def csv_data(self):
+        """
+        The region data as csv rows, header first. Built on demand, export.actual_table writes it in bulk
+        :return: list of lists
+        """
+        return [self.CSV_HEADER] + [[self.name, date, case, death] for date, case, death in
+                                    zip(np.datetime_as_string(self.dates).tolist(), self.reported_cases.tolist(),
+                                        self.deaths.tolist())]
 
     def get_population_data(self):
         """
         Get the population for a given "name"
         i.e. self.name = 'United States', 'California' etc.
-        :return: int of total population
+        :return: int of total population, raises UnknownRegionError for unknown regions
         """
-        return int(fetch_data.get_population(self.name))
+        return fetch_data.get_population(self.name, state=self.state, county=self.county, cache=self.cache)
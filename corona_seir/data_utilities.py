@@ -4,46 +4,86 @@ CACHETIMESECONDS = 3600 * 3  # be nice to the API to not get banned
 APIURL = 'https://coronavirus-tracker-api.herokuapp.com/all'
 FILENAME = 'covid-19_data.json'
 
-import datetime
 import numpy as np
-import scipy.ndimage.interpolation  # shift function
 import csv
+import postprocessing
+from constants import OFFSET_WINDOW
 
 
 def delay(npArray, days):
-    """shift to right, fill with 0, values fall off!"""
-    return scipy.ndimage.interpolation.shift(npArray, days, cval=0)
+    """shift to right, fill with 0, values fall off!
+    Shifts along the last axis. For batched (N, T) curves, days may be a scalar or one value per row"""
+    return postprocessing.fractional_delay(npArray, days)
 
 
-def get_offset_x(deaths, D_model, data_offset='auto'):
+def offset_errors(deaths, D_model, window=OFFSET_WINDOW):
     """
-    Leftover code, don't know wtf is going on here :)
-    All it does is best match the data and shift the days to best align with actual cases
-    :param deaths:
-    :param D_model:
-    :param data_offset:
-    :return:
+    Error of matching the data against the model for every offset 0 .. window - 1, in one pass.
+    For offset o the data is padded with o zero days in front and compared with the first len(deaths) + o
+    model days, the error is the rms of the log difference weighted by 1 / (1 + log model).
+    :param deaths: reported deaths, length L
+    :param D_model: model deaths, (T,) or batched (N, T)
+    :param window: number of offsets to try, limited to T - L + 1
+    :return: array of errors, (window,) or (N, window)
+    """
+    # log to emphasize lower values (relative error)   http://wrogn.com/curve-fitting-with-minimized-relative-error/
+    D_data = np.log(np.asarray(deaths, dtype='float64') + 1)
+    D_model = np.log(np.asarray(D_model, dtype='float64') + 1)
+    length = len(D_data)
+    window = max(min(window, D_model.shape[-1] - length + 1), 1)
+
+    weight = 1.0 / (1.0 + D_model)
+    squares = D_model * D_model * weight
+    # model days in front of the padded data: sum of squares[:o]
+    cumulated = np.cumsum(squares, axis=-1)
+    leading = np.concatenate((np.zeros(D_model.shape[:-1] + (1,)), cumulated[..., :window - 1]), axis=-1)
+    # model days under the data, expanded (d - m)^2 w = d^2 w - 2 d m w + m^2 w and summed per window
+    weights = np.lib.stride_tricks.sliding_window_view(weight, length, axis=-1)[..., :window, :]
+    weighted = np.lib.stride_tricks.sliding_window_view(D_model * weight, length, axis=-1)[..., :window, :]
+    overlap = (np.einsum('...wl,l->...w', weights, D_data * D_data)
+               - 2.0 * np.einsum('...wl,l->...w', weighted, D_data)
+               + cumulated[..., length - 1:length - 1 + window] - leading)
+    counts = length + np.arange(window)
+    return np.sqrt(np.maximum(leading + overlap, 0.0) / counts)
+
+
+def find_offset(deaths, D_model, window=OFFSET_WINDOW, refine=False):
+    """
+    Best offset of the data relative to the model, see offset_errors
+    :param deaths: reported deaths
+    :param D_model: model deaths, (T,) or batched (N, T)
+    :param window: number of offsets to try
+    :param refine: refine to a fraction of a day with a parabola through the best offset and its neighbours
+    :return: best offset (int, or float if refined; an array for batched models), errors for every offset
+    """
+    errors = offset_errors(deaths, D_model, window=window)
+    best = np.argmin(errors, axis=-1)
+    if refine:
+        at = lambda shift: np.take_along_axis(errors, np.clip(best + shift, 0, errors.shape[-1] - 1)[..., None],
+                                              axis=-1)[..., 0]
+        left, center, right = at(-1), at(0), at(1)
+        curvature = left - 2.0 * center + right
+        inner = (best > 0) & (best < errors.shape[-1] - 1) & (curvature > 0)
+        best = best + np.where(inner, 0.5 * (left - right) / np.where(inner, curvature, 1.0), 0.0)
+    if np.ndim(best) == 0:
+        best = best.item()
+    return best, errors
+
+
+def get_offset_x(deaths, D_model, data_offset='auto', window=OFFSET_WINDOW, verbose=False):
+    """
+    Best match the data and shift the days to best align with actual cases
+    :param deaths: reported deaths
+    :param D_model: model deaths
+    :param data_offset: 'auto', or a fixed offset in days which is returned as is
+    :param window: number of offsets to try
+    :param verbose: print the offset found
+    :return: offset in whole days
     """
-    x_days = list(range(len(deaths)))
-    X_days = np.array(x_days) - min(x_days)
     if data_offset == 'auto':
-        D_data = deaths
-
-        # log to emphasize lower values (relative error)   http://wrogn.com/curve-fitting-with-minimized-relative-error/
-        D_data = np.log(np.array(D_data, dtype='float64') + 1)
-        D_model = np.log(D_model + 1)
-
-        mini = 9e9
-        miniO = None
-        for o in range(0,150):  # todo: dat number...
-            oDd = np.pad(D_data, (o, 0))  # different than delay/shift, extends length
-            oDm = D_model[:len(D_data) + o]
-            rms = np.sqrt(np.mean(np.square((oDd - oDm))/(1 + oDm)))  # hacky but seems to do the job
-            if rms < mini:
-                mini = rms
-                miniO = o
-        print("date offset:", miniO)
-        data_offset = miniO
+        data_offset, errors = find_offset(deaths, D_model, window=window)
+        if verbose:
+            print("date offset:", data_offset)
     return data_offset
 
 
@@ -54,11 +94,9 @@ def model_to_world_time(num_days_to_shift, dates):
     :param dates:
     :return:
     """
-    shifted_dates = np.array(num_days_to_shift, dtype=np.dtype('M8[D]'))
-    for i, x in enumerate(num_days_to_shift):
-        shifted_dates[i] = min(dates) + datetime.timedelta(days=int(x))
-
-    return shifted_dates
+    # whole days, truncated like int()
+    days = np.asarray(num_days_to_shift).astype('int64').astype('timedelta64[D]')
+    return np.min(np.asarray(dates, dtype='datetime64[D]')) + days
 
 
 def write_to_csv_file(file_name, data):
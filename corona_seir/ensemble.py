@@ -0,0 +1,191 @@
+"""
+Monte Carlo uncertainty bands. Virus parameters (and optionally the lockdown) are drawn from distributions,
+solved in chunks with solve_batch and folded into per day histograms, so memory doesn't grow with the number
+of draws. Percentile bands are read from the histograms at the end.
+"""
+import numpy as np
+
+import seir_model
+from model_config import DEFAULT_CONFIG
+
+# Ranges from the sources in corona_virus.py: (numpy Generator method, arguments) or ('fixed', value)
+DEFAULT_DISTRIBUTIONS = {'fatality_rate': ('triangular', .001, .0036, .012),
+                         'generation_time': ('triangular', 3.5, 4.18, 5.0),
+                         'incubation_period': ('triangular', 4.5, 5.2, 6.0),
+                         'no_symptoms': ('uniform', 0.2, 0.5),
+                         'r0': ('uniform', 2.2, 2.7),
+                         'time_presymptom': ('triangular', 1.5, 2.5, 3.0),
+                         'find_factor': ('fixed', 10)}
+LOCKDOWN_PARAMETERS = ('quarantine_r1', 'lifted_q_r2', 'days0', 'days_q_lifted')
+# Allowed values of every draw, inclusive
+PARAMETER_RANGES = {'fatality_rate': (0.0, 1.0),
+                    'generation_time': (0.0, np.inf),
+                    'incubation_period': (0.0, np.inf),
+                    'no_symptoms': (0.0, 1.0),
+                    'r0': (0.0, np.inf),
+                    'time_presymptom': (0.0, np.inf),
+                    'find_factor': (1.0, np.inf),
+                    'quarantine_r1': (0.0, np.inf),
+                    'lifted_q_r2': (0.0, np.inf),
+                    'days0': (0.0, np.inf),
+                    'days_q_lifted': (0.0, np.inf)}
+# The delay parameters overlap: gamma = 1 / (2 * (generation_time - (incubation_period - time_presymptom))).
+# Draws where that difference is below MIN_INFECTIOUS_DAYS (gamma above 1 / day, or negative) are drawn again.
+DELAY_PARAMETERS = ('generation_time', 'incubation_period', 'time_presymptom')
+MIN_INFECTIOUS_DAYS = 0.5
+MAX_REDRAWS = 100
+PERCENTILES = (2.5, 25, 50, 75, 97.5)
+
+
+class StreamingQuantiles(object):
+    """
+    Histogram per day with log spaced bins, updated chunk by chunk. Memory is days x bins, whatever the
+    number of samples. Quantiles are accurate to about one bin width (max_value ** (1 / bins) relative).
+    """
+
+    def __init__(self, days, max_value=1e10, bins=2000):
+        # bin 0 holds values below 1, the last bin everything above max_value
+        self.edges = np.concatenate(([0.0], np.geomspace(1.0, max_value, bins)))
+        self.counts = np.zeros((days, len(self.edges) + 1), dtype='int64')
+        self.samples = 0
+
+    def update(self, values):
+        """
+        :param values: (n, days) array
+        """
+        values = np.atleast_2d(values)
+        bins = np.searchsorted(self.edges, values, side='right')
+        flat = (np.arange(values.shape[1]) * self.counts.shape[1] + bins).ravel()
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.counts.shape)
+        self.samples += values.shape[0]
+
+    def quantiles(self, percentiles=PERCENTILES):
+        """
+        :param percentiles: percentiles between 0 and 100
+        :return: (len(percentiles), days) array
+        """
+        cumulative = np.cumsum(self.counts, axis=1)
+        result = np.empty((len(percentiles), self.counts.shape[0]))
+        for row, percentile in enumerate(percentiles):
+            rank = percentile / 100.0 * self.samples
+            index = np.clip(np.argmax(cumulative >= max(rank, 1), axis=1), 1, len(self.edges) - 1)
+            low, high = self.edges[index - 1], self.edges[index]
+            below = np.take_along_axis(cumulative, (index - 1)[:, None], axis=1)[:, 0]
+            inside = np.maximum(self.counts[np.arange(len(index)), index], 1)
+            frac = np.clip((rank - below) / inside, 0.0, 1.0)
+            # geometric interpolation inside log bins, linear in the first bin that starts at 0
+            result[row] = np.where(low > 0, low * (high / np.where(low > 0, low, 1.0)) ** frac, high * frac)
+        return result
+
+
+def check_distributions(distributions):
+    """
+    Raise ValueError for unknown parameters or distributions
+    :param distributions: dict of parameter -> distribution, see DEFAULT_DISTRIBUTIONS
+    """
+    for name, distribution in distributions.items():
+        if name not in PARAMETER_RANGES:
+            raise ValueError("Unknown ensemble parameter {!r}, expected one of {}".format(
+                name, sorted(PARAMETER_RANGES)))
+        if not isinstance(distribution, (tuple, list)) or not distribution:
+            raise ValueError("Distribution of {} has to be a (kind, arguments...) tuple, got {!r}".format(
+                name, distribution))
+        kind = distribution[0]
+        if kind == 'fixed' and len(distribution) != 2:
+            raise ValueError("Fixed value of {} takes one argument, got {!r}".format(name, distribution))
+        if kind != 'fixed' and not callable(getattr(np.random.Generator, str(kind), None)):
+            raise ValueError("Unknown distribution {!r} for {}".format(kind, name))
+
+
+def _draw(distributions, names, n, rng):
+    draws = {}
+    for name in names:
+        kind, args = distributions[name][0], distributions[name][1:]
+        draws[name] = np.full(n, float(args[0])) if kind == 'fixed' else getattr(rng, kind)(*args, size=n)
+        low, high = PARAMETER_RANGES[name]
+        if not np.all((draws[name] >= low) & (draws[name] <= high)):
+            raise ValueError("Distribution {!r} of {} gives values outside [{}, {}]".format(
+                distributions[name], name, low, high))
+    return draws
+
+
+def _infectious_days(draws):
+    return draws['generation_time'] - (draws['incubation_period'] - draws['time_presymptom'])
+
+
+def sample_params(population, n, distributions=None, rng=None, config=DEFAULT_CONFIG):
+    """
+    Draw n rows of the solve_batch parameter array. The delay parameters of a row are drawn again until
+    incubation_period > time_presymptom and the infectious period is at least MIN_INFECTIOUS_DAYS.
+    :param population: Total population
+    :param n: number of draws
+    :param distributions: dict of parameter -> distribution, see DEFAULT_DISTRIBUTIONS. LOCKDOWN_PARAMETERS
+    may be added, they default to config
+    :param rng: numpy Generator
+    :param config: ModelConfig
+    :return: (n, len(BATCH_COLUMNS)) array
+    """
+    check_distributions(distributions or {})
+    distributions = dict(DEFAULT_DISTRIBUTIONS, **(distributions or {}))
+    rng = np.random.default_rng() if rng is None else rng
+    draws = _draw(distributions, list(DEFAULT_DISTRIBUTIONS) +
+                  [name for name in LOCKDOWN_PARAMETERS if name in distributions], n, rng)
+
+    for attempt in range(MAX_REDRAWS):
+        invalid = np.flatnonzero((draws['incubation_period'] <= draws['time_presymptom']) |
+                                 (_infectious_days(draws) < MIN_INFECTIOUS_DAYS))
+        if len(invalid) == 0:
+            break
+        for name, values in _draw(distributions, DELAY_PARAMETERS, len(invalid), rng).items():
+            draws[name][invalid] = values
+    else:
+        raise ValueError("The delay distributions rarely give an infectious period of at least {} days: {}".format(
+            MIN_INFECTIOUS_DAYS, {name: distributions[name] for name in DELAY_PARAMETERS}))
+
+    # same relations as CoronaVirus
+    sigma = 1.0 / (draws['incubation_period'] - draws['time_presymptom'])
+    gamma = 1.0 / (2.0 * (draws['generation_time'] - 1.0 / sigma))
+    columns = {'population': np.full(n, float(population)),
+               'r0': draws['r0'],
+               'sigma': sigma,
+               'gamma': gamma,
+               'fatality_rate': draws['fatality_rate'],
+               'find_ratio': (1.0 - draws['no_symptoms']) / draws['find_factor'],
+               'time_presymptom': draws['time_presymptom']}
+    for name in LOCKDOWN_PARAMETERS:
+        columns[name] = draws[name] if name in draws else np.full(n, float(getattr(config, name)))
+    return np.column_stack([columns[name] for name in seir_model.BATCH_COLUMNS])
+
+
+def run_ensemble(population, draws=10000, chunk_size=1000, distributions=None, percentiles=PERCENTILES, seed=None,
+                 config=DEFAULT_CONFIG, bins=2000):
+    """
+    Percentile bands of infected, reported cases and deaths
+    :param population: Total population
+    :param draws: number of parameter draws
+    :param chunk_size: draws solved per solve_batch call, bounds the memory use
+    :param distributions: see sample_params
+    :param percentiles: percentiles between 0 and 100
+    :param seed: random seed
+    :param config: ModelConfig
+    :param bins: histogram bins per day
+    :return: dict of 'infected', 'reported_cases', 'deaths' -> (len(percentiles), days) arrays, plus 'days'
+    and 'percentiles'
+    """
+    rng = np.random.default_rng(seed)
+    # reported cases add up find_ratio * infected every day, so they are only bounded by population * days
+    max_values = {'infected': population, 'reported_cases': population * config.days_total, 'deaths': population}
+    bands = {name: StreamingQuantiles(config.days_total, max_value=max_value, bins=bins)
+             for name, max_value in max_values.items()}
+    for start in range(0, draws, chunk_size):
+        params = sample_params(population, min(chunk_size, draws - start), distributions, rng, config)
+        days, susceptible, exposed, infected, recovered = seir_model.solve_batch(params, config=config)
+        batch = seir_model.VirusBatch(params)
+        bands['infected'].update(infected)
+        bands['reported_cases'].update(seir_model.calculate_reported_cases(infected, batch, config))
+        bands['deaths'].update(seir_model.calculate_deaths(days, recovered, batch, config))
+
+    results = {name: band.quantiles(percentiles) for name, band in bands.items()}
+    results['days'] = np.arange(config.days_total)
+    results['percentiles'] = np.array(percentiles)
+    return results
@@ -0,0 +1,104 @@
+"""
+Headless export of model and reported series. Tables are built column wise from the numpy arrays and written
+in one call as csv (optionally compressed), parquet or npz, one file per region or one combined file per batch.
+"""
+import os
+
+import numpy as np
+import pandas
+
+FORMATS = {'csv': 'csv', 'parquet': 'parquet', 'npz': 'npz'}
+# csv compression by file extension, as pandas infers it
+CSV_COMPRESSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.zip': 'zip', '.xz': 'xz'}
+ACTUAL_COLUMNS = ['name', 'date', 'cases', 'deaths']
+MODEL_COLUMNS = ['name', 'date', 'predicted cases', 'predicted deaths', 'r0 value', 'fatality rate']
+
+
+def infer_format(file_name):
+    """
+    :param file_name: i.e. 'run.csv', 'run.csv.gz', 'run.parquet', 'run.npz'
+    :return: key of FORMATS
+    """
+    root, extension = os.path.splitext(file_name)
+    if extension in CSV_COMPRESSIONS:
+        root, extension = os.path.splitext(root)
+    file_format = extension.lstrip('.')
+    if file_format not in FORMATS:
+        raise ValueError('unknown export format: {}'.format(file_name))
+    return file_format
+
+
+def file_extension(file_format, compression=None):
+    """
+    :return: extension for file_format, i.e. 'csv.gz' for gzip compressed csv
+    """
+    extension = FORMATS[file_format]
+    if file_format == 'csv' and compression is not None:
+        extension += {name: suffix for suffix, name in CSV_COMPRESSIONS.items()}[compression]
+    return extension
+
+
+def actual_table(country_data):
+    """
+    Reported data of one region, same columns as CountryData.csv_data
+    """
+    return pandas.DataFrame({'name': country_data.name,
+                             'date': np.asarray(country_data.dates, dtype='datetime64[D]'),
+                             'cases': country_data.reported_cases,
+                             'deaths': country_data.deaths}, columns=ACTUAL_COLUMNS)
+
+
+def model_table(name, dates, reported_cases, deaths, virus):
+    """
+    Model series of one region
+    :param name: region name
+    :param dates: datetime64 dates of the model days
+    :param reported_cases: model reported cases
+    :param deaths: model deaths
+    :param virus: Virus object, for the r0 and fatality rate columns
+    """
+    return pandas.DataFrame({'name': name,
+                             'date': np.asarray(dates, dtype='datetime64[D]'),
+                             'predicted cases': reported_cases,
+                             'predicted deaths': deaths,
+                             'r0 value': virus.r0,
+                             'fatality rate': virus.fatality_rate}, columns=MODEL_COLUMNS)
+
+
+def _npz_column(column):
+    # plain numpy dtypes only, so np.load works without allow_pickle
+    if pandas.api.types.is_datetime64_any_dtype(column):
+        return column.to_numpy().astype('datetime64[D]')
+    if pandas.api.types.is_numeric_dtype(column):
+        return column.to_numpy()
+    return column.to_numpy(dtype=str)
+
+
+def write_table(file_name, table, file_format=None, compression=None):
+    """
+    Write a table in one call
+    :param file_name: output file
+    :param table: pandas data frame
+    :param file_format: key of FORMATS, inferred from file_name if None
+    :param compression: csv: 'gzip', 'bz2', 'zip', 'xz' (inferred from the extension if None);
+    parquet: 'snappy', 'gzip', 'zstd'...; npz: anything true for savez_compressed
+    """
+    file_format = infer_format(file_name) if file_format is None else file_format
+    if file_format == 'csv':
+        table.to_csv(file_name, index=False, compression='infer' if compression is None else compression)
+    elif file_format == 'parquet':
+        # needs pyarrow or fastparquet
+        table.to_parquet(file_name, index=False, compression=compression or 'snappy')
+    elif file_format == 'npz':
+        columns = {name: _npz_column(table[name]) for name in table.columns}
+        (np.savez_compressed if compression else np.savez)(file_name, **columns)
+    else:
+        raise ValueError('unknown export format: {}'.format(file_format))
+
+
+def write_tables(file_name, tables, file_format=None, compression=None):
+    """
+    Write the tables of a batch run (one per region or scenario) as one combined file
+    :param tables: iterable of pandas data frames with the same columns
+    """
+    write_table(file_name, pandas.concat(tables, ignore_index=True), file_format, compression)
@@ -1,7 +1,21 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import urllib.error
 import urllib.request
 import pandas
 import data_utilities
-import csv
+from population_registry import COUNTY_FILE, POPULATION_FILE, POPULATION_KEY, get_registry, write_county_file
+from region_index import RegionIndex
+
+# Where downloaded csv files are kept, override with the CORONA_SEIR_CACHE environment variable
+CACHE_DIR = os.environ.get('CORONA_SEIR_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'corona_seir'))
+# Census county population estimates, the source of the compact county file
+COUNTY_CENSUS_URL = ('https://www2.census.gov/programs-surveys/popest/datasets/2010-2019/counties/totals/'
+                     'co-est2019-alldata.csv')
 
 class CSVFileReadError(IOError):
     pass
@@ -9,30 +23,217 @@ class CSVFileReadError(IOError):
 
 def fetch_us_data(file):
     """
-    Try to read csv data from file. Return pandas object
+    Read csv data from file, skipping malformed lines. Return pandas object
     file can be local path, or github address
     :param file:
-    :return:
+    :return: pandas data frame, raises CSVFileReadError if the file can't be read
     """
     try:
-        return pandas.read_csv(file, error_bad_lines=False)
-    except:
-        print("Can't load csv file, either github or local copy")
+        return pandas.read_csv(file, on_bad_lines='skip')
+    except (IOError, ValueError, pandas.errors.ParserError) as error:
+        raise CSVFileReadError("Can't load csv file {}: {}".format(file, error)) from error
 
 
-def get_population(name, file='nst-est2019-popchg2010_2019.csv', key='POPESTIMATE2019'):
+def _write_atomic(path, data):
+    """
+    Write bytes to path through a temporary file in the same folder, so readers never see a partial file
     """
-    Get population for USA, or a state based on 'name'.
-    Default file param should be saved in same working folder as code.
-    :param name:
+    handle, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp_')
+    try:
+        with os.fdopen(handle, 'wb') as tmp_file:
+            tmp_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class DownloadCache(object):
+    """
+    On disk cache for the csv downloads.
+    Files are refreshed at most every ttl seconds, with ETag/Last-Modified conditional requests so an unchanged
+    file costs one round trip. Parsed pandas frames and their region indexes are kept per process, so every
+    CountryData object built from the same file shares one copy. Don't modify those.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, ttl=data_utilities.CACHETIMESECONDS, timeout=60):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.timeout = timeout
+        self._frames = {}
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._index_lock = threading.Lock()
+
+    def path(self, url):
+        """
+        Local file for url, readable name plus a hash of the full url
+        """
+        digest = hashlib.sha1(url.encode('utf-8')).hexdigest()[:10]
+        return os.path.join(self.cache_dir, '{}_{}'.format(digest, os.path.basename(url)))
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, data_utilities.FILENAME)
+
+    def _read_index(self):
+        try:
+            with open(self._index_path(), mode='r') as index_file:
+                return json.load(index_file)
+        except (IOError, ValueError):
+            return {}
+
+    def _update_index(self, url, entry):
+        # concurrent downloads (see async_fetch) update the index one at a time
+        with self._index_lock:
+            index = self._read_index()
+            index[url] = entry
+            _write_atomic(self._index_path(), json.dumps(index, indent=1).encode('utf-8'))
+
+    def is_fresh(self, url):
+        path = self.path(url)
+        return os.path.exists(path) and time.time() - os.path.getmtime(path) < self.ttl
+
+    def fetch(self, url, update=True, fallback=True):
+        """
+        Get a local copy of url, downloading only when needed.
+        :param url: http(s) or file:// address
+        :param update: refresh the copy once it is older than ttl. If False any cached copy is used
+        :param fallback: use the cached copy if the download fails, else raise the download error
+        :return: path of the local copy
+        """
+        path = self.path(url)
+        if os.path.exists(path) and (not update or self.is_fresh(url)):
+            return path
+        try:
+            return self.download(url)
+        except (urllib.error.URLError, IOError) as error:
+            if not fallback:
+                raise
+            return self.use_cached(url, error)
+
+    def download(self, url):
+        """
+        Download url now, as a conditional request if there is a cached copy
+        :param url: http(s) or file:// address
+        :return: path of the local copy, raises urllib.error.URLError or IOError
+        """
+        path = self.path(url)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        headers = {}
+        entry = self._read_index().get(url, {})
+        if os.path.exists(path):
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=self.timeout) as response:
+                data = response.read()
+                entry = {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+        except urllib.error.HTTPError as error:
+            if error.code == 304:
+                os.utime(path)
+                return path
+            raise
+
+        _write_atomic(path, data)
+        self._update_index(url, entry)
+        return path
+
+    def use_cached(self, url, error):
+        """
+        Fall back to the cached copy of url after a failed download
+        :param url: http(s) or file:// address
+        :param error: the download error, reported with the fallback
+        :return: path of the cached copy, raises CSVFileReadError if there is none
+        """
+        path = self.path(url)
+        if os.path.exists(path):
+            print("Can't download {}, using cached copy: {}".format(url, error))
+            return path
+        raise CSVFileReadError("Can't download {} and no cached copy: {}".format(url, error))
+
+    def read_csv(self, url, update=True):
+        """
+        Parsed csv data for url, shared by everyone in this process until the file changes
+        :param url: http(s) or file:// address
+        :param update: see fetch
+        :return: pandas data frame
+        """
+        path = self.fetch(url, update=update)
+        # New downloads replace the file (new inode), 304 responses only touch it
+        stat = os.stat(path)
+        stamp = stat.st_dev, stat.st_ino, stat.st_size
+        with self._lock:
+            cached = self._frames.get(url)
+            if cached is None or cached[0] != stamp:
+                cached = stamp, fetch_us_data(path)
+                self._frames[url] = cached
+        return cached[1]
+
+    def read_index(self, url, update=True):
+        """
+        RegionIndex of the csv data for url, built once per parsed copy
+        :param url: http(s) or file:// address
+        :param update: see fetch
+        :return: RegionIndex
+        """
+        frame = self.read_csv(url, update=update)
+        with self._lock:
+            cached = self._indexes.get(url)
+            if cached is None or cached[0] is not frame:
+                cached = frame, RegionIndex.from_frame(frame)
+                self._indexes[url] = cached
+        return cached[1]
+
+
+# Cache shared by the whole process
+download_cache = DownloadCache()
+
+
+def fetch_county_file(url=None, file=None, cache=None, update=False):
+    """
+    Build the compact county population file from the census county estimates, downloaded through the cache
+    :param url: census co-est2019-alldata.csv address, COUNTY_CENSUS_URL if None
+    :param file: compact county file to write, COUNTY_FILE if None
+    :param cache: DownloadCache, the process cache if None
+    :param update: see DownloadCache.fetch
+    :return: path of the county file, raises CSVFileReadError if the census file can't be downloaded
+    """
+    url = COUNTY_CENSUS_URL if url is None else url
+    file = COUNTY_FILE if file is None else file
+    cache = download_cache if cache is None else cache
+    write_county_file(cache.fetch(url, update=update), file)
+    # registries loaded before the file existed have no counties
+    get_registry.cache_clear()
+    return file
+
+
+def get_population(name, file=POPULATION_FILE, key=POPULATION_KEY, state=None, county=False, cache=None):
+    """
+    Get population for USA, a census region, a state, or a county from the population registry, which reads the
+    files once per process. The county file is built from the census data on the first county lookup
+    :param name: region name, or (state, county)
+    :param file: state population file
+    :param key: population column
+    :param state: state of a county, only needed if the county name exists in several states
+    :param county: name is a county
+    :param cache: DownloadCache for the census county file, the process cache if None
+    :return: int population, raises UnknownRegionError for unknown names
+    """
+    registry = get_registry(file, COUNTY_FILE, key)
+    if not registry.has_counties and (county or state is not None or isinstance(name, tuple)):
+        fetch_county_file(file=COUNTY_FILE, cache=cache)
+        registry = get_registry(file, COUNTY_FILE, key)
+    return registry.population(name, state=state, county=county)
+
+
+def get_region_names(file=POPULATION_FILE, summary_level='40'):
+    """
+    Get all region names of one summary level from the population file.
+    Summary level '10' is the whole country, '20' census regions and '40' states (incl. DC and Puerto Rico)
     :param file:
-    :param key:
-    :return:
-    """
-    # CSV File Format: SUMLEV	REGION	DIVISION	STATE	NAME    POPESTIMATE2018 POPESTIMATE2019
-    with open(file, mode='r') as csv_file:
-        csv_reader = csv.DictReader(csv_file)
-        for row in csv_reader:
-            if row['NAME'] == name:
-                return row[key]
-    return 0
+    :param summary_level:
+    :return: list of names
+    """
+    return get_registry(file, COUNTY_FILE, POPULATION_KEY).region_names(summary_level)
@@ -0,0 +1,53 @@
+"""
+Client of forecast_server, standard library and numpy only so it imports fast.
+"""
+import io
+import json
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+HOST = '127.0.0.1'
+PORT = 8765
+
+
+class ForecastClient(object):
+
+    def __init__(self, host=HOST, port=PORT, timeout=30):
+        self.url = 'http://{}:{}'.format(host, port)
+        self.timeout = timeout
+
+    def forecast(self, region, params=None, schedule=None, state=None, binary=True):
+        """
+        :param region: region name
+        :param params: CoronaVirus keyword arguments
+        :param schedule: dict of quarantine_r1, lifted_q_r2, days0, days_q_lifted
+        :param state: state of a county
+        :param binary: transfer the arrays as npz instead of JSON
+        :return: dict of 'dates' (datetime64[D]), 'infected', 'reported_cases', 'deaths' arrays and 'data_offset'
+        """
+        request = {'region': region, 'state': state, 'params': params or {}, 'schedule': schedule or {},
+                   'format': 'npz' if binary else 'json'}
+        body = self._post('/forecast', json.dumps(request).encode('utf-8'))
+        if binary:
+            with np.load(io.BytesIO(body)) as arrays:
+                result = {name: arrays[name] for name in arrays.files}
+        else:
+            result = {name: np.array(value) for name, value in json.loads(body).items()}
+            result['dates'] = result['dates'].astype('datetime64[D]')
+        result['data_offset'] = result['data_offset'].item()
+        return result
+
+    def health(self):
+        with urllib.request.urlopen(self.url + '/health', timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def _post(self, path, body):
+        request = urllib.request.Request(self.url + path, data=body, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except urllib.error.HTTPError as error:
+            message = json.loads(error.read() or b'{}').get('error', error.reason)
+            raise ValueError('forecast failed ({}): {}'.format(error.code, message)) from None
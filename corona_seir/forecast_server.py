@@ -0,0 +1,319 @@
+"""
+Long lived forecast service. The region indexes, populations and default virus stay in memory, requests
+(region, params, schedule) -> curves are queued and the requests waiting together are solved as one batch with
+seir_model.solve_rows, the same integrator as run_model. Identical requests of one batch share a row, recently
+solved rows are reused.
+Run with: python forecast_server.py, query with forecast_client.ForecastClient.
+
+POST /forecast with a JSON body:
+    {"region": "Texas", "state": null, "params": {"r0": 2.4}, "schedule": {"days0": 70}, "format": "json"}
+params are CoronaVirus keyword arguments, schedule any of quarantine_r1, lifted_q_r2, days0, days_q_lifted.
+The answer holds dates, infected, reported_cases, deaths and data_offset, as JSON or as an npz file with
+"format": "npz". GET /health answers with the server statistics.
+"""
+import collections
+import concurrent.futures
+import http.server
+import io
+import json
+import math
+import numbers
+import queue
+import threading
+import time
+
+import numpy as np
+
+import data_utilities
+import fetch_data
+import scenario_runner
+import seir_model
+from corona_virus import CoronaVirus
+from model_config import DEFAULT_CONFIG
+from region_index import USA
+
+HOST = '127.0.0.1'
+PORT = 8765
+# Seconds a batch stays open for more requests once requests queue up, and its largest size
+BATCH_WINDOW = 0.005
+MAX_BATCH = 256
+# Solved curves kept in memory, about 9 kB each
+CACHED_CURVES = 1024
+SCHEDULE_PARAMS = ('quarantine_r1', 'lifted_q_r2', 'days0', 'days_q_lifted')
+FORMATS = ('json', 'npz')
+# Seconds a request waits for its batch before it is answered with 503
+TIMEOUT = 30.0
+
+
+class ForecastError(ValueError):
+    """
+    Bad request, answered with status 400 (404 for unknown regions, 503 when the batch doesn't finish in time)
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class ForecastService(object):
+
+    def __init__(self, raw_data=None, counties=False, update_data=False, config=DEFAULT_CONFIG,
+                 batch_window=BATCH_WINDOW, max_batch=MAX_BATCH, cached_curves=CACHED_CURVES):
+        """
+        :param raw_data: dict of 'us', 'states', 'counties' -> RegionIndex, loaded with
+        scenario_runner.load_data_sets if None
+        :param counties: also load the counties file
+        :param update_data: refresh the cached files first
+        :param config: ModelConfig of every forecast
+        :param batch_window: seconds a batch waits for more requests
+        :param max_batch: largest batch
+        :param cached_curves: solved parameter rows kept for repeated requests
+        """
+        if raw_data is None:
+            raw_data = scenario_runner.load_data_sets(['us', 'states', 'counties'] if counties else ['us', 'states'],
+                                                      update_data=update_data)
+        self.raw_data = raw_data
+        if counties and not fetch_data.get_registry(fetch_data.POPULATION_FILE, fetch_data.COUNTY_FILE,
+                                                    fetch_data.POPULATION_KEY).has_counties:
+            fetch_data.fetch_county_file()
+        self.registry = fetch_data.get_registry(fetch_data.POPULATION_FILE, fetch_data.COUNTY_FILE,
+                                                fetch_data.POPULATION_KEY)
+        self.default_virus = CoronaVirus()
+        self.config = config
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.cached_curves = cached_curves
+        # parameter row bytes -> infected, reported cases, deaths; only the batch thread touches it
+        self._curves = collections.OrderedDict()
+        self.requests = 0
+        self.batches = 0
+        self.rows = 0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='forecast-batcher', daemon=True)
+        self._worker.start()
+
+    def region_data(self, region, state=None):
+        """
+        :return: dates, cases, deaths and population of a region
+        """
+        counties = self.raw_data.get('counties')
+        if state is not None:
+            index = counties
+        elif region == USA:
+            index = self.raw_data.get('us')
+        else:
+            index = self.raw_data.get('states')
+            if index is None or region not in index:
+                index = counties
+        if index is None:
+            raise ForecastError('unknown region {} (counties loaded: {})'.format(region, counties is not None),
+                                status=404)
+        try:
+            dates, cases, deaths = index.lookup(region, state=state)
+            population = self.registry.population(region, state=state, county=index is counties)
+        except KeyError as error:
+            raise ForecastError(str(error), status=404) from None
+        return dates, cases, deaths, population
+
+    @staticmethod
+    def _numbers(request, name):
+        """
+        A dict of finite numbers from the request, empty if it isn't given
+        """
+        values = request.get(name) or {}
+        if not isinstance(values, dict):
+            raise ForecastError('{} has to be an object of name -> number'.format(name))
+        for key, value in values.items():
+            if isinstance(value, bool) or not isinstance(value, numbers.Real) or not math.isfinite(value):
+                raise ForecastError('{} {} has to be a finite number, got {!r}'.format(name, key, value))
+        return values
+
+    def _prepare(self, request):
+        """
+        Validate a request, return its row of the parameter array and its region data
+        """
+        if not isinstance(request, dict) or not isinstance(request.get('region'), str):
+            raise ForecastError('request needs a region name')
+        if request.get('state') is not None and not isinstance(request['state'], str):
+            raise ForecastError('state has to be a name')
+        if request.get('format', 'json') not in FORMATS:
+            raise ForecastError('format has to be one of {}'.format(', '.join(FORMATS)))
+        params = self._numbers(request, 'params')
+        schedule = self._numbers(request, 'schedule')
+        unknown = set(schedule) - set(SCHEDULE_PARAMS)
+        if unknown:
+            raise ForecastError('unknown schedule parameters: {}'.format(', '.join(sorted(unknown))))
+        try:
+            virus = CoronaVirus(**params) if params else self.default_virus
+        except TypeError as error:
+            raise ForecastError(str(error)) from None
+        except (ArithmeticError, ValueError):
+            # i.e. find_factor 0, or incubation_period equal to time_presymptom
+            raise ForecastError('params give no valid model: {}'.format(params)) from None
+        rates = (virus.sigma, virus.gamma, virus.beta, virus.find_ratio, virus.fatality_rate)
+        if not all(math.isfinite(rate) and rate >= 0 for rate in rates) or virus.gamma == 0:
+            raise ForecastError('params give negative or infinite rates: {}'.format(params))
+        dates, cases, deaths, population = self.region_data(request['region'], request.get('state'))
+        row = seir_model.batch_params(population, virus, config=self.config,
+                                      **{name: float(value) for name, value in schedule.items()})
+        return row, dates, deaths
+
+    def forecast(self, request, timeout=TIMEOUT):
+        """
+        Queue a request and wait for its batch
+        :param request: dict, see the module docstring
+        :param timeout: seconds to wait, ForecastError with status 503 after that
+        :return: dict of 'dates', 'infected', 'reported_cases', 'deaths' arrays and 'data_offset'
+        """
+        row, dates, deaths = self._prepare(request)
+        future = concurrent.futures.Future()
+        self._queue.put((row, dates, deaths, future))
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            # the batcher skips cancelled requests
+            future.cancel()
+            raise ForecastError('forecast timed out after {} s'.format(timeout), status=503) from None
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # an idle server answers at once, only under load the batch stays open to collect more requests
+            deadline = time.monotonic() + (self.batch_window if not self._queue.empty() else 0)
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._solve(batch)
+            except Exception as error:
+                for item in batch:
+                    if not item[3].done():
+                        item[3].set_exception(error)
+
+    def _solve(self, batch):
+        # identical parameter rows share one solve, rows solved earlier come from the curve cache
+        rows, positions = np.unique(np.vstack([item[0] for item in batch]), axis=0, return_inverse=True)
+        positions = positions.ravel()
+        keys = [row.tobytes() for row in rows]
+        missing = [k for k, key in enumerate(keys) if key not in self._curves]
+        if missing:
+            # one integrator for every batch size, so a request doesn't depend on what else was queued
+            days, susceptible, exposed, infected, recovered = seir_model.solve_rows(rows[missing], config=self.config)
+            virus = seir_model.VirusBatch(rows[missing])
+            reported_cases = seir_model.calculate_reported_cases(infected, virus, self.config)
+            predicted_deaths = seir_model.calculate_deaths(days, recovered, virus, self.config)
+            for j, k in enumerate(missing):
+                self._curves[keys[k]] = infected[j], reported_cases[j], predicted_deaths[j]
+        curves = []
+        for key in keys:
+            self._curves.move_to_end(key)
+            curves.append(self._curves[key])
+        while len(self._curves) > self.cached_curves:
+            self._curves.popitem(last=False)
+        days = np.arange(self.config.days_total)
+        self.requests += len(batch)
+        self.batches += 1
+        self.rows += len(missing)
+
+        for (row, dates, deaths, future), k in zip(batch, positions):
+            if future.done():
+                continue
+            infected, reported_cases, predicted_deaths = curves[k]
+            if self.config.data_offset == 'auto':
+                data_offset = data_utilities.find_offset(deaths, predicted_deaths, window=self.config.offset_window)[0]
+            else:
+                data_offset = self.config.data_offset
+            try:
+                future.set_result({'dates': data_utilities.model_to_world_time(days - data_offset, dates),
+                                   'infected': infected,
+                                   'reported_cases': reported_cases,
+                                   'deaths': predicted_deaths,
+                                   'data_offset': data_offset})
+            except concurrent.futures.InvalidStateError:
+                # cancelled by a timeout since the check above
+                pass
+
+    def statistics(self):
+        return {'requests': self.requests, 'batches': self.batches, 'solved_rows': self.rows,
+                'regions': {name: len(index) for name, index in self.raw_data.items()}}
+
+
+def encode(result, file_format='json'):
+    """
+    :return: body bytes and content type of a forecast result
+    """
+    if file_format == 'npz':
+        body = io.BytesIO()
+        np.savez(body, **{name: np.asarray(value) for name, value in result.items()})
+        return body.getvalue(), 'application/octet-stream'
+    values = {name: (np.datetime_as_string(value).tolist() if name == 'dates' else np.asarray(value).tolist())
+              for name, value in result.items()}
+    return json.dumps(values).encode('utf-8'), 'application/json'
+
+
+class ForecastHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out as two writes, with Nagle the body waits for the client's delayed ACK (~40 ms)
+    disable_nagle_algorithm = True
+
+    def _send(self, status, body, content_type='application/json'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status, message):
+        self._send(status, json.dumps({'error': message}).encode('utf-8'))
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send(200, json.dumps(self.server.service.statistics()).encode('utf-8'))
+        else:
+            self._send_error(404, 'unknown path {}'.format(self.path))
+
+    def do_POST(self):
+        if self.path != '/forecast':
+            self._send_error(404, 'unknown path {}'.format(self.path))
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            result = self.server.service.forecast(request)
+            self._send(200, *encode(result, request.get('format', 'json')))
+        except ForecastError as error:
+            self._send_error(error.status, str(error))
+        except ValueError as error:
+            self._send_error(400, str(error))
+        except Exception as error:
+            self._send_error(500, '{}: {}'.format(type(error).__name__, error))
+
+    def log_message(self, format, *args):
+        # one line per request is too much for dashboards polling the server
+        pass
+
+
+class ForecastServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+    # dashboards open many connections at once, the socketserver default backlog is 5
+    request_queue_size = 128
+
+    def __init__(self, address, service):
+        super().__init__(address, ForecastHandler)
+        self.service = service
+
+
+def make_server(service, host=HOST, port=PORT):
+    """
+    :param service: ForecastService
+    :return: ForecastServer, call serve_forever() on it
+    """
+    return ForecastServer((host, port), service)
+
+
+if __name__ == '__main__':
+    server = make_server(ForecastService(update_data=True))
+    print('forecast server on http://{}:{}'.format(*server.server_address))
+    server.serve_forever()
@@ -0,0 +1,210 @@
+"""
+Incremental daily ingest of a NYT data file.
+The files only grow at the end, so after the first full download a refresh asks for the bytes past what was
+already ingested with an HTTP Range request, starting TAIL_BYTES early. If that overlap no longer matches what
+was ingested the file was rewritten upstream (backfills, revisions): the file is downloaded once in full and
+only regions whose checksum changed are replaced, regions that are gone upstream are dropped. Appended rows dated on
+or before the last date of their region are treated the same way, and so are failed Range requests.
+The ingested data is kept as a snapshot (see snapshot.py), so CountryData(snapshot=store.snapshot_path) reads it.
+Only the download is incremental: the snapshot keeps the rows of a region together, and a daily update adds a row
+to nearly every region, so every refresh that changes something writes the whole snapshot again.
+"""
+import io
+import os
+import json
+import hashlib
+import urllib.error
+import urllib.request
+import numpy as np
+import pandas
+
+import fetch_data
+import snapshot
+from region_index import RegionIndex
+
+# Bytes before the end of the ingested data that are fetched again to check nothing changed upstream
+TAIL_BYTES = 4096
+STATE_FILE = 'ingest_state.json'
+
+
+def _key_name(key):
+    return '|'.join(key) if isinstance(key, tuple) else key
+
+
+def _lookup(index, key):
+    if isinstance(key, tuple):
+        return index.lookup(key[1], state=key[0])
+    return index.lookup(key)
+
+
+def region_checksum(dates, cases, deaths):
+    """
+    Checksum of the history of one region
+    :return: hex digest
+    """
+    digest = hashlib.sha1()
+    for array in (np.asarray(dates, dtype='datetime64[D]'), np.asarray(cases, dtype='int64'),
+                  np.asarray(deaths, dtype='int64')):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+
+def merge_regions(index, updates, append, removed=()):
+    """
+    New RegionIndex with some regions changed
+    :param index: RegionIndex, or None
+    :param updates: dict of region key -> (dates, cases, deaths)
+    :param append: True appends the rows to the region, False replaces the region
+    :param removed: region keys to drop
+    :return: RegionIndex
+    """
+    keys = [key for key in index.keys if key not in removed] if index is not None else []
+    keys += [key for key in updates if index is None or key not in index]
+    parts = []
+    for key in keys:
+        current = _lookup(index, key) if index is not None and key in index else None
+        if key not in updates:
+            parts.append(current)
+        elif append and current is not None:
+            parts.append(tuple(np.concatenate((old, new)) for old, new in zip(current, updates[key])))
+        else:
+            parts.append(updates[key])
+    counts = [len(part[0]) for part in parts]
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype('int64')
+    columns = [np.concatenate([part[j] for part in parts]) if parts else np.zeros(0) for j in range(3)]
+    return RegionIndex(keys, offsets, columns[0].astype('datetime64[D]'), columns[1].astype('int64'),
+                       columns[2].astype('int64'))
+
+
+def _regions(index):
+    """
+    :return: dict of region key -> (dates, cases, deaths)
+    """
+    return {key: (index.dates[start:stop], index.cases[start:stop], index.deaths[start:stop])
+            for key, start, stop in zip(index.keys, index.offsets[:-1], index.offsets[1:])}
+
+
+def _parse(data):
+    raw_data = pandas.read_csv(io.BytesIO(data))
+    raw_data['deaths'] = raw_data.deaths.fillna(0)
+    return RegionIndex.from_frame(raw_data)
+
+
+class IncrementalStore(object):
+
+    def __init__(self, store_dir, url, timeout=60):
+        """
+        :param store_dir: folder for the ingest state and the snapshot
+        :param url: address of us.csv, us-states.csv or us-counties.csv
+        :param timeout: seconds per request
+        """
+        self.store_dir = store_dir
+        self.url = url
+        self.timeout = timeout
+        self.snapshot_path = os.path.join(store_dir, 'snapshot')
+
+    def _state_path(self):
+        return os.path.join(self.store_dir, STATE_FILE)
+
+    def _read_state(self):
+        try:
+            with open(self._state_path(), mode='r') as state_file:
+                return json.load(state_file)
+        except (IOError, ValueError):
+            return None
+
+    def _save(self, index, state):
+        snapshot.write_snapshot(index, self.snapshot_path)
+        fetch_data._write_atomic(self._state_path(), json.dumps(state, indent=1).encode('utf-8'))
+
+    def _request(self, start=None):
+        headers = {} if start is None else {'Range': 'bytes={}-'.format(start)}
+        with urllib.request.urlopen(urllib.request.Request(self.url, headers=headers),
+                                    timeout=self.timeout) as response:
+            return response.getcode(), response.read()
+
+    @property
+    def index(self):
+        """
+        RegionIndex of everything ingested so far, memory mapped
+        """
+        return snapshot.load_snapshot(self.snapshot_path)
+
+    def refresh(self):
+        """
+        Bring the store up to date with the upstream file
+        :return: dict with 'mode' ('full', 'append', 'unchanged' or 'revised'), 'bytes' downloaded, the
+        'regions' that changed and the regions 'removed' upstream
+        """
+        state = self._read_state()
+        if state is None:
+            status, data = self._request()
+            return self._ingest_full(data, previous=None)
+
+        start = max(state['size'] - TAIL_BYTES, 0)
+        try:
+            status, data = self._request(start)
+        except urllib.error.HTTPError:
+            # i.e. 416 when the file got shorter than what was ingested
+            status, data = self._request()
+            return self._ingest_full(data, previous=state)
+        if status != 206:
+            # no range support, data is the whole file
+            return self._ingest_full(data, previous=state)
+        overlap, new_data = data[:state['size'] - start], data[state['size'] - start:]
+        if hashlib.sha1(overlap).hexdigest() != state['tail_hash']:
+            status, data = self._request()
+            return self._ingest_full(data, previous=state, downloaded=len(overlap) + len(new_data))
+
+        # only whole lines are ingested
+        new_data = new_data[:new_data.rfind(b'\n') + 1]
+        if not new_data:
+            return {'mode': 'unchanged', 'bytes': len(data), 'regions': [], 'removed': []}
+        appended = _regions(_parse(state['header'].encode('utf-8') + new_data))
+        last_dates = {name: np.datetime64(values['last_date'], 'D') for name, values in state['regions'].items()}
+        if any(_key_name(key) in last_dates and dates[0] <= last_dates[_key_name(key)]
+               for key, (dates, cases, deaths) in appended.items()):
+            # rows for days that were already ingested: a backfill
+            status, full_data = self._request()
+            return self._ingest_full(full_data, previous=state, downloaded=len(data))
+
+        index = merge_regions(self.index, appended, append=True)
+        state['size'] += len(new_data)
+        state['tail_hash'] = self._tail_hash(overlap + new_data, state['size'] - start)
+        self._update_regions(state, index, appended)
+        self._save(index, state)
+        return {'mode': 'append', 'bytes': len(data), 'regions': list(appended), 'removed': []}
+
+    @staticmethod
+    def _tail_hash(data, end):
+        return hashlib.sha1(data[max(end - TAIL_BYTES, 0):end]).hexdigest()
+
+    @staticmethod
+    def _update_regions(state, index, keys):
+        for key in keys:
+            dates, cases, deaths = _lookup(index, key)
+            state['regions'][_key_name(key)] = {'last_date': str(dates[-1]),
+                                                'checksum': region_checksum(dates, cases, deaths)}
+
+    def _ingest_full(self, data, previous, downloaded=0):
+        data = data[:data.rfind(b'\n') + 1]
+        upstream = _parse(data)
+        state = {'url': self.url, 'size': len(data), 'header': data[:data.find(b'\n') + 1].decode('utf-8'),
+                 'tail_hash': self._tail_hash(data, len(data)), 'regions': {}}
+        if previous is None:
+            self._update_regions(state, upstream, upstream.keys)
+            self._save(upstream, state)
+            return {'mode': 'full', 'bytes': len(data), 'regions': list(upstream.keys), 'removed': []}
+
+        # replace only the regions whose history changed, drop the ones that are gone upstream
+        regions = _regions(upstream)
+        changed = {key: values for key, values in regions.items()
+                   if previous['regions'].get(_key_name(key), {}).get('checksum') != region_checksum(*values)}
+        current = self.index
+        removed = [key for key in current.keys if key not in regions]
+        removed_names = set(_key_name(key) for key in removed)
+        state['regions'] = {name: values for name, values in previous['regions'].items() if name not in removed_names}
+        index = merge_regions(current, changed, append=False, removed=set(removed))
+        self._update_regions(state, index, changed)
+        self._save(index, state)
+        return {'mode': 'revised', 'bytes': downloaded + len(data), 'regions': list(changed), 'removed': removed}
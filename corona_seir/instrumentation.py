@@ -0,0 +1,149 @@
+"""
+Run metrics: wall time per stage (download, csv parse, region filter, ODE, offset search, export...),
+counters such as the odeint RHS evaluations and steps, and peak memory. Pass a Metrics object to CountryData
+and run_model to collect them, the default NO_METRICS does nothing.
+cProfile and tracemalloc are opt in, they slow the run down.
+"""
+import contextlib
+import cProfile
+import io
+import json
+import pstats
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Windows, no peak RSS
+    resource = None
+
+
+class Metrics(object):
+
+    enabled = True
+
+    def __init__(self, profile=False, trace_memory=False, stream=None):
+        """
+        :param profile: run cProfile inside the stages, see profile_stats
+        :param trace_memory: tracemalloc peak of every stage, in bytes
+        :param stream: text file for emit, one JSON object per line
+        """
+        self.stages = {}
+        self.counters = {}
+        self.memory = {}
+        self.stream = stream
+        self.trace_memory = trace_memory
+        self._profiler = cProfile.Profile() if profile else None
+        # peak memory of every open stage up to the last reset_peak, outermost first
+        self._peaks = []
+        self._started_tracing = False
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Time the body of a with block, times of repeated stages add up. Stages can be nested: the outer
+        stage includes the inner ones, the profiler runs from the outermost stage on.
+        :param name: stage name
+        """
+        outermost = not self._peaks
+        if self.trace_memory:
+            if outermost and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracing = True
+            if not outermost:
+                # the peak belongs to the enclosing stages so far, keep it before measuring this one
+                self._peaks[-1] = max(self._peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        self._peaks.append(0)
+        if outermost and self._profiler is not None:
+            self._profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+            peak = self._peaks.pop()
+            if outermost and self._profiler is not None:
+                self._profiler.disable()
+            if self.trace_memory:
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                self.memory[name] = max(self.memory.get(name, 0), peak)
+                if outermost:
+                    if self._started_tracing:
+                        tracemalloc.stop()
+                        self._started_tracing = False
+                else:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+                    tracemalloc.reset_peak()
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record_odeint(self, info):
+        """
+        Add the counters of an odeint full_output info dict
+        """
+        self.count('odeint_calls')
+        self.count('odeint_rhs_evaluations', int(info['nfe'][-1]))
+        self.count('odeint_steps', int(info['nst'][-1]))
+        self.count('odeint_jacobian_evaluations', int(info['nje'][-1]))
+
+    def as_dict(self):
+        """
+        :return: dict of 'stages' (seconds), 'counters', 'memory' (tracemalloc peak bytes per stage) and
+        'max_rss' (peak resident memory of the process, OS units: kB on Linux, bytes on macOS)
+        """
+        metrics = {'stages': dict(self.stages), 'counters': dict(self.counters), 'memory': dict(self.memory)}
+        if resource is not None:
+            metrics['max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return metrics
+
+    def json_line(self, **fields):
+        """
+        :param fields: extra fields, i.e. the region name
+        :return: metrics as one line of JSON
+        """
+        return json.dumps(dict(fields, **self.as_dict()), sort_keys=True)
+
+    def emit(self, **fields):
+        """
+        Write json_line to the stream, if there is one
+        """
+        if self.stream is not None:
+            self.stream.write(self.json_line(**fields) + '\n')
+            self.stream.flush()
+
+    def profile_stats(self, sort='cumulative', limit=30):
+        """
+        :return: cProfile report of the profiled stages, as text
+        """
+        if self._profiler is None:
+            return ''
+        text = io.StringIO()
+        pstats.Stats(self._profiler, stream=text).sort_stats(sort).print_stats(limit)
+        return text.getvalue()
+
+
+class _NoMetrics(object):
+    """
+    Metrics that are thrown away, every method is a no op
+    """
+
+    enabled = False
+    _null_stage = contextlib.nullcontext()
+
+    def stage(self, name):
+        return self._null_stage
+
+    def count(self, name, n=1):
+        pass
+
+    def record_odeint(self, info):
+        pass
+
+    def emit(self, **fields):
+        pass
+
+
+NO_METRICS = _NoMetrics()
@@ -0,0 +1,94 @@
+"""
+Time indexed R0 schedule for quarantine/lockdown measures.
+The R0 curve is computed once when the schedule is built, the ODE right hand side only looks values up by time.
+Nothing is mutated during a solve, so one schedule (and one CoronaVirus) can be shared between runs and threads.
+"""
+import numpy as np
+from constants import DAYS_TOTAL, QUARANTINE_R1, LIFTED_Q_R2, DAYS0, DAYS_Q_LIFTED, DELTA_R0
+from model_config import DEFAULT_CONFIG
+
+# Default resolution of the R0 tables, entries per day
+STEPS_PER_DAY = 24
+
+
+def reproduction(t, r0, quarantine_r1=QUARANTINE_R1, lifted_q_r2=LIFTED_Q_R2, days0=DAYS0,
+                 days_q_lifted=DAYS_Q_LIFTED, delta_r0=DELTA_R0):
+    """
+    R0 value at time t. R0 drops to quarantine_r1 once lockdown measures start, and once they are lifted
+    ramps by delta_r0 per day towards lifted_q_r2. All arguments broadcast, so this also evaluates
+    a whole batch of scenarios or a whole time grid at once.
+    :param t: Day(s) of evaluation
+    :param r0: Initial reproduction value
+    :param quarantine_r1: R0 value during the lockdown
+    :param lifted_q_r2: R0 value once the lockdown is lifted
+    :param days0: Day the lockdown starts
+    :param days_q_lifted: Day the lockdown ends
+    :param delta_r0: R0 increase per day after the lockdown ends
+    :return: numpy array of R0 values
+    """
+    ramp = quarantine_r1 + delta_r0 * (t - days_q_lifted)
+    lifted = np.where(np.less(quarantine_r1, lifted_q_r2), np.minimum(ramp, lifted_q_r2), lifted_q_r2)
+    return np.where(np.less(t, days0), r0, np.where(np.less(t, days_q_lifted), quarantine_r1, lifted))
+
+
+class InterventionSchedule(object):
+    """
+    Precomputed R0(t) table. Values are stored at steps_per_day points per day and looked up
+    by the step that contains t, so R0 only depends on t and not on how often the solver asks.
+    """
+
+    def __init__(self, r0_values, steps_per_day=1):
+        self._r0_values = np.array(r0_values, dtype='float64')
+        self._r0_values.flags.writeable = False
+        self._steps_per_day = steps_per_day
+
+    @classmethod
+    def lockdown(cls, r0, quarantine_r1=QUARANTINE_R1, lifted_q_r2=LIFTED_Q_R2, days0=DAYS0,
+                 days_q_lifted=DAYS_Q_LIFTED, delta_r0=DELTA_R0, days_total=DAYS_TOTAL, steps_per_day=STEPS_PER_DAY):
+        """
+        Schedule with a single lockdown, see reproduction()
+        :return: InterventionSchedule
+        """
+        t = np.arange(days_total * steps_per_day + 1) / steps_per_day
+        return cls(reproduction(t, r0, quarantine_r1, lifted_q_r2, days0, days_q_lifted, delta_r0), steps_per_day)
+
+    @classmethod
+    def from_config(cls, r0, config=DEFAULT_CONFIG, steps_per_day=STEPS_PER_DAY):
+        """
+        Schedule with the lockdown of a ModelConfig
+        :param r0: Initial reproduction value
+        :param config: ModelConfig
+        :return: InterventionSchedule
+        """
+        return cls.lockdown(r0, config.quarantine_r1, config.lifted_q_r2, config.days0, config.days_q_lifted,
+                            config.delta_r0, config.days_total, steps_per_day)
+
+    @classmethod
+    def piecewise(cls, days, values, days_total=DAYS_TOTAL, steps_per_day=STEPS_PER_DAY):
+        """
+        Piecewise constant schedule, values[k] applies from days[k] until days[k + 1].
+        Before days[0] the first value applies.
+        :param days: Increasing list of days at which R0 changes
+        :param values: R0 value for each entry in days
+        :return: InterventionSchedule
+        """
+        t = np.arange(days_total * steps_per_day + 1) / steps_per_day
+        index = np.clip(np.searchsorted(days, t, side='right') - 1, 0, len(values) - 1)
+        return cls(np.asarray(values, dtype='float64')[index], steps_per_day)
+
+    @property
+    def r0_values(self):
+        return self._r0_values
+
+    @property
+    def steps_per_day(self):
+        return self._steps_per_day
+
+    def r0_at(self, t):
+        """
+        Look up R0 at time t, clamped to the ends of the table
+        :param t: Day of evaluation
+        :return: float R0 value
+        """
+        index = int(t * self._steps_per_day)
+        return self._r0_values[min(max(index, 0), len(self._r0_values) - 1)]
@@ -0,0 +1,181 @@
+"""
+Metapopulation SEIR model: all 50 states + DC as one coupled system.
+State i is infected by the infectious people of state j through a row stochastic coupling matrix W,
+force of infection beta(t) * sum_j W[i, j] * I[j] / N[j]. With W the identity every state runs in isolation
+and the curves equal seir_model.solve. The coupling is sparse (states mostly mix with their census division),
+so the RHS is a sparse product. LSODA is the default solver; BDF/Radau get the Jacobian sparsity pattern.
+"""
+import numpy as np
+import pandas
+import scipy.integrate
+import scipy.sparse
+
+from intervention import InterventionSchedule
+from model_config import DEFAULT_CONFIG
+from population_registry import POPULATION_FILE, POPULATION_KEY
+from postprocessing import deaths_curve, deaths_lag, reported_cases_curve, reported_cases_lag
+
+COMPARTMENTS = ('S', 'E', 'I', 'R')
+# Share of contacts a state has outside itself, and of those the share outside its census division
+TRAVEL = 0.02
+REGION_SHARE = 0.25
+
+
+def load_states(file=POPULATION_FILE, key=POPULATION_KEY):
+    """
+    The 50 states + DC from the population file, in file order
+    :param file: population file
+    :param key: population column
+    :return: DataFrame with NAME, REGION, DIVISION and the population column
+    """
+    states = pandas.read_csv(file, usecols=['SUMLEV', 'REGION', 'DIVISION', 'NAME', key], dtype={'REGION': str,
+                                                                                               'DIVISION': str})
+    # Puerto Rico has summary level 40 but no census region
+    states = states[(states['SUMLEV'] == 40) & (states['REGION'] != 'X')]
+    return states.reset_index(drop=True)
+
+
+def division_coupling(populations, regions, divisions, travel=TRAVEL, region_share=REGION_SHARE):
+    """
+    Row stochastic coupling from census geography: a state keeps 1 - travel of its contacts at home and
+    spreads the rest over the other states of its division and (region_share of it) of the rest of its
+    region, by population. States in different regions don't mix.
+    :param populations: (n,) populations
+    :param regions: (n,) census region codes
+    :param divisions: (n,) census division codes
+    :param travel: share of contacts outside the home state
+    :param region_share: share of the travel that leaves the division
+    :return: (n, n) scipy.sparse.csr_matrix
+    """
+    populations = np.asarray(populations, dtype='float64')
+    regions = np.asarray(regions)
+    divisions = np.asarray(divisions)
+    others = ~np.eye(len(populations), dtype=bool)
+    same_division = (divisions[:, np.newaxis] == divisions[np.newaxis, :]) & others
+    rest_of_region = (regions[:, np.newaxis] == regions[np.newaxis, :]) & ~same_division & others
+
+    def spread(mask, share):
+        weights = mask * populations[np.newaxis, :]
+        totals = weights.sum(axis=1, keepdims=True)
+        return np.divide(weights * share, totals, out=np.zeros_like(weights), where=totals > 0)
+
+    has_rest = rest_of_region.any(axis=1, keepdims=True)
+    division_share = travel * np.where(has_rest, 1.0 - region_share, 1.0)
+    coupling = spread(same_division, division_share) + spread(rest_of_region, travel * region_share)
+    coupling[~others] = 1.0 - coupling.sum(axis=1)
+    return scipy.sparse.csr_matrix(coupling)
+
+
+class MetapopulationModel(object):
+
+    def __init__(self, populations, coupling, virus, schedule=None, config=DEFAULT_CONFIG, names=None):
+        """
+        :param populations: (n,) population of each state
+        :param coupling: (n, n) row stochastic coupling, dense or scipy.sparse
+        :param virus: Virus object
+        :param schedule: InterventionSchedule shared by all states, defaults to the lockdown of config
+        :param config: ModelConfig
+        :param names: optional state names, kept for the output
+        """
+        self.populations = np.asarray(populations, dtype='float64')
+        self.n = len(self.populations)
+        self.coupling = scipy.sparse.csr_matrix(coupling)
+        # infections of state i per susceptible = beta * (mixing @ I)[i]
+        self._mixing = scipy.sparse.csr_matrix(self.coupling.multiply(1.0 / self.populations[np.newaxis, :]))
+        self.virus = virus
+        self.schedule = schedule if schedule is not None else InterventionSchedule.from_config(virus.r0, config)
+        self.config = config
+        self.names = names
+
+    @classmethod
+    def united_states(cls, virus, coupling=None, file=POPULATION_FILE, key=POPULATION_KEY, **kwargs):
+        """
+        All 50 states + DC, coupled by division_coupling unless a coupling is given
+        :param key: population column of the population file
+        """
+        states = load_states(file, key)
+        populations = states[key].to_numpy(dtype='float64')
+        if coupling is None:
+            coupling = division_coupling(populations, states['REGION'], states['DIVISION'])
+        return cls(populations, coupling, virus, names=list(states['NAME']), **kwargs)
+
+    def rhs(self, t, y):
+        """
+        :param t: day
+        :param y: flat state, compartment major: y[c * n:(c + 1) * n] is compartment c
+        :return: flat derivative
+        """
+        s, e, i, r = y.reshape(len(COMPARTMENTS), self.n)
+        infections = self.schedule.r0_at(t) * self.virus.gamma * s * (self._mixing @ i)
+        exposed_out = self.virus.sigma * e
+        infected_out = self.virus.gamma * i
+        return np.concatenate((-infections, infections - exposed_out, exposed_out - infected_out, infected_out))
+
+    def jacobian_sparsity(self):
+        """
+        Non zero pattern of the Jacobian: S and E of state i depend on S[i], E[i] and I of the states coupled to i
+        """
+        identity = scipy.sparse.identity(self.n, format='csr')
+        pattern = (self._mixing != 0).astype('int8') + identity
+        zero = scipy.sparse.csr_matrix((self.n, self.n), dtype='int8')
+        return scipy.sparse.bmat([[identity, zero, pattern, zero],
+                                  [identity, identity, pattern, zero],
+                                  [zero, identity, identity, zero],
+                                  [zero, zero, identity, zero]], format='csr')
+
+    def jacobian(self, t, y):
+        """
+        Analytic sparse Jacobian of rhs
+        """
+        s, e, i, r = y.reshape(len(COMPARTMENTS), self.n)
+        beta = self.schedule.r0_at(t) * self.virus.gamma
+        force = scipy.sparse.diags(beta * (self._mixing @ i))
+        by_infected = scipy.sparse.diags(beta * s) @ self._mixing
+        sigma = scipy.sparse.identity(self.n) * self.virus.sigma
+        gamma = scipy.sparse.identity(self.n) * self.virus.gamma
+        # explicit zero block, the R column is empty
+        zero = scipy.sparse.csr_matrix((self.n, self.n))
+        return scipy.sparse.bmat([[-force, None, -by_infected, zero],
+                                  [force, -sigma, by_infected, None],
+                                  [None, sigma, -gamma, None],
+                                  [None, None, gamma, None]], format='csc')
+
+    def solve(self, init_infected=None, method='LSODA', analytic_jacobian=False, rtol=1e-6, atol=1e-3):
+        """
+        :param init_infected: exposed people at the start, scalar for every state or one per state.
+        Defaults to config.init_infected
+        :param method: solve_ivp method. LSODA takes about 0.05 s for the 51 states, BDF about 0.2 s. BDF and Radau
+        get the Jacobian sparsity pattern, which may pay off for stiffer or larger systems such as counties
+        :param analytic_jacobian: pass jacobian() (to LSODA, BDF or Radau) instead of only its sparsity pattern
+        :param rtol: relative tolerance
+        :param atol: absolute tolerance, in people
+        :return: days, dict of compartment name -> (n, days_total) array
+        """
+        init_infected = self.config.init_infected if init_infected is None else init_infected
+        y0 = np.zeros((len(COMPARTMENTS), self.n))
+        y0[1] = init_infected
+        y0[0] = self.populations - y0[1]
+
+        days = np.arange(self.config.days_total)
+        options = {}
+        if analytic_jacobian and method in ('LSODA', 'BDF', 'Radau'):
+            options['jac'] = self.jacobian
+        elif method in ('BDF', 'Radau'):
+            options['jac_sparsity'] = self.jacobian_sparsity()
+        solution = scipy.integrate.solve_ivp(self.rhs, (days[0], days[-1]), y0.ravel(), method=method,
+                                             t_eval=days, rtol=rtol, atol=atol, **options)
+        if not solution.success:
+            raise RuntimeError('metapopulation solve failed: {}'.format(solution.message))
+        compartments = solution.y.reshape(len(COMPARTMENTS), self.n, len(days))
+        return days, dict(zip(COMPARTMENTS, compartments))
+
+    def deaths_and_cases(self, compartments):
+        """
+        Deaths and reported cases of every state, same postprocessing as run_model
+        :param compartments: dict from solve
+        :return: deaths, reported_cases as (n, days_total) arrays
+        """
+        deaths = deaths_curve(compartments['R'], self.virus.fatality_rate, deaths_lag(self.virus, self.config))
+        cases = reported_cases_curve(compartments['I'], self.virus.find_ratio,
+                                     reported_cases_lag(self.virus, self.config))
+        return deaths, cases
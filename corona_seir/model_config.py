@@ -0,0 +1,67 @@
+"""
+Immutable set of model settings. Defaults come from constants.py, so ModelConfig() is the model as configured there.
+Configs are hashable and compare by value, so they can be part of a cache key, and pickle as a plain tuple.
+"""
+from constants import DAYS_TOTAL, INIT_INFECTED, QUARANTINE_R1, LIFTED_Q_R2, DAYS0, DAYS_Q_LIFTED, DELTA_R0, \
+    DATA_OFFSET, OFFSET_WINDOW, TIME_IN_HOSPITAL, COMMUNICATION_LAG, TEST_LAG, SYMPTOM_HOSPITAL_LAG, HOSPITAL_ICU_LAG, \
+    SOLVER
+
+
+class ModelConfig(object):
+    __slots__ = ('days_total', 'init_infected', 'quarantine_r1', 'lifted_q_r2', 'days0', 'days_q_lifted', 'delta_r0',
+                 'data_offset', 'offset_window', 'time_in_hospital', 'communication_lag', 'test_lag',
+                 'symptom_hospital_lag', 'hospital_icu_lag', 'solver')
+
+    def __init__(self, days_total=DAYS_TOTAL, init_infected=INIT_INFECTED, quarantine_r1=QUARANTINE_R1,
+                 lifted_q_r2=LIFTED_Q_R2, days0=DAYS0, days_q_lifted=DAYS_Q_LIFTED, delta_r0=DELTA_R0,
+                 data_offset=DATA_OFFSET, offset_window=OFFSET_WINDOW, time_in_hospital=TIME_IN_HOSPITAL,
+                 communication_lag=COMMUNICATION_LAG, test_lag=TEST_LAG, symptom_hospital_lag=SYMPTOM_HOSPITAL_LAG,
+                 hospital_icu_lag=HOSPITAL_ICU_LAG, solver=SOLVER):
+        values = (days_total, init_infected, quarantine_r1, lifted_q_r2, days0, days_q_lifted, delta_r0, data_offset,
+                  offset_window, time_in_hospital, communication_lag, test_lag, symptom_hospital_lag, hospital_icu_lag,
+                  solver)
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ModelConfig is immutable, use replace() to change {}".format(name))
+
+    def __delattr__(self, name):
+        raise AttributeError("ModelConfig is immutable")
+
+    def astuple(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def asdict(self):
+        return dict(zip(self.__slots__, self.astuple()))
+
+    def replace(self, **changes):
+        """
+        Copy of this config with some values changed
+        :param changes: new values by name
+        :return: ModelConfig
+        """
+        values = self.asdict()
+        unknown = set(changes) - set(values)
+        if unknown:
+            raise TypeError("Unknown ModelConfig values: {}".format(sorted(unknown)))
+        values.update(changes)
+        return ModelConfig(**values)
+
+    def __eq__(self, other):
+        return isinstance(other, ModelConfig) and self.astuple() == other.astuple()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.astuple())
+
+    def __reduce__(self):
+        return ModelConfig, self.astuple()
+
+    def __repr__(self):
+        return 'ModelConfig({})'.format(', '.join('{}={!r}'.format(name, value) for name, value in self.asdict().items()))
+
+
+DEFAULT_CONFIG = ModelConfig()
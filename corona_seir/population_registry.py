@@ -0,0 +1,167 @@
+"""
+Population of the country, census regions, states and counties, loaded once per process.
+Regions are looked up by name (counties by (state, county) like RegionIndex keys) or by FIPS code.
+State data comes from nst-est2019-popchg2010_2019.csv next to this file. County data comes from a compact
+csv with the columns fips, state, county, population (see write_county_file), used if present;
+fetch_data.get_population builds it from the census county estimates on the first county lookup.
+"""
+import functools
+import os
+import tempfile
+
+import numpy as np
+import pandas
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+POPULATION_FILE = os.path.join(DATA_DIR, 'nst-est2019-popchg2010_2019.csv')
+COUNTY_FILE = os.path.join(DATA_DIR, 'co-est2019-pop.csv')
+POPULATION_KEY = 'POPESTIMATE2019'
+# Census county name suffixes that the NYT data leaves out
+COUNTY_SUFFIXES = (' County', ' Parish', ' Borough', ' Census Area', ' City and Borough', ' Municipality')
+
+
+class UnknownRegionError(KeyError):
+    pass
+
+
+class PopulationRegistry(object):
+
+    def __init__(self, frame, counties=None):
+        """
+        :param frame: state level data frame with SUMLEV, STATE, NAME and population columns
+        :param counties: county data frame with fips, state, county, population columns, or None
+        """
+        self.names = list(frame['NAME'])
+        self._levels = dict(zip(frame['NAME'], frame['SUMLEV'].astype(str)))
+        self._populations = dict(zip(frame['NAME'], frame['population'].astype('int64').tolist()))
+        # FIPS codes of the states (summary level 40), counties use 5 digit state * 1000 + county codes
+        states = frame[frame['SUMLEV'] == 40]
+        self._fips = dict(zip(states['STATE'].astype('int64').tolist(), states['population'].astype('int64').tolist()))
+        self._counties = {}
+        self._county_states = {}
+        if counties is not None:
+            for fips, state, county, population in zip(counties['fips'].tolist(), counties['state'],
+                                                       counties['county'], counties['population'].tolist()):
+                self._counties[(state, county)] = population
+                self._county_states.setdefault(county, []).append(state)
+                self._fips[fips] = population
+
+    @classmethod
+    def load(cls, file=POPULATION_FILE, county_file=COUNTY_FILE, key=POPULATION_KEY):
+        """
+        :param file: state population file
+        :param county_file: compact county file, skipped if it doesn't exist
+        :param key: population column of the state file
+        :return: PopulationRegistry
+        """
+        frame = pandas.read_csv(file, usecols=['SUMLEV', 'STATE', 'NAME', key], encoding='latin-1')
+        frame = frame.rename(columns={key: 'population'})
+        counties = None
+        if county_file is not None and os.path.exists(county_file):
+            counties = pandas.read_csv(county_file, dtype={'fips': 'int64', 'population': 'int64'},
+                                       keep_default_na=False)
+        return cls(frame, counties)
+
+    def __contains__(self, name):
+        return name in self._populations or name in self._counties
+
+    @property
+    def has_counties(self):
+        return bool(self._counties)
+
+    def region_names(self, summary_level='40'):
+        """
+        :param summary_level: '10' the country, '20' census regions, '40' states (incl. DC and Puerto Rico)
+        :return: list of names in file order
+        """
+        return [name for name in self.names if self._levels[name] == summary_level]
+
+    def population(self, name, state=None, county=False):
+        """
+        :param name: country, region or state name, county name, or a (state, county) tuple
+        :param state: state of a county, only needed if the county name exists in several states
+        :param county: name is a county (implied by a state or a tuple)
+        :return: int population
+        """
+        if isinstance(name, tuple):
+            state, name = name
+        if state is None and not county:
+            try:
+                return self._populations[name]
+            except KeyError:
+                raise UnknownRegionError('no population for {}'.format(name)) from None
+        if state is None:
+            states = self._county_states.get(name, [])
+            if len(states) > 1:
+                raise UnknownRegionError('county {} exists in several states, give the state: {}'.format(
+                    name, ', '.join(sorted(states))))
+            state = states[0] if states else None
+        try:
+            return self._counties[(state, name)]
+        except KeyError:
+            hint = '' if self.has_counties else (' (county populations come from {}, build it from the census '
+                                                 'co-est2019-alldata.csv with write_county_file or '
+                                                 'fetch_data.fetch_county_file)'.format(COUNTY_FILE))
+            raise UnknownRegionError('no population for county {}{}'.format(
+                name if state is None else (state, name), hint)) from None
+
+    def by_fips(self, fips):
+        """
+        :param fips: state or 5 digit county FIPS code
+        :return: int population
+        """
+        try:
+            return self._fips[int(fips)]
+        except KeyError:
+            raise UnknownRegionError('no population for FIPS {}'.format(fips)) from None
+
+    def populations(self, regions):
+        """
+        Bulk lookup
+        :param regions: names or (state, county) tuples
+        :return: int64 array
+        """
+        return np.array([self.population(region) for region in regions], dtype='int64')
+
+
+@functools.lru_cache(maxsize=None)
+def get_registry(file=POPULATION_FILE, county_file=COUNTY_FILE, key=POPULATION_KEY):
+    """
+    Registry of the process, loaded on first use
+    """
+    return PopulationRegistry.load(file, county_file, key)
+
+
+def county_name(census_name):
+    """
+    :param census_name: i.e. 'Autauga County'
+    :return: NYT style name, i.e. 'Autauga'
+    """
+    for suffix in COUNTY_SUFFIXES:
+        if census_name.endswith(suffix):
+            return census_name[:-len(suffix)]
+    return census_name
+
+
+def write_county_file(census_file, file=COUNTY_FILE, key=POPULATION_KEY):
+    """
+    Build the compact county file from the census county estimates (co-est2019-alldata.csv)
+    :param census_file: census csv with SUMLEV, STATE, COUNTY, STNAME, CTYNAME and population columns
+    :param file: compact county file to write
+    :param key: population column
+    """
+    census = pandas.read_csv(census_file, usecols=['SUMLEV', 'STATE', 'COUNTY', 'STNAME', 'CTYNAME', key],
+                             encoding='latin-1')
+    census = census[census['SUMLEV'] == 50]
+    # written next to the final name and moved in place, parallel workers never read a partial file
+    handle, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(file)), prefix='.tmp_', suffix='.csv')
+    os.close(handle)
+    try:
+        pandas.DataFrame({'fips': census['STATE'] * 1000 + census['COUNTY'],
+                          'state': census['STNAME'],
+                          'county': census['CTYNAME'].map(county_name),
+                          'population': census[key]}).to_csv(tmp_file, index=False)
+        os.replace(tmp_file, file)
+    except BaseException:
+        os.remove(tmp_file)
+        raise
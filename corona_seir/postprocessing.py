@@ -0,0 +1,97 @@
+"""
+Turn model compartments into the curves that are compared with reported data: cumulative deaths
+and cumulative reported cases, delayed by the lags between infection and the official numbers.
+Everything works on the last axis, so a single (DAYS_TOTAL,) curve and a batch of (N, DAYS_TOTAL) curves
+go through the same code. All results are float64.
+"""
+import numpy as np
+from model_config import DEFAULT_CONFIG
+
+
+def fractional_delay(curves, days):
+    """
+    Shift curves to the right by a possibly fractional number of days, linear interpolation between days.
+    Fill with 0 on the left, values fall off on the right.
+    :param curves: (T,) or (N, T) array
+    :param days: scalar, or one value per row for (N, T) curves
+    :return: float64 array, same shape as curves
+    """
+    curves = np.asarray(curves, dtype='float64')
+    days = np.asarray(days, dtype='float64')
+    length = curves.shape[-1]
+    if days.size == 1:
+        # same shift for every row, index the last axis with one set of positions
+        source = np.arange(length) - float(days.reshape(-1)[0])
+    else:
+        source = np.arange(length) - days.reshape(-1, 1)
+    lower = np.floor(source).astype('int64')
+    frac = source - lower
+
+    def take(index):
+        inside = (index >= 0) & (index < length)
+        index = np.clip(index, 0, length - 1)
+        values = curves[..., index] if index.ndim == 1 else np.take_along_axis(curves, index, axis=-1)
+        return np.where(inside, values, 0.0)
+
+    return (1.0 - frac) * take(lower) + frac * take(lower + 1)
+
+
+def fractional_delay_slope(curves, days):
+    """
+    Derivative of fractional_delay(curves, days) with respect to days: minus the slope of the curve
+    between the two days each value is interpolated from
+    :param curves: (T,) or (N, T) array
+    :param days: scalar, or one value per row for (N, T) curves
+    :return: float64 array, same shape as curves
+    """
+    # step from day j - 1 to day j (0 before the curve starts), moved by whole days like the curve;
+    # at whole day shifts this is the derivative for growing days
+    steps = np.diff(np.asarray(curves, dtype='float64'), axis=-1, prepend=0.0)
+    return -fractional_delay(steps, np.floor(np.asarray(days, dtype='float64')))
+
+
+def deaths_lag(virus, config=DEFAULT_CONFIG):
+    """
+    Days from "recovered" (infectious period over) to reported death
+    :param virus: Virus object or VirusBatch
+    :param config: ModelConfig with the lags
+    :return: lag in days, scalar or (N, 1)
+    """
+    time_infected = 1.0 / virus.gamma
+    return (- time_infected + virus.time_presymptom + config.symptom_hospital_lag + config.time_in_hospital +
+            config.communication_lag)
+
+
+def reported_cases_lag(virus, config=DEFAULT_CONFIG):
+    """
+    Days from infectious to found in tests and officially announced
+    :param virus: Virus object or VirusBatch
+    :param config: ModelConfig with the lags
+    :return: lag in days, scalar or (N, 1)
+    """
+    return virus.time_presymptom + config.symptom_hospital_lag + config.test_lag + config.communication_lag
+
+
+def deaths_curve(recovered, fatality_rate, lag):
+    """
+    Cumulative deaths: every day fatality_rate of the newly "recovered" die, reported lag days later
+    :param recovered: (T,) or (N, T) array of the R compartment
+    :param fatality_rate: infection fatality rate, scalar or (N, 1)
+    :param lag: delay in days, scalar or one per row
+    :return: float64 array, same shape as recovered
+    """
+    recovered = np.asarray(recovered, dtype='float64')
+    deaths = np.cumsum(fatality_rate * np.diff(recovered, axis=-1, prepend=0.0), axis=-1)
+    return fractional_delay(deaths, lag)
+
+
+def reported_cases_curve(infected, find_ratio, lag):
+    """
+    Cumulative reported cases: find_ratio of the infected are found, lag days later
+    :param infected: (T,) or (N, T) array of the I compartment
+    :param find_ratio: share of infected that are found, scalar or (N, 1)
+    :param lag: delay in days, scalar or one per row
+    :return: float64 array, same shape as infected
+    """
+    found = fractional_delay(np.asarray(infected, dtype='float64') * find_ratio, lag)
+    return np.cumsum(found, axis=-1)
@@ -0,0 +1,140 @@
+"""
+Grouped index over the NYT data files.
+Rows are sorted once by region and date into contiguous numpy arrays, so the data of one state or county
+is a slice instead of a scan over the whole file.
+"""
+import numpy as np
+import pandas
+
+USA = 'United States'
+# Rows parsed at a time by from_csv_chunks
+CHUNK_ROWS = 200000
+
+
+class RegionIndex(object):
+    """
+    Region keys are the state name for the states file, (state, county) for the counties file
+    and 'United States' for the country totals file.
+    """
+
+    def __init__(self, keys, offsets, dates, cases, deaths):
+        """
+        :param keys: list of region keys, in storage order
+        :param offsets: len(keys) + 1 row offsets, region k is rows offsets[k]:offsets[k + 1]
+        :param dates: datetime64[D] array
+        :param cases: int64 array of cumulative cases
+        :param deaths: int64 array of cumulative deaths
+        """
+        self.keys = keys
+        self.offsets = offsets
+        self.dates = dates
+        self.cases = cases
+        self.deaths = deaths
+        self._positions = {key: k for k, key in enumerate(keys)}
+        # county name -> states that have a county of that name
+        self._county_states = {}
+        for key in keys:
+            if isinstance(key, tuple):
+                self._county_states.setdefault(key[1], []).append(key[0])
+
+    @classmethod
+    def from_frame(cls, raw_data):
+        """
+        Build the index from a data frame of us.csv, us-states.csv or us-counties.csv
+        :param raw_data: pandas data frame, missing cases or deaths count as 0
+        :return: RegionIndex
+        """
+        dates = pandas.to_datetime(raw_data.date, format='%Y-%m-%d').values.astype('datetime64[D]')
+        if 'county' in raw_data.columns:
+            state_codes, states = pandas.factorize(raw_data.state)
+            county_codes, counties = pandas.factorize(raw_data.county)
+            groups = state_codes.astype('int64') * len(counties) + county_codes
+        elif 'state' in raw_data.columns:
+            groups, states = pandas.factorize(raw_data.state)
+        else:
+            groups = np.zeros(len(raw_data), dtype='int64')
+
+        order = np.lexsort((dates, groups))
+        unique_groups, counts = np.unique(groups[order], return_counts=True)
+        if 'county' in raw_data.columns:
+            keys = [(states[g // len(counties)], counties[g % len(counties)]) for g in unique_groups]
+        elif 'state' in raw_data.columns:
+            keys = [states[g] for g in unique_groups]
+        else:
+            keys = [USA]
+
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        return cls(keys, offsets, dates[order],
+                   raw_data.cases.fillna(0).values.astype('int64')[order],
+                   raw_data.deaths.fillna(0).values.astype('int64')[order])
+
+    @classmethod
+    def from_csv_chunks(cls, file, regions=None, chunk_rows=CHUNK_ROWS):
+        """
+        Build the index from a csv file, reading chunk_rows rows at a time and keeping only the selected
+        regions, so memory stays flat however large the file is.
+        :param file: path or address of us.csv, us-states.csv or us-counties.csv
+        :param regions: list of region keys to keep: state names, county names (any state) or
+        (state, county) tuples. None keeps everything
+        :param chunk_rows: rows per chunk
+        :return: RegionIndex
+        """
+        header = pandas.read_csv(file, nrows=0).columns
+        columns = [name for name in ('date', 'state', 'county', 'cases', 'deaths') if name in header]
+        # deaths are missing for a few rows in the counties file
+        dtypes = {'date': str, 'state': str, 'county': str, 'cases': 'int32', 'deaths': 'float32'}
+        names = set(region for region in regions or [] if not isinstance(region, tuple))
+        pairs = set(region for region in regions or [] if isinstance(region, tuple))
+
+        kept = []
+        for chunk in pandas.read_csv(file, usecols=columns, dtype={name: dtypes[name] for name in columns},
+                                     chunksize=chunk_rows):
+            if regions is not None:
+                if 'county' in chunk.columns:
+                    keep = chunk.county.isin(names).values
+                    if pairs:
+                        keep = keep | pandas.MultiIndex.from_arrays([chunk.state, chunk.county]).isin(pairs)
+                elif 'state' in chunk.columns:
+                    keep = chunk.state.isin(names).values
+                else:
+                    keep = np.full(len(chunk), USA in names)
+                chunk = chunk[keep]
+            kept.append(chunk)
+
+        return cls.from_frame(pandas.concat(kept, ignore_index=True))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self._positions
+
+    def states_with_county(self, county):
+        """
+        :param county: County name
+        :return: list of states with a county of that name
+        """
+        return list(self._county_states.get(county, []))
+
+    def lookup(self, name, state=None):
+        """
+        Data of one region, as views into the index arrays
+        :param name: State name, county name, or 'United States'
+        :param state: State of the county. Needed when the county name exists in more than one state
+        :return: dates, cases, deaths
+        """
+        if state is not None:
+            key = (state, name)
+        elif name in self._positions:
+            key = name
+        else:
+            states = self.states_with_county(name)
+            if len(states) > 1:
+                raise KeyError("County {} exists in several states, pass one of: {}".format(name, states))
+            key = (states[0], name) if states else name
+        if key not in self._positions:
+            raise KeyError("No data for region {}".format(key))
+
+        k = self._positions[key]
+        rows = slice(self.offsets[k], self.offsets[k + 1])
+        return self.dates[rows], self.cases[rows], self.deaths[rows]
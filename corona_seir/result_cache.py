@@ -0,0 +1,243 @@
+"""
+Content addressed cache for solved model runs.
+Entries are keyed by a hash of everything the results depend on: population, reported data, virus parameters,
+R0 schedule and ModelConfig. New data gives a new key, so stale entries are never returned and simply age out.
+Two tiers: an in-memory LRU, and a folder of .npy files per entry that are memory mapped when read back.
+Both tiers are bounded by the number of bytes they hold, least recently used entries go first. The disk tier keeps
+its size and use order in memory, the folder is only scanned the first time it is used. Entries another process
+writes to a shared folder join the index when they are read.
+"""
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+import collections
+import numpy as np
+
+from model_config import DEFAULT_CONFIG
+
+
+def _update_hash(digest, value):
+    if isinstance(value, np.ndarray):
+        digest.update(str(value.dtype).encode('utf-8'))
+        digest.update(str(value.shape).encode('utf-8'))
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (tuple, list)):
+        digest.update(b'(')
+        for item in value:
+            _update_hash(digest, item)
+        digest.update(b')')
+    else:
+        digest.update(repr(value).encode('utf-8'))
+    digest.update(b';')
+
+
+def content_key(*parts):
+    """
+    Hash of any mix of numpy arrays, tuples and plain values
+    :return: hex digest
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        _update_hash(digest, part)
+    return digest.hexdigest()
+
+
+def data_fingerprint(country_data):
+    """
+    Hash of the reported data of a region, changes whenever the data snapshot does
+    :param country_data: CountryData() object
+    :return: hex digest
+    """
+    return content_key(np.asarray(country_data.dates, dtype='datetime64[D]'),
+                       np.asarray(country_data.reported_cases, dtype='int64'),
+                       np.asarray(country_data.deaths, dtype='int64'))
+
+
+def model_key(country_data, virus, schedule=None, config=DEFAULT_CONFIG, model_name='model_changing_beta'):
+    """
+    Cache key of one model run of a region
+    :param country_data: CountryData() object
+    :param virus: Virus object
+    :param schedule: InterventionSchedule, None for the lockdown of config
+    :param config: ModelConfig
+    :param model_name: name of the ODE function
+    :return: hex digest
+    """
+    schedule_part = None if schedule is None else (schedule.steps_per_day, schedule.r0_values)
+    return content_key(model_name, country_data.name, country_data.population, data_fingerprint(country_data),
+                       virus.parameters(), schedule_part, config.astuple())
+
+
+class ResultCache(object):
+    """
+    Values are dicts of name -> numpy array. Arrays read from disk are read only memory maps.
+    """
+
+    def __init__(self, cache_dir=None, memory_bytes=256 * 2 ** 20, disk_bytes=2 * 2 ** 30):
+        """
+        :param cache_dir: folder of the disk tier, None for memory only
+        :param memory_bytes: size bound of the memory tier
+        :param disk_bytes: size bound of the disk tier
+        """
+        self.cache_dir = cache_dir
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = collections.OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        # disk tier: key -> size in bytes, least recently used first, None until the folder is scanned
+        self._disk = None
+        self._disk_size = 0
+        self._disk_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _size(arrays):
+        return sum(array.nbytes for array in arrays.values())
+
+    def _remember(self, key, arrays):
+        size = self._size(arrays)
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            if key in self._memory:
+                self._memory_size -= self._size(self._memory.pop(key))
+            self._memory[key] = arrays
+            self._memory_size += size
+            while self._memory_size > self.memory_bytes:
+                old_key, old_arrays = self._memory.popitem(last=False)
+                self._memory_size -= self._size(old_arrays)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _entry_size(self, key):
+        path = self._entry_path(key)
+        return sum(os.path.getsize(os.path.join(path, file_name)) for file_name in os.listdir(path))
+
+    def _scan_disk(self):
+        # called with _disk_lock held
+        entries = []
+        if os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                path = os.path.join(self.cache_dir, name)
+                if name.startswith('.') or not os.path.isdir(path):
+                    continue
+                try:
+                    entries.append((os.path.getmtime(path), name, self._entry_size(name)))
+                except OSError:
+                    continue
+        self._disk = collections.OrderedDict((name, size) for mtime, name, size in sorted(entries))
+        self._disk_size = sum(self._disk.values())
+
+    def _touch_disk(self, key, size=None):
+        """
+        Mark key as the most recently used disk entry, adding it to the index when size is given or it is unknown
+        """
+        with self._disk_lock:
+            if self._disk is None:
+                self._scan_disk()
+            if key in self._disk:
+                self._disk.move_to_end(key)
+                return
+            if size is None:
+                try:
+                    size = self._entry_size(key)
+                except OSError:
+                    return
+            self._disk[key] = size
+            self._disk_size += size
+
+    def _read_disk(self, key):
+        path = self._entry_path(key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            arrays = {name[:-4]: np.load(os.path.join(path, name), mmap_mode='r')
+                      for name in os.listdir(path) if name.endswith('.npy')}
+        except (IOError, ValueError):
+            # evicted while reading
+            return None
+        os.utime(path)
+        self._touch_disk(key)
+        return arrays
+
+    def _write_disk(self, key, arrays):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp_')
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), np.asarray(array))
+        size = sum(os.path.getsize(os.path.join(tmp_path, name + '.npy')) for name in arrays)
+        try:
+            os.rename(tmp_path, self._entry_path(key))
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        self._touch_disk(key, size)
+        self._evict_disk()
+
+    def _evict_disk(self):
+        evicted = []
+        with self._disk_lock:
+            while self._disk_size > self.disk_bytes and len(self._disk) > 1:
+                key, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                evicted.append(key)
+        for key in evicted:
+            shutil.rmtree(self._entry_path(key), ignore_errors=True)
+
+    def get(self, key):
+        """
+        :param key: see content_key
+        :return: dict of arrays, or None if the key isn't cached
+        """
+        with self._lock:
+            arrays = self._memory.get(key)
+            if arrays is not None:
+                self._memory.move_to_end(key)
+        if arrays is None and self.cache_dir is not None:
+            arrays = self._read_disk(key)
+            if arrays is not None:
+                self._remember(key, arrays)
+        with self._lock:
+            if arrays is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return arrays
+
+    def put(self, key, arrays):
+        """
+        :param key: see content_key
+        :param arrays: dict of name -> numpy array
+        """
+        arrays = {name: np.asarray(array) for name, array in arrays.items()}
+        self._remember(key, arrays)
+        if self.cache_dir is not None:
+            self._write_disk(key, arrays)
+
+    def get_or_compute(self, key, compute):
+        """
+        Cached value of key, computed and stored on a miss
+        :param key: see content_key
+        :param compute: function without arguments returning a dict of arrays
+        :return: dict of arrays
+        """
+        arrays = self.get(key)
+        if arrays is None:
+            arrays = compute()
+            self.put(key, arrays)
+        return arrays
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_size = 0
+        with self._disk_lock:
+            self._disk = None
+            self._disk_size = 0
+        if self.cache_dir is not None and os.path.isdir(self.cache_dir):
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
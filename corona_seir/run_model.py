@@ -1,99 +1,159 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.widgets  # Cursor
-import matplotlib.dates
-import matplotlib.ticker
 import datetime
 
 import data_utilities
-from constants import INIT_INFECTED, QUARANTINE_R1, DATA_OFFSET, INIT_R0, DAYS0
+import export
+import result_cache
+from instrumentation import NO_METRICS
+from constants import INIT_R0
+from model_config import DEFAULT_CONFIG
 from corona_virus import CoronaVirus
 from country_data import CountryData
 from seir_model import solve, model_changing_beta, calculate_deaths, calculate_reported_cases
 
-def run_model(country_data, virus, plot, save_data):
+def compute_model(country_data, virus, schedule=None, config=DEFAULT_CONFIG, metrics=NO_METRICS, verbose=False):
     """
-    Main driver function to run the SEIR model to predict virus cases and deaths
+    Solve the SEIR model and align it with the reported data
     :param country_data: CountryData() object
     :param virus: Virus object
-    :return:
+    :param schedule: InterventionSchedule, defaults to the lockdown of config
+    :param config: ModelConfig
+    :param metrics: instrumentation.Metrics
+    :param verbose: print the data offset found
+    :return: dict of numpy arrays: days, infected, reported_cases, deaths, data_offset
     """
     # SEIR model to predict cases, deaths
     # Date, Susceptible, Exposed, Infected, Recovered
-    days, susceptible, exposed, infected, recovered = solve(model_changing_beta, country_data.population,
-                                                            INIT_INFECTED, virus)
-
-    reported_cases = calculate_reported_cases(infected, virus=virus)
-    predicted_deaths = calculate_deaths(days, recovered, virus=virus)
+    with metrics.stage('ode'):
+        days, susceptible, exposed, infected, recovered = solve(model_changing_beta, country_data.population,
+                                                                config.init_infected, virus, schedule=schedule,
+                                                                config=config, metrics=metrics)
+
+    with metrics.stage('postprocess'):
+        reported_cases = calculate_reported_cases(infected, virus=virus, config=config)
+        predicted_deaths = calculate_deaths(days, recovered, virus=virus, config=config)
     # Shift dates to best align model
-    data_offset = data_utilities.get_offset_x(country_data.deaths, predicted_deaths, data_offset=DATA_OFFSET)  # match model day to real data day for deaths curve  todo: percentage wise?
+    with metrics.stage('offset_search'):
+        # match model day to real data day for deaths curve  todo: percentage wise?
+        data_offset = data_utilities.get_offset_x(country_data.deaths, predicted_deaths, data_offset=config.data_offset,
+                                                  window=config.offset_window, verbose=verbose)
+    return {'days': days, 'infected': infected, 'reported_cases': reported_cases, 'deaths': predicted_deaths,
+            'data_offset': np.array(data_offset)}
+
+
+def plot_model(country_data, model_days_shifted, infected, reported_cases, predicted_deaths):
+    """
+    Plot the reported data and the model curves. matplotlib is imported here, so headless runs never load it
+    """
+    import matplotlib.pyplot as plt
+    import matplotlib.widgets  # Cursor
+    import matplotlib.dates
+    import matplotlib.ticker
+
+    fig = plt.figure(dpi=75, figsize=(20,16))
+    ax = fig.add_subplot(111)
+    ax.fmt_xdata = matplotlib.dates.DateFormatter('%Y-%m-%d')  # higher date precision for cursor display
+    ax.set_yscale("log", nonposy='clip')
+
+    # Actual Data
+    ax.plot(country_data.dates, country_data.reported_cases, 'o', color='orange', alpha=0.5, lw=1, label='cases actually detected in tests')
+    ax.plot(country_data.dates, country_data.deaths, 'x', color='black', alpha=0.5, lw=1, label='actually deceased')
+
+    # Model data
+    ax.plot(model_days_shifted, infected, 'r--', alpha=0.5, lw=1, label='Infected (realtime)')
+    ax.plot(model_days_shifted, reported_cases, color='orange', alpha=0.5, lw=1, label='Found cumulated: "cases" Curve Fitted')
+    ax.plot(model_days_shifted, predicted_deaths, 'k', alpha=0.5, lw=1, label='Deaths Curve Fitted')
+
+    ax.set_xlabel('Time /days')
+    ax.set_ylim(bottom=1.0)
+    ax.xaxis.set_major_locator(matplotlib.dates.MonthLocator())
+    ax.xaxis.set_minor_locator(matplotlib.dates.WeekdayLocator())
+    ax.yaxis.set_major_locator(matplotlib.ticker.LogLocator(numticks=10, base=10.0, subs=(1.0,)))
+    ax.yaxis.set_minor_locator(matplotlib.ticker.LogLocator(numticks=10, base=10.0,
+                                                        subs=np.arange(2, 10) * .1))
+
+
+    ax.grid(linestyle=':')  #b=True, which='major', c='w', lw=2, ls='-')
+
+    legend = ax.legend(title='COVID-19 SEIR model: ' + ' (beta)\n')
+    legend.get_frame().set_alpha(0.5)
+    for spine in ('top', 'right', 'bottom', 'left'):
+        ax.spines[spine].set_visible(False)
+    cursor = matplotlib.widgets.Cursor(ax, color='black', linewidth=1 )
+    plt.show()
+
+
+def run_model(country_data, virus, plot, save_data, schedule=None, verbose=True, config=DEFAULT_CONFIG, cache=None,
+              metrics=None, export_format='csv', compression=None):
+    """
+    Main driver function to run the SEIR model to predict virus cases and deaths
+    :param country_data: CountryData() object
+    :param virus: Virus object
+    :param schedule: InterventionSchedule, defaults to the lockdown of config
+    :param config: ModelConfig
+    :param verbose: Print a summary of the run
+    :param cache: ResultCache to reuse earlier runs with the same inputs
+    :param metrics: instrumentation.Metrics to time the stages, returned under 'metrics' and emitted as a JSON line
+    :param export_format: file format of save_data, see export.FORMATS
+    :param compression: compression of save_data, see export.write_table
+    :return: dict of model results, see keys below
+    """
+    stages = NO_METRICS if metrics is None else metrics
+    if cache is not None:
+        key = result_cache.model_key(country_data, virus, schedule, config)
+        with stages.stage('cache_lookup'):
+            model = cache.get(key)
+        if model is None:
+            model = compute_model(country_data, virus, schedule, config, stages, verbose)
+            with stages.stage('cache_store'):
+                cache.put(key, model)
+    else:
+        model = compute_model(country_data, virus, schedule, config, stages, verbose)
+    days = model['days']
+    infected = model['infected']
+    reported_cases = model['reported_cases']
+    predicted_deaths = model['deaths']
+    data_offset = model['data_offset'].item()
     model_days = days - data_offset
     #
     model_days_shifted = data_utilities.model_to_world_time(model_days, country_data.dates)
 
     # Plot
     if plot:
-        fig = plt.figure(dpi=75, figsize=(20,16))
-        ax = fig.add_subplot(111)
-        ax.fmt_xdata = matplotlib.dates.DateFormatter('%Y-%m-%d')  # higher date precision for cursor display
-        ax.set_yscale("log", nonposy='clip')
-
-        # Actual Data
-        ax.plot(country_data.dates, country_data.reported_cases, 'o', color='orange', alpha=0.5, lw=1, label='cases actually detected in tests')
-        ax.plot(country_data.dates, country_data.deaths, 'x', color='black', alpha=0.5, lw=1, label='actually deceased')
-
-        # Model data
-        ax.plot(model_days_shifted, infected, 'r--', alpha=0.5, lw=1, label='Infected (realtime)')
-        ax.plot(model_days_shifted, reported_cases, color='orange', alpha=0.5, lw=1, label='Found cumulated: "cases" Curve Fitted')
-        ax.plot(model_days_shifted, predicted_deaths, 'k', alpha=0.5, lw=1, label='Deaths Curve Fitted')
-
-        ax.set_xlabel('Time /days')
-        ax.set_ylim(bottom=1.0)
-        ax.xaxis.set_major_locator(matplotlib.dates.MonthLocator())
-        ax.xaxis.set_minor_locator(matplotlib.dates.WeekdayLocator())
-        ax.yaxis.set_major_locator(matplotlib.ticker.LogLocator(numticks=10, base=10.0, subs=(1.0,)))
-        ax.yaxis.set_minor_locator(matplotlib.ticker.LogLocator(numticks=10, base=10.0,
-                                                            subs=np.arange(2, 10) * .1))
-
-
-        ax.grid(linestyle=':')  #b=True, which='major', c='w', lw=2, ls='-')
-
-        legend = ax.legend(title='COVID-19 SEIR model: ' + ' (beta)\n')
-        legend.get_frame().set_alpha(0.5)
-        for spine in ('top', 'right', 'bottom', 'left'):
-            ax.spines[spine].set_visible(False)
-        cursor = matplotlib.widgets.Cursor(ax, color='black', linewidth=1 )
-        plt.show()
+        stages.count('plots')
+        plot_model(country_data, model_days_shifted, infected, reported_cases, predicted_deaths)
 
     if save_data:
-        today = datetime.datetime.now()
-        today_str = "{}_{}_{}".format(today.year, today.month, today.day)
-        actual_data_filename = "{}_actual_data_{}_.csv".format(country_data.name, today_str)
-        model_data_filename = "{}_model_R0={}_R1={}_IFR={}_{}_.csv".format(country_data.name, INIT_R0, QUARANTINE_R1, virus.fatality_rate, today_str)
-
-        # Format data for csv file
-        header = ['name', 'date', 'predicted cases', 'predicted deaths', 'r0 value', 'fatality rate']
-        model_data = []
-        model_data.append(header)
-        for i in range(0, len(model_days_shifted)):
-            row = []
-            row.append(country_data.name)
-            row.append(str(model_days_shifted[i]))
-            row.append(reported_cases[i])
-            row.append(predicted_deaths[i])
-            row.append(INIT_R0)
-            row.append(virus.fatality_rate)
-            model_data.append(row)
-
-        data_utilities.write_to_csv_file(actual_data_filename, country_data.csv_data)
-        data_utilities.write_to_csv_file(model_data_filename, model_data)
+        with stages.stage('export'):
+            today = datetime.datetime.now()
+            today_str = "{}_{}_{}".format(today.year, today.month, today.day)
+            extension = export.file_extension(export_format, compression)
+            actual_data_filename = "{}_actual_data_{}_.{}".format(country_data.name, today_str, extension)
+            model_data_filename = "{}_model_R0={}_R1={}_IFR={}_{}_.{}".format(country_data.name, virus.r0, config.quarantine_r1, virus.fatality_rate, today_str, extension)
+
+            export.write_table(actual_data_filename, export.actual_table(country_data), export_format, compression)
+            export.write_table(model_data_filename, export.model_table(country_data.name, model_days_shifted,
+                                                                       reported_cases, predicted_deaths, virus),
+                               export_format, compression)
 
     # text output
-    print("corona_virus.sigma: %.3f  1/corona_virus.sigma: %.3f    corona_virus.gamma: %.3f  1/corona_virus.gamma: %.3f" % (corona_virus.sigma, 1.0/corona_virus.sigma, corona_virus.gamma, 1.0/corona_virus.gamma))
-    print("doubling0 every ~%.1f" % corona_virus.doubling_time, "days")
-    print("total predicted deaths: {}".format(predicted_deaths[-1]))
-    print("actual deaths: {}".format(country_data.deaths[-1]))
-    print("lockdown measures start:", model_days_shifted[DAYS0])
+    if verbose:
+        print("corona_virus.sigma: %.3f  1/corona_virus.sigma: %.3f    corona_virus.gamma: %.3f  1/corona_virus.gamma: %.3f" % (virus.sigma, 1.0/virus.sigma, virus.gamma, 1.0/virus.gamma))
+        print("doubling0 every ~%.1f" % virus.doubling_time, "days")
+        print("total predicted deaths: {}".format(predicted_deaths[-1]))
+        print("actual deaths: {}".format(country_data.deaths[-1]))
+        print("lockdown measures start:", model_days_shifted[config.days0])
+
+    results = {'name': country_data.name,
+               'dates': model_days_shifted,
+               'infected': infected,
+               'reported_cases': reported_cases,
+               'deaths': predicted_deaths,
+               'data_offset': data_offset}
+    if metrics is not None:
+        results['metrics'] = metrics.as_dict()
+        metrics.emit(name=country_data.name)
+    return results
 
 
 if __name__ == '__main__':
@@ -0,0 +1,161 @@
+"""
+Run the SEIR model for many regions and parameter sets on a process pool.
+The raw NYT data is loaded and indexed once in the parent process and handed to every worker when it starts,
+each task then only filters its region, solves, fits the offset and returns a table.
+"""
+import concurrent.futures
+import inspect
+import itertools
+import pandas
+
+import async_fetch
+import export
+import fetch_data
+from corona_virus import CoronaVirus
+from country_data import CountryData, USA
+from intervention import InterventionSchedule
+from model_config import DEFAULT_CONFIG
+from population_registry import UnknownRegionError
+from run_model import run_model
+
+# Keyword arguments of InterventionSchedule.lockdown, everything else in a parameter set goes to CoronaVirus
+SCHEDULE_PARAMS = [name for name in inspect.signature(InterventionSchedule.lockdown).parameters if name != 'r0']
+
+# NYT data sets by the names used in the raw data dicts
+DATA_SETS = {'us': CountryData.us_url, 'states': CountryData.states_virus_url, 'counties': CountryData.counties_url}
+
+# Raw data of the worker process, set by _init_worker
+_raw_data = None
+
+
+def parameter_grid(**values):
+    """
+    Cartesian product of parameter values.
+    i.e. parameter_grid(r0=[2.2, 2.5], fatality_rate=[.0036]) gives 2 parameter sets
+    :param values: lists of values for CoronaVirus or InterventionSchedule.lockdown keyword arguments
+    :return: list of dicts
+    """
+    names = list(values)
+    return [dict(zip(names, combination)) for combination in itertools.product(*(values[name] for name in names))]
+
+
+def load_raw_data(regions, county=False, update_data=True):
+    """
+    Load the NYT data sets needed for the given regions, once
+    :param regions: list of region names
+    :param county: regions are counties
+    :param update_data: refresh cached copies older than the cache ttl
+    :return: dict of 'us', 'states' or 'counties' -> RegionIndex
+    """
+    names = []
+    if county:
+        names.append('counties')
+    else:
+        if USA in regions:
+            names.append('us')
+        if any(region != USA for region in regions):
+            names.append('states')
+    return load_data_sets(names, update_data)
+
+
+def load_data_sets(names, update_data=True):
+    """
+    Load NYT data sets by name, once
+    :param names: any of the DATA_SETS names, 'us', 'states' and 'counties'
+    :param update_data: refresh cached copies older than the cache ttl
+    :return: dict of name -> RegionIndex
+    """
+    urls = {name: DATA_SETS[name] for name in names}
+    if update_data:
+        # download every file at once, read_index then uses the fresh copies
+        async_fetch.refresh(list(urls.values()), fetch_data.download_cache)
+    return {name: fetch_data.download_cache.read_index(url, update=False) for name, url in urls.items()}
+
+
+def _init_worker(raw_data):
+    global _raw_data
+    _raw_data = raw_data
+
+
+def run_scenario(region, params, county=False, save_data=False, config=DEFAULT_CONFIG):
+    """
+    Run one region with one parameter set. Uses the raw data handed to the worker process.
+    :param region: Region name, or (state, county) for counties
+    :param params: dict of CoronaVirus and InterventionSchedule.lockdown keyword arguments
+    :param county: region is a county
+    :param save_data: also write the per-region csv files
+    :param config: ModelConfig, lockdown values in params take precedence
+    :return: pandas data frame with one row per model day
+    """
+    if county:
+        raw_data = _raw_data['counties']
+    elif region == USA:
+        raw_data = _raw_data['us']
+    else:
+        raw_data = _raw_data['states']
+    state, name = region if isinstance(region, tuple) else (None, region)
+    country_data = CountryData(name=name, county=county, raw_data=raw_data, state=state)
+
+    virus_params = {key: value for key, value in params.items() if key not in SCHEDULE_PARAMS}
+    schedule_params = {key: value for key, value in params.items() if key in SCHEDULE_PARAMS}
+    virus = CoronaVirus(**virus_params)
+    schedule_params = dict({'quarantine_r1': config.quarantine_r1, 'lifted_q_r2': config.lifted_q_r2,
+                            'days0': config.days0, 'days_q_lifted': config.days_q_lifted,
+                            'delta_r0': config.delta_r0, 'days_total': config.days_total}, **schedule_params)
+    schedule = InterventionSchedule.lockdown(virus.r0, **schedule_params)
+
+    results = run_model(country_data, virus, plot=False, save_data=save_data, schedule=schedule, verbose=False,
+                        config=config)
+    table = pandas.DataFrame({'name': name,
+                              'date': results['dates'],
+                              'infected': results['infected'],
+                              'predicted cases': results['reported_cases'],
+                              'predicted deaths': results['deaths'],
+                              'data offset': results['data_offset']})
+    if county:
+        table.insert(1, 'state', state)
+    for key, value in params.items():
+        table[key] = value
+    return table
+
+
+def run_scenarios(regions, param_grid, county=False, update_data=True, save_data=False, max_workers=None,
+                  config=DEFAULT_CONFIG, export_file=None, compression=None):
+    """
+    Run every region with every parameter set on a process pool. Regions without a population (i.e. counties
+    when the county population file isn't there) are skipped with a message.
+    :param regions: list of region names, or (state, county) tuples for counties
+    :param param_grid: list of parameter dicts, see parameter_grid
+    :param county: regions are counties
+    :param update_data: refresh cached copies older than the cache ttl
+    :param save_data: also write the per-region csv files
+    :param max_workers: number of processes, defaults to the number of CPUs
+    :param config: ModelConfig shared by all scenarios
+    :param export_file: write all scenarios to this one file, format from the extension (see export.write_table)
+    :param compression: compression of export_file
+    :return: pandas data frame with the results of all scenarios
+    """
+    raw_data = load_raw_data(regions, county=county, update_data=update_data)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                                initargs=(raw_data,)) as executor:
+        futures = [(region, executor.submit(run_scenario, region, params, county, save_data, config))
+                   for region in regions for params in param_grid]
+        tables = []
+        skipped = {}
+        for region, future in futures:
+            try:
+                tables.append(future.result())
+            except UnknownRegionError as error:
+                skipped[region] = error
+    for region, error in skipped.items():
+        print('skipped {}: {}'.format(region, error.args[0]))
+    results = pandas.concat(tables, ignore_index=True) if tables else pandas.DataFrame()
+    if export_file is not None:
+        export.write_table(export_file, results, compression=compression)
+    return results
+
+
+if __name__ == '__main__':
+    regions = [USA] + fetch_data.get_region_names()
+    param_grid = parameter_grid(r0=[2.2, 2.5], fatality_rate=[.0036], find_factor=[30])
+    results = run_scenarios(regions, param_grid, export_file='scenarios.csv')
@@ -1,11 +1,12 @@
 import scipy.integrate
 import numpy as np
-from data_utilities import delay
-from constants import SYMPTOM_HOSPITAL_LAG, TIME_IN_HOSPITAL, COMMUNICATION_LAG, DAYS_TOTAL, TEST_LAG, \
-QUARANTINE_R1, LIFTED_Q_R2, DAYS0, DELTA_R0, DAYS_Q_LIFTED
+from postprocessing import deaths_curve, deaths_lag, reported_cases_curve, reported_cases_lag
+from intervention import InterventionSchedule, reproduction, STEPS_PER_DAY
+from model_config import DEFAULT_CONFIG
+import solver_backends
 
 
-def calculate_deaths(days, recovered, virus):
+def calculate_deaths(days, recovered, virus, config=DEFAULT_CONFIG):
     """
     This function calculates the deaths from a given virus based on the
     number of people who "recover" and the infection fatality rate.
@@ -14,89 +15,56 @@ def calculate_deaths(days, recovered, virus):
     period of time which means you're healthy with immunity, or dead.
     :param days: Total number of days during infection
     :param recovered: Number of people who were infected, then recover, or die
-    :param virus: Virus object which contains data such as fatality rate, gamma
-    :return:
+    :param virus: Virus object which contains data such as fatality rate, gamma, or a VirusBatch for batched curves
+    :param config: ModelConfig with the reporting lags
+    :return: numpy array of cumulative deaths, same shape as recovered
     """
-    deaths = np.arange(DAYS_TOTAL)
-    rprev = 0
-    dprev = 0
-    for i, x in enumerate(days):
-        # Weird convergence issues with these LOC, check for really small values
-        deaths[i] = dprev + virus.fatality_rate * (recovered[i] - rprev)
-        rprev = recovered[i]
-        dprev = deaths[i]
-
-    time_infected = 1.0 / virus.gamma
-    deaths = delay(deaths, - time_infected + virus.time_presymptom + SYMPTOM_HOSPITAL_LAG + TIME_IN_HOSPITAL + COMMUNICATION_LAG)  # deaths  from R
-
-    return deaths
+    return deaths_curve(recovered, virus.fatality_rate, deaths_lag(virus, config))
 
-def calculate_reported_cases(infected, virus):
+def calculate_reported_cases(infected, virus, config=DEFAULT_CONFIG):
     """
     Use the virus "find ratio" to calculate the number of reported cases
-    :param infected: Number of infected people
-    :param virus: Virus object
-    :return: type list - Number of reported cases
-    """
-    reported_cases = infected * virus.find_ratio
-    reported_cases = delay(reported_cases, virus.time_presymptom + SYMPTOM_HOSPITAL_LAG + TEST_LAG + COMMUNICATION_LAG)  # found in tests and officially announced; from I
-    # cumulate found --> cases
-    reported_cases = np.cumsum(reported_cases)
-
-    return reported_cases
-
-
-def get_reproduction(dx, curr_r0):
-    """
-    Get new R0 value based on number of days that have passed.
-    R0 changes if quarantine measures have been lifted
-    :param dx: Current day of evaluation
-    :param curr_beta: calculated with
-    :return: float new R0 value
+    :param infected: Number of infected people, 1-D or batched (N, DAYS_TOTAL)
+    :param virus: Virus object, or a VirusBatch for batched curves
+    :param config: ModelConfig with the reporting lags
+    :return: numpy array - Number of reported cases, same shape as infected
     """
-    new_r0 = curr_r0
-    if DAYS0 <= dx < DAYS_Q_LIFTED:
-        return QUARANTINE_R1
+    # found in tests and officially announced; from I, cumulate found --> cases
+    return reported_cases_curve(infected, virus.find_ratio, reported_cases_lag(virus, config))
 
-    elif dx >= DAYS_Q_LIFTED:
-        if curr_r0 < LIFTED_Q_R2:
-            return curr_r0 + DELTA_R0
-        else:
-            return LIFTED_Q_R2
 
-    return new_r0
-
-
-def model_changing_beta(prev_soln, dx, population, virus):
+def model_changing_beta(prev_soln, dx, population, virus, schedule):
     """
     SEIR model with a changing R0/beta value due to quarantining measures
     :param prev_soln: previous ODE solution
     :param dx: timestep
     :param population: total population
-    :param virus: Virus object
+    :param virus: Virus object, read only
+    :param schedule: InterventionSchedule giving R0 at time dx
     :return: solution to ODE delta values
     """
     # :param list x: Time step (days)
     # :param int N: Population
     s, e, i, r = prev_soln
     # Beta = r0 * gamma
-    virus.r0 = get_reproduction(dx, virus.r0)
+    beta = schedule.r0_at(dx) * virus.gamma
 
-    ds = -virus.beta * s * i / population
-    de = virus.beta * s * i / population - virus.sigma * e
+    ds = -beta * s * i / population
+    de = beta * s * i / population - virus.sigma * e
     di = virus.sigma * e - virus.gamma * i
     dr = virus.gamma * i
 
     return ds, de, di, dr
 
 
-def seir_model(prev_soln, dx, population, virus):
+def seir_model(prev_soln, dx, population, virus, schedule=None):
     """
     Solve the SEIR ODE
     :param prev_soln: previous ODE solution
     :param dx: timestep
     :param population: total population
     :param virus: Virus object
+    :param schedule: unused, constant R0 from the virus
     :return: solution to ODE delta values
     """
     s, e, i, r = prev_soln
@@ -109,23 +77,195 @@ def seir_model(prev_soln, dx, population, virus):
     return ds, de, di, dr
 
 
-def solve(model, population, init_infected, virus):
+def solve(model, population, init_infected, virus, schedule=None, config=DEFAULT_CONFIG, metrics=None):
     """
-    Main driver function for the model ode
+    Main driver function for the model ode. model_changing_beta and seir_model are integrated by the
+    solver backend named by config.solver, other model functions by odeint.
     :param model: Function which contains the ode
     :param population: Total population
     :param init_infected: Number of people who start the simualtion infected
-    :param virus: Virus object
+    :param virus: Virus object, not modified
+    :param schedule: InterventionSchedule, defaults to the lockdown of config starting from virus.r0
+    :param config: ModelConfig
+    :param metrics: instrumentation.Metrics to count the odeint RHS evaluations and steps
     :return:
     """
-    num_days = np.arange(DAYS_TOTAL)
+    num_days = np.arange(config.days_total)
     n0 = population - init_infected, init_infected, 0, 0  # S, E, I, R at initial step
+    if schedule is None:
+        schedule = InterventionSchedule.from_config(virus.r0, config)
 
-    y_data_var = scipy.integrate.odeint(model, n0, num_days, args=(population, virus))
+    if model is model_changing_beta or model is seir_model:
+        table, steps_per_day = solver_backends.beta_table(virus, schedule if model is model_changing_beta else None)
+        params = solver_backends.parameter_vector(population, virus, steps_per_day)
+        y_data_var = solver_backends.get_backend(config.solver).solve(np.array(n0, dtype='float64'), num_days,
+                                                                      params, table, metrics)
+    elif metrics is not None and metrics.enabled:
+        y_data_var, info = scipy.integrate.odeint(model, n0, num_days, args=(population, virus, schedule),
+                                                  full_output=True)
+        metrics.record_odeint(info)
+    else:
+        y_data_var = scipy.integrate.odeint(model, n0, num_days, args=(population, virus, schedule))
 
     s, e, i, r = y_data_var.T  # transpose and unpack
 
     return num_days, s, e, i, r  # note these are all lists
 
 
+# Column layout of the parameter array taken by solve_batch, one row per scenario
+BATCH_COLUMNS = ('population', 'r0', 'quarantine_r1', 'lifted_q_r2', 'days0', 'days_q_lifted', 'sigma', 'gamma',
+                 'fatality_rate', 'find_ratio', 'time_presymptom')
+
+
+def batch_params(population, virus, quarantine_r1=None, lifted_q_r2=None, days0=None, days_q_lifted=None,
+                 config=DEFAULT_CONFIG):
+    """
+    Build one row of the solve_batch parameter array. Stack several rows with np.vstack to sweep
+    regions, R0, IFR or lockdown dates in a single call.
+    :param population: Total population
+    :param virus: Virus object
+    :param quarantine_r1: R0 value once lockdown measures start
+    :param lifted_q_r2: R0 value once the lockdown is lifted
+    :param days0: Day the lockdown starts
+    :param days_q_lifted: Day the lockdown ends
+    :param config: ModelConfig for the lockdown values that aren't given
+    :return: numpy array with one value per BATCH_COLUMNS entry
+    """
+    quarantine_r1 = config.quarantine_r1 if quarantine_r1 is None else quarantine_r1
+    lifted_q_r2 = config.lifted_q_r2 if lifted_q_r2 is None else lifted_q_r2
+    days0 = config.days0 if days0 is None else days0
+    days_q_lifted = config.days_q_lifted if days_q_lifted is None else days_q_lifted
+    return np.array([population, virus.r0, quarantine_r1, lifted_q_r2, days0, days_q_lifted, virus.sigma,
+                     virus.gamma, virus.fatality_rate, virus.find_ratio, virus.time_presymptom], dtype='float64')
+
+
+class VirusBatch(object):
+    """
+    Column view of a solve_batch parameter array. Exposes the virus attributes used by calculate_deaths
+    and calculate_reported_cases as (N, 1) arrays, so they broadcast over (N, DAYS_TOTAL) curves.
+    """
+
+    def __init__(self, params):
+        self.params = np.atleast_2d(np.asarray(params, dtype='float64'))
+
+    def column(self, name):
+        return self.params[:, BATCH_COLUMNS.index(name), np.newaxis]
+
+    @property
+    def fatality_rate(self):
+        return self.column('fatality_rate')
+
+    @property
+    def find_ratio(self):
+        return self.column('find_ratio')
+
+    @property
+    def gamma(self):
+        return self.column('gamma')
+
+    @property
+    def r0(self):
+        return self.column('r0')
+
+    @property
+    def sigma(self):
+        return self.column('sigma')
+
+    @property
+    def time_presymptom(self):
+        return self.column('time_presymptom')
+
+
+def batch_steps(steps_per_day, table_steps_per_day=STEPS_PER_DAY):
+    """
+    RK4 steps per day used by solve_batch: the smallest divisor of table_steps_per_day that is at least
+    steps_per_day, or the smallest multiple of it once steps_per_day is larger. Either way every step covers
+    whole entries of the R0 table, or lies within one.
+    :param steps_per_day: Requested RK4 steps per day
+    :param table_steps_per_day: Entries per day of the R0 table, see InterventionSchedule
+    :return: int
+    """
+    if steps_per_day > table_steps_per_day:
+        return table_steps_per_day * -(-steps_per_day // table_steps_per_day)
+    return min(n for n in range(max(int(steps_per_day), 1), table_steps_per_day + 1) if table_steps_per_day % n == 0)
+
+
+def solve_batch(params, init_infected=None, steps_per_day=4, config=DEFAULT_CONFIG):
+    """
+    Integrate N SEIR systems at once with a fixed-step RK4 kernel. Every scenario shares the time grid,
+    so each step is a handful of NumPy operations on length N arrays instead of N odeint calls.
+
+    R0 follows the same table as seir_model.solve, STEPS_PER_DAY entries per day, and is held constant during
+    a step at the mean of the entries the step covers. With a multiple of STEPS_PER_DAY steps per day that is
+    the entry at the start of the step and the result matches solve to about 1e-6. Fewer steps smooth the R0
+    jumps: lockdown dates on whole days stay within about 1e-5 of solve, fractional ones within about 2e-4
+    at 4 steps per day and 7e-4 at 2.
+    :param params: (N, len(BATCH_COLUMNS)) array, see batch_params
+    :param init_infected: Number of people who start the simulation infected, scalar or one per scenario.
+    Defaults to config.init_infected
+    :param steps_per_day: RK4 steps per day, rounded by batch_steps
+    :param config: ModelConfig for the number of days and the R0 ramp
+    :return: days, then S, E, I, R as (N, config.days_total) arrays
+    """
+    params = np.atleast_2d(np.asarray(params, dtype='float64'))
+    population, r0, r1, r2, days0, days_lifted, sigma, gamma = (params[:, j] for j in range(8))
+    init_infected = config.init_infected if init_infected is None else init_infected
+    days_total = config.days_total
+    num_days = np.arange(days_total)
+    steps_per_day = batch_steps(steps_per_day)
+    h = 1.0 / steps_per_day
+
+    def rhs(rate, y):
+        s, e, i, r = y
+        new_exposed = rate * s * i / population
+        return np.array([-new_exposed, new_exposed - sigma * e, sigma * e - gamma * i, gamma * i])
+
+    # R0 * gamma at the table entries of one day, evaluated for the whole day at once, and the entries of a step
+    entries = np.arange(STEPS_PER_DAY)[:, np.newaxis]
+    entries_per_step = max(STEPS_PER_DAY // steps_per_day, 1)
+    y = np.zeros((4, len(params)))
+    y[0] = population - init_infected
+    y[1] = init_infected
+    out = np.empty((4, len(params), days_total))
+    out[:, :, 0] = y
+    for day in range(1, days_total):
+        t = ((day - 1) * STEPS_PER_DAY + entries) / STEPS_PER_DAY
+        rates = reproduction(t, r0, r1, r2, days0, days_lifted, config.delta_r0) * gamma
+        rates = rates.reshape(-1, entries_per_step, len(params)).mean(axis=1)
+        for step in range(steps_per_day):
+            rate = rates[step * len(rates) // steps_per_day]
+            k1 = rhs(rate, y)
+            k2 = rhs(rate, y + h / 2 * k1)
+            k3 = rhs(rate, y + h / 2 * k2)
+            k4 = rhs(rate, y + h * k3)
+            y = y + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        out[:, :, day] = y
+
+    s, e, i, r = out
+    return num_days, s, e, i, r
+
+
+def solve_rows(params, init_infected=None, config=DEFAULT_CONFIG):
+    """
+    Solve the rows of a solve_batch parameter array one at a time, with the config.solver backend and the
+    lockdown of each row. A row costs about as much as seir_model.solve, so this is faster than solve_batch
+    for a few rows, whose fixed cost is the per step NumPy overhead.
+    :param params: (N, len(BATCH_COLUMNS)) array, see batch_params
+    :param init_infected: Number of people who start the simulation infected, scalar or one per scenario.
+    Defaults to config.init_infected
+    :param config: ModelConfig for the number of days, the R0 ramp and the solver
+    :return: days, then S, E, I, R as (N, config.days_total) arrays
+    """
+    params = np.atleast_2d(np.asarray(params, dtype='float64'))
+    init_infected = np.broadcast_to(config.init_infected if init_infected is None else init_infected, len(params))
+    backend = solver_backends.get_backend(config.solver)
+    num_days = np.arange(config.days_total)
+    out = np.empty((4, len(params), config.days_total))
+    for k, (population, r0, r1, r2, days0, days_lifted, sigma, gamma) in enumerate(params[:, :8]):
+        schedule = InterventionSchedule.lockdown(r0, r1, r2, days0, days_lifted, config.delta_r0, config.days_total)
+        y0 = np.array([population - init_infected[k], init_infected[k], 0, 0], dtype='float64')
+        out[:, k] = backend.solve(y0, num_days, np.array([population, sigma, gamma, schedule.steps_per_day]),
+                                  schedule.r0_values * gamma).T
 
+    s, e, i, r = out
+    return num_days, s, e, i, r
@@ -0,0 +1,149 @@
+"""
+Forward sensitivity equations of the SEIR model with the config lockdown. The derivatives of S, E, I, R
+with respect to the parameters are integrated in the same odeint call as the model,
+    d/dt (dy/dp) = J(y) dy/dp + df/dp,   dy/dp = 0 at the start
+and pushed through the deaths and reported cases postprocessing, so a gradient costs one solve instead
+of one extra solve per parameter.
+Parameters:
+    beta: uniform scale of beta(t) = R0(t) * gamma, derivatives are per unit scale (d / d log beta)
+    sigma, gamma: virus rates, with R0(t) held fixed (beta follows gamma), gamma also moves the deaths lag
+    r0, quarantine_r1, lifted_q_r2: R0 before, during and after the lockdown
+"""
+import numpy as np
+import scipy.integrate
+
+from intervention import InterventionSchedule, reproduction
+from model_config import DEFAULT_CONFIG
+from postprocessing import (deaths_curve, deaths_lag, fractional_delay_slope, reported_cases_curve,
+                            reported_cases_lag)
+
+SENSITIVITY_PARAMETERS = ('beta', 'sigma', 'gamma', 'r0', 'quarantine_r1', 'lifted_q_r2')
+R0_PARAMETERS = ('r0', 'quarantine_r1', 'lifted_q_r2')
+
+
+def lockdown_derivatives(r0, config=DEFAULT_CONFIG, steps_per_day=24):
+    """
+    Derivatives of the InterventionSchedule.from_config table with respect to the three R0 values,
+    on the same time grid
+    :return: dict of parameter -> table
+    """
+    t = np.arange(config.days_total * steps_per_day + 1) / steps_per_day
+    r1, r2 = config.quarantine_r1, config.lifted_q_r2
+    lifted = t >= config.days_q_lifted
+    ramp = r1 + config.delta_r0 * (t - config.days_q_lifted)
+    ramping = lifted & (r1 < r2) & (ramp < r2)
+    return {'r0': (t < config.days0).astype('float64'),
+            'quarantine_r1': (((t >= config.days0) & ~lifted) | ramping).astype('float64'),
+            'lifted_q_r2': (lifted & ~ramping).astype('float64')}
+
+
+def solve_sensitivities(population, init_infected, virus, parameters=SENSITIVITY_PARAMETERS, config=DEFAULT_CONFIG,
+                        steps_per_day=24):
+    """
+    Solve the model (as seir_model.solve with model_changing_beta) together with its sensitivities
+    :param population: Total population
+    :param init_infected: Number of people who start the simulation infected
+    :param virus: Virus object
+    :param parameters: names from SENSITIVITY_PARAMETERS
+    :param config: ModelConfig with the lockdown
+    :param steps_per_day: resolution of the R0 table
+    :return: days, S, E, I, R, and dict of parameter -> (4, T) array of dS, dE, dI, dR
+    """
+    unknown = set(parameters) - set(SENSITIVITY_PARAMETERS)
+    if unknown:
+        raise ValueError('unknown sensitivity parameters: {}'.format(', '.join(sorted(unknown))))
+    sigma, gamma = virus.sigma, virus.gamma
+    table = InterventionSchedule.from_config(virus.r0, config, steps_per_day).r0_values
+    derivatives = lockdown_derivatives(virus.r0, config, steps_per_day)
+    # d(beta(t)) / d parameter on the table grid, new infections move by weights * S * I / N
+    weights = np.zeros((len(parameters), len(table)))
+    for p, name in enumerate(parameters):
+        if name == 'beta':
+            weights[p] = table * gamma
+        elif name == 'gamma':
+            weights[p] = table
+        elif name in R0_PARAMETERS:
+            weights[p] = derivatives[name] * gamma
+    is_sigma = np.array([name == 'sigma' for name in parameters], dtype='float64')
+    is_gamma = np.array([name == 'gamma' for name in parameters], dtype='float64')
+    weights_by_step = np.ascontiguousarray(weights.T)
+    count = len(parameters)
+    derivative = np.empty(4 * (count + 1))
+    # compartment major: derivative[4 + c * count:4 + (c + 1) * count] is d(compartment c) / d parameters
+    d_s, d_e, d_i, d_r = (derivative[4 + c * count:4 + (c + 1) * count] for c in range(4))
+
+    def model(y, t):
+        s, e, i, r = y[:4]
+        sens_s, sens_e, sens_i, sens_r = y[4:].reshape(4, count)
+        k = min(max(int(t * steps_per_day), 0), len(table) - 1)
+        beta = table[k] * gamma
+        by_i = beta * i / population
+        by_s = beta * s / population
+        infections = by_s * i
+        derivative[:4] = -infections, infections - sigma * e, sigma * e - gamma * i, gamma * i
+        # J @ sensitivities + d f / d parameter
+        new = by_i * sens_s + by_s * sens_i + weights_by_step[k] * (s * i / population)
+        onset = sigma * sens_e + is_sigma * e
+        removal = gamma * sens_i + is_gamma * i
+        d_s[:] = -new
+        d_e[:] = new - onset
+        d_i[:] = onset - removal
+        d_r[:] = removal
+        return derivative
+
+    days = np.arange(config.days_total)
+    y0 = np.zeros(4 * (count + 1))
+    y0[:2] = population - init_infected, init_infected
+    solution = scipy.integrate.odeint(model, y0, days)
+    s, e, i, r = solution[:, :4].T
+    sens = solution[:, 4:].T.reshape(4, count, len(days)).swapaxes(0, 1)
+    return days, s, e, i, r, dict(zip(parameters, sens))
+
+
+def sensitivities(population, virus, parameters=SENSITIVITY_PARAMETERS, init_infected=None, config=DEFAULT_CONFIG):
+    """
+    Model curves and their derivatives, through the same postprocessing as calculate_deaths and
+    calculate_reported_cases
+    :param population: Total population
+    :param virus: Virus object
+    :param parameters: names from SENSITIVITY_PARAMETERS
+    :param init_infected: defaults to config.init_infected
+    :param config: ModelConfig
+    :return: dict of 'days', 'infected', 'reported_cases', 'deaths' arrays, and 'd_infected', 'd_reported_cases',
+    'd_deaths': dicts of parameter -> derivative curve
+    """
+    init_infected = config.init_infected if init_infected is None else init_infected
+    days, s, e, i, r, sens = solve_sensitivities(population, init_infected, virus, parameters, config)
+    lag = deaths_lag(virus, config)
+    cases_lag = reported_cases_lag(virus, config)
+    deaths = deaths_curve(r, virus.fatality_rate, lag)
+    results = {'days': days, 'infected': i, 'reported_cases': reported_cases_curve(i, virus.find_ratio, cases_lag),
+               'deaths': deaths, 'd_infected': {}, 'd_reported_cases': {}, 'd_deaths': {}}
+    for name, (ds, de, di, dr) in sens.items():
+        # both curves are linear in the compartments, so the sensitivities go through the same postprocessing
+        results['d_infected'][name] = di
+        results['d_reported_cases'][name] = reported_cases_curve(di, virus.find_ratio, cases_lag)
+        results['d_deaths'][name] = deaths_curve(dr, virus.fatality_rate, lag)
+        if name == 'gamma':
+            # lag = -1 / gamma + ..., d lag / d gamma = 1 / gamma ** 2
+            undelayed = deaths_curve(r, virus.fatality_rate, 0.0)
+            results['d_deaths'][name] = (results['d_deaths'][name] +
+                                         fractional_delay_slope(undelayed, lag) / virus.gamma ** 2)
+    return results
+
+
+def elasticities(results, virus, config=DEFAULT_CONFIG, curve='deaths', day=-1):
+    """
+    Relative change of a curve value per relative change of each parameter, to rank the levers
+    :param results: sensitivities() output
+    :param virus: the Virus object of the run
+    :param config: ModelConfig of the run
+    :param curve: 'deaths', 'reported_cases' or 'infected'
+    :param day: model day of the value
+    :return: dict of parameter -> d log value / d log parameter, largest effect first
+    """
+    values = {'beta': 1.0, 'sigma': virus.sigma, 'gamma': virus.gamma, 'r0': virus.r0,
+              'quarantine_r1': config.quarantine_r1, 'lifted_q_r2': config.lifted_q_r2}
+    value = results[curve][day]
+    ranked = {name: float(derivative[day] * values[name] / value) for name, derivative in results['d_' + curve].items()}
+    return dict(sorted(ranked.items(), key=lambda item: -abs(item[1])))
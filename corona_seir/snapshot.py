@@ -0,0 +1,138 @@
+"""
+Compact binary snapshot of the parsed NYT data.
+A snapshot folder holds one version folder of .npy files, one per column, plus the region names:
+    dates.npy         datetime64[D]
+    cases.npy         int64
+    deaths.npy        int64
+    offsets.npy       int64, region k is rows offsets[k]:offsets[k + 1]
+    regions.json      region keys, [state, county] pairs for counties
+and a CURRENT file naming that version folder. The version before it is kept until the next rewrite, so readers
+that just read CURRENT still find their folder; a reader that is two rewrites behind reads CURRENT again.
+Rows are stored in RegionIndex order, so loading with mmap_mode='r' maps the files and a region lookup
+only touches the pages of that region, no csv parsing at all.
+"""
+import os
+import json
+import shutil
+import tempfile
+import threading
+import numpy as np
+
+import fetch_data
+from region_index import RegionIndex
+
+COLUMNS = ('dates', 'cases', 'deaths', 'offsets')
+REGIONS_FILE = 'regions.json'
+CURRENT_FILE = 'CURRENT'
+VERSION_PREFIX = 'v_'
+# Times a reader reads CURRENT again when its version folder was deleted meanwhile
+READ_RETRIES = 3
+
+# path -> (version, RegionIndex), shared by the whole process
+_snapshots = {}
+_lock = threading.Lock()
+
+
+def write_snapshot(index, path):
+    """
+    Write a RegionIndex to a snapshot folder. The columns go to a new version folder, which replaces
+    the previous one by rewriting CURRENT, so a reader sees either the old or the new snapshot as a whole.
+    :param index: RegionIndex
+    :param path: snapshot folder, created if needed
+    :return:
+    """
+    os.makedirs(path, exist_ok=True)
+    columns = {'dates': np.asarray(index.dates, dtype='datetime64[D]'),
+               'cases': np.asarray(index.cases, dtype='int64'),
+               'deaths': np.asarray(index.deaths, dtype='int64'),
+               'offsets': np.asarray(index.offsets, dtype='int64')}
+    tmp_path = tempfile.mkdtemp(dir=path, prefix='.tmp_')
+    try:
+        for name in COLUMNS:
+            np.save(os.path.join(tmp_path, name + '.npy'), columns[name])
+        keys = [list(key) if isinstance(key, tuple) else key for key in index.keys]
+        with open(os.path.join(tmp_path, REGIONS_FILE), mode='w') as regions_file:
+            json.dump(keys, regions_file)
+        version = VERSION_PREFIX + os.path.basename(tmp_path)[len('.tmp_'):]
+        os.rename(tmp_path, os.path.join(path, version))
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    try:
+        previous = current_version(path)
+    except FileNotFoundError:
+        previous = None
+    fetch_data._write_atomic(os.path.join(path, CURRENT_FILE), version.encode('utf-8'))
+    # keep the previous version for readers that read CURRENT just before the rewrite. Readers that mapped
+    # an older version keep their pages, the files only go away with the last map
+    for name in os.listdir(path):
+        if name.startswith(VERSION_PREFIX) and name not in (version, previous):
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+
+def current_version(path):
+    """
+    :param path: snapshot folder
+    :return: name of the version folder in use
+    """
+    with open(os.path.join(path, CURRENT_FILE), mode='r') as current_file:
+        return current_file.read().strip()
+
+
+def read_snapshot(path, mmap_mode='r'):
+    """
+    Load a snapshot folder as a RegionIndex, memory mapped by default
+    :param path: snapshot folder
+    :param mmap_mode: passed to numpy.load, None reads the columns into memory
+    :return: RegionIndex
+    """
+    return _read_current(path, mmap_mode)[1]
+
+
+def _read_current(path, mmap_mode='r', retries=READ_RETRIES):
+    """
+    :return: name of the current version folder and its RegionIndex
+    """
+    for attempt in range(retries):
+        version = current_version(path)
+        try:
+            return version, _read_version(os.path.join(path, version), mmap_mode)
+        except FileNotFoundError:
+            # deleted by two rewrites since CURRENT was read, the new CURRENT names a complete version
+            if attempt == retries - 1:
+                raise
+
+
+def _read_version(version_path, mmap_mode='r'):
+    with open(os.path.join(version_path, REGIONS_FILE), mode='r') as regions_file:
+        keys = [tuple(key) if isinstance(key, list) else key for key in json.load(regions_file)]
+    columns = {name: np.load(os.path.join(version_path, name + '.npy'), mmap_mode=mmap_mode) for name in COLUMNS}
+    return RegionIndex(keys, columns['offsets'], columns['dates'], columns['cases'], columns['deaths'])
+
+
+def load_snapshot(path):
+    """
+    Memory mapped snapshot, loaded once per process and reloaded when it is rewritten
+    :param path: snapshot folder
+    :return: RegionIndex
+    """
+    with _lock:
+        version = current_version(path)
+        cached = _snapshots.get(path)
+        if cached is None or cached[0] != version:
+            cached = _read_current(path)
+            _snapshots[path] = cached
+    return cached[1]
+
+
+def snapshot_from_url(url, path, update=True):
+    """
+    Download (through the download cache), parse and write a snapshot of one NYT file
+    :param url: us.csv, us-states.csv or us-counties.csv address
+    :param path: snapshot folder
+    :param update: see DownloadCache.fetch
+    :return: RegionIndex that was written
+    """
+    index = fetch_data.download_cache.read_index(url, update=update)
+    write_snapshot(index, path)
+    return index
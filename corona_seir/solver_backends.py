@@ -0,0 +1,290 @@
+"""
+Interchangeable integrators for the single region SEIR model. Every backend integrates the same right hand side,
+written against a flat float64 parameter vector (see PARAMETERS) and a table of beta values, instead of reading
+CoronaVirus properties on every evaluation. ModelConfig.solver picks the backend used by seir_model.solve.
+
+The fixed-step kernel is compiled with Numba when it is installed and runs as plain Python otherwise.
+Run this module to check that all backends agree.
+"""
+import numpy as np
+import scipy.integrate
+from model_config import DEFAULT_CONFIG
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Layout of the parameter vector taken by the backends
+PARAMETERS = ('population', 'sigma', 'gamma', 'steps_per_day')
+
+# Deviation of the fixed-step kernel with one step per day allowed by check_parity, about twice what it is
+# against a tight reference, and the accuracy of odeint with its default tolerances
+FIXED_STEP_RTOL = 1e-4
+REFERENCE_RTOL = 1e-6
+
+
+def parameter_vector(population, virus, steps_per_day=1):
+    """
+    Build the flat parameter vector of the backends
+    :param population: Total population
+    :param virus: Virus object
+    :param steps_per_day: Number of beta table entries per day
+    :return: numpy float64 array laid out as PARAMETERS
+    """
+    return np.array([population, virus.sigma, virus.gamma, steps_per_day], dtype='float64')
+
+
+def beta_table(virus, schedule=None):
+    """
+    Beta values looked up by the right hand side
+    :param virus: Virus object
+    :param schedule: InterventionSchedule, or None for the constant beta of the virus
+    :return: numpy float64 array and its number of entries per day
+    """
+    if schedule is None:
+        return np.array([virus.beta], dtype='float64'), 1
+    # Beta = r0 * gamma
+    return np.asarray(schedule.r0_values, dtype='float64') * virus.gamma, schedule.steps_per_day
+
+
+def _seir(s, e, i, beta, params):
+    population, sigma, gamma = params[0], params[1], params[2]
+
+    ds = -beta * s * i / population
+    de = beta * s * i / population - sigma * e
+    di = sigma * e - gamma * i
+    dr = gamma * i
+
+    return ds, de, di, dr
+
+
+def _derivative(t, s, e, i, params, table):
+    index = min(max(int(t * params[3]), 0), len(table) - 1)
+    return _seir(s, e, i, table[index], params)
+
+
+def _rk4_kernel(y0, days_total, steps_per_day, params, table):
+    # steps_per_day is a multiple of the table's, so every step lies within one table entry and beta is
+    # constant over all four stages; looking it up once per step keeps the kernel fourth order
+    out = np.empty((days_total, 4))
+    s, e, i, r = y0[0], y0[1], y0[2], y0[3]
+    out[0, 0], out[0, 1], out[0, 2], out[0, 3] = s, e, i, r
+    h = 1.0 / steps_per_day
+    table_steps = int(params[3])
+    steps_per_entry = steps_per_day // table_steps
+    for day in range(1, days_total):
+        for step in range(steps_per_day):
+            beta = table[min((day - 1) * table_steps + step // steps_per_entry, len(table) - 1)]
+            a1, b1, c1, d1 = _seir(s, e, i, beta, params)
+            a2, b2, c2, d2 = _seir(s + h / 2 * a1, e + h / 2 * b1, i + h / 2 * c1, beta, params)
+            a3, b3, c3, d3 = _seir(s + h / 2 * a2, e + h / 2 * b2, i + h / 2 * c2, beta, params)
+            a4, b4, c4, d4 = _seir(s + h * a3, e + h * b3, i + h * c3, beta, params)
+            s += h / 6 * (a1 + 2 * a2 + 2 * a3 + a4)
+            e += h / 6 * (b1 + 2 * b2 + 2 * b3 + b4)
+            i += h / 6 * (c1 + 2 * c2 + 2 * c3 + c4)
+            r += h / 6 * (d1 + 2 * d2 + 2 * d3 + d4)
+        out[day, 0], out[day, 1], out[day, 2], out[day, 3] = s, e, i, r
+    return out
+
+
+if numba is not None:
+    # _derivative and _rk4_kernel resolve _seir when they are compiled, so the jitted version has to be bound first
+    _seir = numba.njit(cache=True)(_seir)
+    _derivative = numba.njit(cache=True)(_derivative)
+    _rk4_kernel = numba.njit(cache=True)(_rk4_kernel)
+
+
+def rhs(y, t, params, table):
+    """
+    SEIR right hand side in odeint argument order
+    :param y: S, E, I, R
+    :param t: Day of evaluation
+    :param params: Parameter vector, see parameter_vector
+    :param table: Beta table, see beta_table
+    :return: S, E, I, R delta values
+    """
+    return _derivative(t, y[0], y[1], y[2], params, table)
+
+
+class SolverBackend(object):
+    """
+    Interface of the integrators. solve returns the S, E, I, R values at the whole days as a (days, 4) array.
+    """
+    name = None
+
+    def solve(self, y0, days, params, table, metrics=None):
+        """
+        :param y0: S, E, I, R at day 0
+        :param days: Whole days to report, starting at 0
+        :param params: Parameter vector, see parameter_vector
+        :param table: Beta table, see beta_table
+        :param metrics: instrumentation.Metrics, used by the backends that have solver statistics
+        :return: numpy array, one row per day
+        """
+        raise NotImplementedError
+
+    def __repr__(self):
+        return '{}()'.format(type(self).__name__)
+
+
+class OdeintBackend(SolverBackend):
+    name = 'odeint'
+
+    def __init__(self, rtol=None, atol=None):
+        self.rtol = rtol
+        self.atol = atol
+
+    def solve(self, y0, days, params, table, metrics=None):
+        if metrics is not None and metrics.enabled:
+            y, info = scipy.integrate.odeint(rhs, y0, days, args=(params, table), rtol=self.rtol, atol=self.atol,
+                                             full_output=True)
+            metrics.record_odeint(info)
+            return y
+        return scipy.integrate.odeint(rhs, y0, days, args=(params, table), rtol=self.rtol, atol=self.atol)
+
+    def __repr__(self):
+        return 'OdeintBackend(rtol={!r}, atol={!r})'.format(self.rtol, self.atol)
+
+
+class SolveIvpBackend(SolverBackend):
+    name = 'solve_ivp'
+
+    def __init__(self, method='LSODA', rtol=1e-6, atol=1e-6):
+        self.method = method
+        self.rtol = rtol
+        self.atol = atol
+
+    def solve_dense(self, y0, days, params, table, metrics=None):
+        """
+        Integrate with dense output
+        :return: scipy OdeResult; its sol attribute evaluates S, E, I, R at any time between the first and last day
+        """
+        result = scipy.integrate.solve_ivp(lambda t, y: _derivative(t, y[0], y[1], y[2], params, table),
+                                           (days[0], days[-1]), y0, method=self.method, t_eval=days,
+                                           dense_output=True, rtol=self.rtol, atol=self.atol)
+        if not result.success:
+            raise RuntimeError("solve_ivp ({}) failed: {}".format(self.method, result.message))
+        if metrics is not None:
+            metrics.count('solve_ivp_nfev', result.nfev)
+            metrics.count('solve_ivp_njev', result.njev)
+        return result
+
+    def solve(self, y0, days, params, table, metrics=None):
+        return self.solve_dense(y0, days, params, table, metrics).y.T
+
+    def __repr__(self):
+        return 'SolveIvpBackend(method={!r}, rtol={!r}, atol={!r})'.format(self.method, self.rtol, self.atol)
+
+
+class FixedStepBackend(SolverBackend):
+    """
+    Classic RK4 with a fixed step. The step is rounded down so that it divides the step of the beta table,
+    see steps_for.
+    """
+    name = 'fixed_step'
+
+    def __init__(self, steps_per_day=4):
+        self.steps_per_day = steps_per_day
+
+    @property
+    def compiled(self):
+        return numba is not None
+
+    def steps_for(self, table_steps_per_day):
+        """
+        RK4 steps per day used with a beta table. A step that spans a jump of the piecewise constant table
+        is only first order, so this is the smallest multiple of the table's steps per day that is at least
+        self.steps_per_day.
+        :param table_steps_per_day: Number of beta table entries per day
+        :return: int
+        """
+        table_steps_per_day = int(table_steps_per_day)
+        return table_steps_per_day * max(1, -(-self.steps_per_day // table_steps_per_day))
+
+    def solve(self, y0, days, params, table, metrics=None):
+        return _rk4_kernel(np.asarray(y0, dtype='float64'), len(days), self.steps_for(params[3]),
+                           np.asarray(params, dtype='float64'), np.asarray(table, dtype='float64'))
+
+    def __repr__(self):
+        return 'FixedStepBackend(steps_per_day={!r})'.format(self.steps_per_day)
+
+
+BACKENDS = {
+    'odeint': OdeintBackend(),
+    'solve_ivp': SolveIvpBackend(),
+    'solve_ivp_rk45': SolveIvpBackend('RK45'),
+    'solve_ivp_bdf': SolveIvpBackend('BDF'),
+    'fixed_step': FixedStepBackend(),
+}
+
+
+def register_backend(name, backend):
+    """
+    Make a backend selectable by ModelConfig.solver, e.g. a solve_ivp backend with other tolerances
+    :param name: Value of ModelConfig.solver
+    :param backend: SolverBackend
+    """
+    BACKENDS[name] = backend
+
+
+def get_backend(name):
+    """
+    :param name: Value of ModelConfig.solver
+    :return: SolverBackend
+    """
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError("Unknown solver {!r}, expected one of {}".format(name, sorted(BACKENDS))) from None
+
+
+def check_parity(population=3.3e8, virus=None, config=DEFAULT_CONFIG, names=None, rtol=1e-3,
+                 fixed_step_rtol=FIXED_STEP_RTOL, reference_rtol=REFERENCE_RTOL):
+    """
+    Solve the lockdown model with every backend and compare against odeint. Deviations are relative to the
+    largest value of each compartment, so they don't blow up where a curve is close to 0.
+    :param population: Total population
+    :param virus: Virus object, defaults to CoronaVirus()
+    :param config: ModelConfig
+    :param names: Backends to check, defaults to all of BACKENDS
+    :param rtol: Allowed deviation of the adaptive backends
+    :param fixed_step_rtol: Allowed deviation of a fixed-step backend with one step per day. The kernel is
+    fourth order, so this is divided by the fourth power of its steps per day
+    :param reference_rtol: Smallest deviation allowed for a fixed-step backend, the accuracy of the odeint
+    reference itself
+    :return: dict of the largest deviation per backend name
+    :raises AssertionError: when a backend deviates by more than allowed
+    """
+    from corona_virus import CoronaVirus
+    from intervention import InterventionSchedule
+
+    virus = CoronaVirus() if virus is None else virus
+    schedule = InterventionSchedule.from_config(virus.r0, config)
+    table, steps_per_day = beta_table(virus, schedule)
+    params = parameter_vector(population, virus, steps_per_day)
+    days = np.arange(config.days_total)
+    y0 = np.array([population - config.init_infected, config.init_infected, 0, 0], dtype='float64')
+
+    reference = get_backend('odeint').solve(y0, days, params, table)
+    scale = np.abs(reference).max(axis=0)
+    deviations = {}
+    allowed = {}
+    for name in sorted(BACKENDS) if names is None else names:
+        backend = get_backend(name)
+        y = backend.solve(y0, days, params, table)
+        deviations[name] = float((np.abs(y - reference) / scale).max())
+        if isinstance(backend, FixedStepBackend):
+            allowed[name] = max(fixed_step_rtol / backend.steps_for(steps_per_day) ** 4, reference_rtol)
+        else:
+            allowed[name] = rtol
+    failed = {name: deviation for name, deviation in deviations.items() if deviation > allowed[name]}
+    if failed:
+        raise AssertionError("Backends deviate from odeint by more than allowed: {}".format(failed))
+    return deviations
+
+
+if __name__ == '__main__':
+    print('numba', 'available' if numba is not None else 'not installed, fixed_step runs as plain Python')
+    for backend_name, deviation in check_parity().items():
+        print('{:16s} max deviation {:.2e}'.format(backend_name, deviation))
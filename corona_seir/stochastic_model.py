@@ -0,0 +1,169 @@
+"""
+Stochastic SEIR model for small regions, where chance and extinction matter.
+Two engines, both vectorized over replicates:
+    tau leaping: Poisson numbers of S->E, E->I and I->R events per step, with a binomial chain draw for the
+    replicates where a Poisson draw would empty a compartment below zero
+    Gillespie: exact event by event simulation, for tiny populations
+Replicates are simulated in fixed blocks, each block seeded by its own child of SeedSequence(seed), so replicate
+k gives the same curve whatever the number of workers. Deaths and reported cases use the same postprocessing
+as the deterministic model.
+"""
+import concurrent.futures
+
+import numpy as np
+
+import seir_model
+from intervention import InterventionSchedule
+from model_config import DEFAULT_CONFIG
+
+COMPARTMENTS = ('susceptible', 'exposed', 'infected', 'recovered')
+# Replicates per block (one random stream each)
+BLOCK_SIZE = 256
+# method='auto' uses Gillespie up to this population
+GILLESPIE_POPULATION = 5000
+
+
+def _leap(rng, counts, rates, dt, exact):
+    """
+    Events out of a compartment in one step
+    :param counts: people in the compartment, per replicate
+    :param rates: per capita rate, per replicate or scalar
+    :param exact: use the binomial chain for every replicate
+    """
+    probability = -np.expm1(-rates * dt)
+    if exact:
+        return rng.binomial(counts, probability)
+    events = rng.poisson(counts * rates * dt)
+    over = np.nonzero(events > counts)[0]
+    if len(over):
+        events[over] = rng.binomial(counts[over], np.broadcast_to(probability, counts.shape)[over])
+    return events
+
+
+def tau_leap(population, virus, schedule, replicates, rng, init_infected=1, steps_per_day=4, days_total=365,
+             binomial=False):
+    """
+    :param population: Total population
+    :param virus: Virus object
+    :param schedule: InterventionSchedule
+    :param replicates: number of replicates
+    :param rng: numpy Generator
+    :param init_infected: exposed people at the start
+    :param steps_per_day: leaps per day
+    :param days_total: days simulated
+    :param binomial: binomial chain for every step instead of Poisson leaps
+    :return: S, E, I, R as (replicates, days_total) int64 arrays
+    """
+    population = int(population)
+    s = np.full(replicates, population - int(init_infected), dtype='int64')
+    e = np.full(replicates, int(init_infected), dtype='int64')
+    i = np.zeros(replicates, dtype='int64')
+    r = np.zeros(replicates, dtype='int64')
+    output = np.empty((4, replicates, days_total), dtype='int64')
+    dt = 1.0 / steps_per_day
+    for day in range(days_total):
+        output[:, :, day] = s, e, i, r
+        for step in range(steps_per_day):
+            beta = schedule.r0_at(day + step * dt) * virus.gamma
+            infections = _leap(rng, s, beta * i / population, dt, binomial)
+            onsets = _leap(rng, e, virus.sigma, dt, binomial)
+            removals = _leap(rng, i, virus.gamma, dt, binomial)
+            s = s - infections
+            e = e + infections - onsets
+            i = i + onsets - removals
+            r = r + removals
+    return tuple(output)
+
+
+def gillespie(population, virus, schedule, replicates, rng, init_infected=1, days_total=365):
+    """
+    Exact stochastic simulation, one event per replicate per iteration. The cost grows with the number
+    of events (about 3 x population), so keep it for tiny populations. R0 is taken at the start of each
+    waiting time.
+    :return: S, E, I, R as (replicates, days_total) int64 arrays
+    """
+    population = int(population)
+    state = np.zeros((4, replicates), dtype='int64')
+    state[0] = population - int(init_infected)
+    state[1] = int(init_infected)
+    output = np.empty((4, replicates, days_total), dtype='int64')
+    # change of (S, E, I, R) per event: infection, onset, removal
+    changes = np.array([[-1, 1, 0, 0], [0, -1, 1, 0], [0, 0, -1, 1]], dtype='int64')
+    time = np.zeros(replicates)
+    next_day = np.zeros(replicates, dtype='int64')
+    running = np.arange(replicates)
+    while len(running):
+        s, e, i = state[0, running], state[1, running], state[2, running]
+        table = np.minimum((time[running] * schedule.steps_per_day).astype('int64'), len(schedule.r0_values) - 1)
+        beta = schedule.r0_values[table] * virus.gamma
+        rates = np.stack((beta * s * i / population, virus.sigma * e, virus.gamma * i))
+        total = rates.sum(axis=0)
+        with np.errstate(divide='ignore'):
+            new_time = time[running] + rng.exponential(1.0, len(running)) / total
+        # record the state for every day boundary passed before the event
+        crossing = running[next_day[running] < np.minimum(new_time, days_total)]
+        while len(crossing):
+            output[:, crossing, next_day[crossing]] = state[:, crossing]
+            next_day[crossing] += 1
+            limit = np.minimum(new_time[np.searchsorted(running, crossing)], days_total)
+            crossing = crossing[next_day[crossing] < limit]
+        time[running] = new_time
+        active = (total > 0) & (new_time < days_total)
+        running, rates, total = running[active], rates[:, active], total[active]
+        pick = rng.random(len(running)) * total
+        event = (pick > rates[0]).astype('int64') + (pick > rates[0] + rates[1])
+        state[:, running] += changes[event].T
+    return tuple(output)
+
+
+def _simulate_block(population, virus, schedule, replicates, seed_sequence, method, init_infected, steps_per_day,
+                    days_total):
+    rng = np.random.default_rng(seed_sequence)
+    if method == 'gillespie':
+        return gillespie(population, virus, schedule, replicates, rng, init_infected, days_total)
+    return tau_leap(population, virus, schedule, replicates, rng, init_infected, steps_per_day, days_total,
+                    binomial=method == 'binomial')
+
+
+def run_stochastic(population, virus, replicates=1000, seed=None, method='auto', schedule=None, init_infected=None,
+                   steps_per_day=4, max_workers=1, block_size=BLOCK_SIZE, config=DEFAULT_CONFIG):
+    """
+    Replicates of the stochastic model, with deaths and reported cases
+    :param population: Total population
+    :param virus: Virus object
+    :param replicates: number of replicates
+    :param seed: seed of the SeedSequence, replicate k is reproducible for a given seed and block_size
+    :param method: 'tau', 'binomial', 'gillespie' or 'auto' (Gillespie up to GILLESPIE_POPULATION)
+    :param schedule: InterventionSchedule, defaults to the lockdown of config
+    :param init_infected: exposed people at the start, defaults to config.init_infected
+    :param steps_per_day: leaps per day for 'tau' and 'binomial'
+    :param max_workers: processes for the blocks, 1 runs in this process
+    :param block_size: replicates per random stream
+    :param config: ModelConfig
+    :return: dict of 'susceptible', 'exposed', 'infected', 'recovered', 'deaths', 'reported_cases' ->
+    (replicates, days) arrays, plus 'days'
+    """
+    if method == 'auto':
+        method = 'gillespie' if population <= GILLESPIE_POPULATION else 'tau'
+    if method not in ('tau', 'binomial', 'gillespie'):
+        raise ValueError('unknown method: {}'.format(method))
+    if schedule is None:
+        schedule = InterventionSchedule.from_config(virus.r0, config)
+    init_infected = config.init_infected if init_infected is None else init_infected
+
+    sizes = [min(block_size, replicates - start) for start in range(0, replicates, block_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(population, virus, schedule, size, seed_sequence, method, init_infected, steps_per_day,
+             config.days_total) for size, seed_sequence in zip(sizes, seeds)]
+    if max_workers == 1 or len(args) == 1:
+        blocks = [_simulate_block(*arg) for arg in args]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+            blocks = list(executor.map(_simulate_block, *zip(*args)))
+
+    results = {name: np.concatenate([block[k] for block in blocks]) for k, name in enumerate(COMPARTMENTS)}
+    days = np.arange(config.days_total)
+    results['deaths'] = seir_model.calculate_deaths(days, results['recovered'], virus, config)
+    results['reported_cases'] = seir_model.calculate_reported_cases(results['infected'], virus, config)
+    results['days'] = days
+    return results
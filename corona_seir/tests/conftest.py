@@ -0,0 +1,62 @@
+"""
+The modules import each other by name, so the tests run with the module folder on the path.
+stand_in_server is a local HTTP server for the download tests.
+"""
+import os
+import sys
+import threading
+import http.server
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Serves server.files (path -> bytes) with an ETag and Last-Modified, answers conditional requests with 304.
+    server.failures (path -> list of status codes) are answered first, one per request.
+    """
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, dict(self.headers)))
+            failures = server.failures.get(self.path)
+            status = failures.pop(0) if failures else None
+        if status is not None:
+            self.send_error(status)
+            return
+        if self.path not in server.files:
+            self.send_error(404)
+            return
+        data = server.files[self.path]
+        etag = '"{}"'.format(hash(data) & 0xffffffff)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', 'Wed, 01 Apr 2020 00:00:00 GMT')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def stand_in_server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.files = {}
+    server.failures = {}
+    server.requests = []
+    server.lock = threading.Lock()
+    server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,68 @@
+import socket
+import urllib.error
+
+import pytest
+
+import async_fetch
+import fetch_data
+
+CSV = b'date,state,fips,cases,deaths\n2020-03-01,Oregon,41,1,0\n'
+
+
+def _http_error(code):
+    return urllib.error.HTTPError('http://example.com', code, 'error', {}, None)
+
+
+@pytest.mark.parametrize('error, transient', [
+    (_http_error(503), True),
+    (_http_error(500), True),
+    (_http_error(429), True),
+    (_http_error(404), False),
+    (_http_error(403), False),
+    (urllib.error.URLError('connection refused'), True),
+    (socket.timeout(), True),
+    (ConnectionResetError(), True),
+    (IOError('disk full'), False),
+])
+def test_is_transient(error, transient):
+    assert async_fetch.is_transient(error) == transient
+
+
+def test_transient_errors_are_retried(stand_in_server, tmp_path):
+    stand_in_server.files['/us.csv'] = CSV
+    stand_in_server.failures['/us.csv'] = [503, 500]
+    cache = fetch_data.DownloadCache(str(tmp_path))
+    url = stand_in_server.url + '/us.csv'
+    paths = async_fetch.refresh([url], cache, backoff=0)
+    with open(paths[url], 'rb') as local_file:
+        assert local_file.read() == CSV
+    assert len(stand_in_server.requests) == 3
+
+
+def test_permanent_errors_are_not_retried(stand_in_server, tmp_path):
+    cache = fetch_data.DownloadCache(str(tmp_path))
+    url = stand_in_server.url + '/missing.csv'
+    paths = async_fetch.refresh([url], cache, backoff=0)
+    assert isinstance(paths[url], fetch_data.CSVFileReadError)
+    assert len(stand_in_server.requests) == 1
+
+
+def test_failed_download_falls_back_to_cached_copy(stand_in_server, tmp_path):
+    stand_in_server.files['/us.csv'] = CSV
+    cache = fetch_data.DownloadCache(str(tmp_path), ttl=0)
+    url = stand_in_server.url + '/us.csv'
+    path = cache.fetch(url)
+    stand_in_server.failures['/us.csv'] = [503] * (async_fetch.RETRIES + 1)
+    paths = async_fetch.refresh([url], cache, backoff=0)
+    assert paths[url] == path
+    assert len(stand_in_server.requests) == 1 + async_fetch.RETRIES + 1
+
+
+def test_one_failing_source_does_not_stop_the_others(stand_in_server, tmp_path):
+    stand_in_server.files['/us.csv'] = CSV
+    stand_in_server.files['/us-states.csv'] = CSV
+    cache = fetch_data.DownloadCache(str(tmp_path))
+    urls = [stand_in_server.url + name for name in ('/us.csv', '/us-states.csv', '/missing.csv')]
+    paths = async_fetch.refresh(urls, cache, backoff=0, max_connections=2)
+    assert all(isinstance(paths[url], str) for url in urls[:2])
+    assert isinstance(paths[urls[2]], fetch_data.CSVFileReadError)
@@ -0,0 +1,58 @@
+import types
+
+import numpy as np
+import pytest
+
+import calibration
+import seir_model
+from corona_virus import CoronaVirus
+from intervention import InterventionSchedule
+from model_config import DEFAULT_CONFIG
+from run_model import run_model
+
+TRUTHS = [dict(r0=2.8, quarantine_r1=0.9, days0=60, fatality_rate=0.006, find_factor=8),
+          dict(r0=2.2, quarantine_r1=1.1, days0=80, fatality_rate=0.004, find_factor=5)]
+
+
+def synthetic_data(truth, population=1e7, offset=20, length=150):
+    """
+    Rounded deaths and reported cases of the model with the truth parameters, starting on model day offset
+    """
+    virus = CoronaVirus(r0=truth['r0'], fatality_rate=truth['fatality_rate'], find_factor=truth['find_factor'])
+    result = calibration.CalibrationResult(truth, 0.0, offset)
+    config = result.config(DEFAULT_CONFIG)
+    days, susceptible, exposed, infected, recovered = seir_model.solve(
+        seir_model.model_changing_beta, population, config.init_infected, virus,
+        InterventionSchedule.from_config(virus.r0, config), config)
+    deaths = seir_model.calculate_deaths(days, recovered, virus, config)
+    cases = seir_model.calculate_reported_cases(infected, virus, config)
+    return types.SimpleNamespace(name='synthetic', population=population,
+                                 dates=np.datetime64('2020-03-01') + np.arange(length),
+                                 deaths=np.round(deaths[offset:offset + length]),
+                                 reported_cases=np.round(cases[offset:offset + length]))
+
+
+@pytest.mark.parametrize('truth', TRUTHS)
+def test_fit_recovers_synthetic_parameters(truth):
+    data = synthetic_data(truth)
+    fit = calibration.calibrate(data, virus=CoronaVirus(fatality_rate=truth['fatality_rate']), seed=0)
+    assert fit.params['r0'] == pytest.approx(truth['r0'], rel=0.03)
+    assert fit.params['days0'] == pytest.approx(truth['days0'], abs=2)
+    assert fit.params['quarantine_r1'] == pytest.approx(truth['quarantine_r1'], rel=0.1)
+    assert fit.params['find_factor'] == pytest.approx(truth['find_factor'], rel=0.1)
+    assert fit.params['fatality_rate'] == truth['fatality_rate']
+    assert fit.data_offset == pytest.approx(20, abs=2)
+
+
+def test_fitted_config_runs_in_run_model():
+    truth = TRUTHS[0]
+    data = synthetic_data(truth)
+    fit = calibration.calibrate(data, starts=2, generations=3, seed=0)
+    config = fit.config()
+    assert isinstance(config.days0, int) and isinstance(config.days_q_lifted, int)
+    assert run_model(data, fit.virus(), plot=False, save_data=False, verbose=True, config=config)['data_offset'] \
+        == fit.data_offset
+    # the offset run_model finds for the fitted lockdown is the one of the fit
+    results = run_model(data, fit.virus(), plot=False, save_data=False, verbose=False,
+                        config=config.replace(data_offset='auto'))
+    assert abs(results['data_offset'] - fit.data_offset) <= 1
@@ -0,0 +1,49 @@
+import os
+
+import fetch_data
+
+CSV = b'date,state,fips,cases,deaths\n2020-03-01,Oregon,41,1,0\n'
+
+
+def test_fresh_copy_is_not_downloaded_again(stand_in_server, tmp_path):
+    stand_in_server.files['/us-states.csv'] = CSV
+    cache = fetch_data.DownloadCache(str(tmp_path), ttl=3600)
+    url = stand_in_server.url + '/us-states.csv'
+    path = cache.fetch(url)
+    assert cache.fetch(url) == path
+    assert len(stand_in_server.requests) == 1
+    with open(path, 'rb') as local_file:
+        assert local_file.read() == CSV
+
+
+def test_stale_copy_sends_conditional_request(stand_in_server, tmp_path):
+    stand_in_server.files['/us-states.csv'] = CSV
+    cache = fetch_data.DownloadCache(str(tmp_path), ttl=0)
+    url = stand_in_server.url + '/us-states.csv'
+    path = cache.fetch(url)
+    os.utime(path, (0, 0))
+    assert cache.fetch(url) == path
+    headers = stand_in_server.requests[-1][1]
+    assert headers['If-None-Match']
+    assert headers['If-Modified-Since'] == 'Wed, 01 Apr 2020 00:00:00 GMT'
+    # the 304 answer marks the copy as fresh again
+    assert os.path.getmtime(path) > 0
+
+
+def test_changed_file_replaces_copy(stand_in_server, tmp_path):
+    stand_in_server.files['/us-states.csv'] = CSV
+    cache = fetch_data.DownloadCache(str(tmp_path), ttl=0)
+    url = stand_in_server.url + '/us-states.csv'
+    cache.fetch(url)
+    stand_in_server.files['/us-states.csv'] = CSV + b'2020-03-02,Oregon,41,3,0\n'
+    with open(cache.fetch(url), 'rb') as local_file:
+        assert local_file.read().endswith(b'2020-03-02,Oregon,41,3,0\n')
+
+
+def test_update_false_uses_any_copy(stand_in_server, tmp_path):
+    stand_in_server.files['/us-states.csv'] = CSV
+    cache = fetch_data.DownloadCache(str(tmp_path), ttl=0)
+    url = stand_in_server.url + '/us-states.csv'
+    path = cache.fetch(url)
+    assert cache.fetch(url, update=False) == path
+    assert len(stand_in_server.requests) == 1
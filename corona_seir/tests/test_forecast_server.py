@@ -0,0 +1,38 @@
+import concurrent.futures
+
+import numpy as np
+import pytest
+
+import benchmark_suite
+import forecast_server
+from region_index import RegionIndex
+
+
+@pytest.fixture(scope='module')
+def service():
+    index = RegionIndex.from_frame(benchmark_suite.synthetic_frame(52 * benchmark_suite.FIXTURE_DAYS))
+    return forecast_server.ForecastService(raw_data={'states': index})
+
+
+def request(r0):
+    return {'region': 'Texas', 'params': {'r0': r0}}
+
+
+def test_result_does_not_depend_on_the_batch(service):
+    alone = service.forecast(request(2.5))['infected']
+    service._curves.clear()
+    with concurrent.futures.ThreadPoolExecutor(21) as pool:
+        results = list(pool.map(service.forecast, [request(2 + k / 40) for k in range(21)]))
+    assert np.array_equal(results[20]['infected'], alone)
+
+
+def test_r0_of_one_is_a_valid_request(service):
+    assert np.isfinite(service.forecast(request(1))['infected']).all()
+
+
+@pytest.mark.parametrize('bad', [{'params': {'find_factor': 0}}, {'schedule': [70]}, {'params': {'r0': 'x'}},
+                                 {'format': 'xml'}, {'region': 5}])
+def test_bad_requests_raise_forecast_errors(service, bad):
+    with pytest.raises(forecast_server.ForecastError) as error:
+        service.forecast(dict(request(2.5), **bad))
+    assert error.value.status == 400
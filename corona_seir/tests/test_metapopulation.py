@@ -0,0 +1,16 @@
+import numpy as np
+
+from corona_virus import CoronaVirus
+from metapopulation import MetapopulationModel, load_states
+
+
+def test_united_states_uses_population_key():
+    model = MetapopulationModel.united_states(CoronaVirus(), key='POPESTIMATE2018')
+    assert np.array_equal(model.populations, load_states(key='POPESTIMATE2018')['POPESTIMATE2018'])
+
+
+def test_default_solver_matches_bdf():
+    model = MetapopulationModel.united_states(CoronaVirus())
+    infected = model.solve()[1]['I']
+    reference = model.solve(method='BDF', rtol=1e-9, atol=1e-6)[1]['I']
+    assert np.abs(infected - reference).max() / reference.max() < 5e-3
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas
+import pytest
+
+import fetch_data
+import population_registry
+from country_data import CountryData
+from region_index import RegionIndex
+
+# co-est2019-alldata.csv layout: the state total (summary level 40) and its counties (50)
+CENSUS = (b'SUMLEV,REGION,DIVISION,STATE,COUNTY,STNAME,CTYNAME,POPESTIMATE2019\n'
+          b'040,4,9,41,0,Oregon,Oregon,4217737\n'
+          b'050,4,9,41,51,Oregon,Multnomah County,812855\n'
+          b'050,4,9,41,67,Oregon,Washington County,601592\n'
+          b'050,3,7,22,71,Louisiana,Orleans Parish,390144\n')
+
+
+@pytest.fixture
+def county_source(stand_in_server, tmp_path, monkeypatch):
+    stand_in_server.files['/co-est2019-alldata.csv'] = CENSUS
+    monkeypatch.setattr(fetch_data, 'COUNTY_CENSUS_URL', stand_in_server.url + '/co-est2019-alldata.csv')
+    monkeypatch.setattr(fetch_data, 'COUNTY_FILE', str(tmp_path / 'co-est2019-pop.csv'))
+    fetch_data.get_registry.cache_clear()
+    yield fetch_data.DownloadCache(str(tmp_path / 'cache'), ttl=3600)
+    fetch_data.get_registry.cache_clear()
+
+
+def test_county_file_from_census_data(county_source):
+    file = fetch_data.fetch_county_file(cache=county_source)
+    registry = population_registry.PopulationRegistry.load(county_file=file)
+    assert registry.population(('Oregon', 'Multnomah')) == 812855
+    assert registry.population('Orleans', county=True) == 390144
+    assert registry.by_fips(41067) == 601592
+    # state totals still come from the state file
+    assert registry.population('Oregon') == 4217737
+
+
+def test_county_data_loads_population(county_source):
+    frame = pandas.DataFrame({'date': ['2020-03-01', '2020-03-02'], 'county': ['Multnomah'] * 2,
+                              'state': ['Oregon'] * 2, 'fips': [41051] * 2, 'cases': [3, 5], 'deaths': [0, 1]})
+    county_data = CountryData('Multnomah', county=True, state='Oregon', raw_data=RegionIndex.from_frame(frame),
+                              cache=county_source)
+    assert county_data.population == 812855
+    assert np.array_equal(county_data.deaths, [0, 1])
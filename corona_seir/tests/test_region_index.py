@@ -0,0 +1,19 @@
+import numpy as np
+import pandas
+
+from region_index import RegionIndex
+
+
+def test_missing_deaths_count_as_zero():
+    # the NYT counties file has no deaths for some rows, read_csv makes them NaN floats
+    frame = pandas.DataFrame({'date': ['2020-03-02', '2020-03-01', '2020-03-01'],
+                              'county': ['Multnomah', 'Multnomah', 'Orleans'],
+                              'state': ['Oregon', 'Oregon', 'Louisiana'],
+                              'fips': [41051, 41051, 22071],
+                              'cases': [5, 3, 2], 'deaths': [1.0, np.nan, np.nan]})
+    index = RegionIndex.from_frame(frame)
+    dates, cases, deaths = index.lookup('Multnomah')
+    assert deaths.dtype == np.int64
+    assert np.array_equal(cases, [3, 5])
+    assert np.array_equal(deaths, [0, 1])
+    assert np.array_equal(index.lookup('Orleans', state='Louisiana')[2], [0])
@@ -0,0 +1,29 @@
+import types
+
+import numpy as np
+
+import seir_model
+from corona_virus import CoronaVirus
+from run_model import run_model
+
+
+def model_data(offset=20, length=150, population=1e7):
+    """
+    Rounded deaths and reported cases of the default model, starting on model day offset
+    """
+    virus = CoronaVirus()
+    days, susceptible, exposed, infected, recovered = seir_model.solve(seir_model.model_changing_beta, population,
+                                                                        1, virus)
+    deaths = seir_model.calculate_deaths(days, recovered, virus)
+    cases = seir_model.calculate_reported_cases(infected, virus)
+    return types.SimpleNamespace(name='synthetic', population=population,
+                                 dates=np.datetime64('2020-03-01') + np.arange(length),
+                                 deaths=np.round(deaths[offset:offset + length]),
+                                 reported_cases=np.round(cases[offset:offset + length]))
+
+
+def test_quiet_run_prints_nothing(capsys):
+    run_model(model_data(), CoronaVirus(), plot=False, save_data=False, verbose=False)
+    assert capsys.readouterr().out == ''
+    run_model(model_data(), CoronaVirus(), plot=False, save_data=False, verbose=True)
+    assert 'date offset:' in capsys.readouterr().out
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+import seir_model
+from corona_virus import CoronaVirus
+from intervention import InterventionSchedule
+from model_config import DEFAULT_CONFIG
+
+POPULATION = 3.3e8
+
+
+def deviation_from_solve(days0, days_q_lifted, steps_per_day):
+    virus = CoronaVirus()
+    config = DEFAULT_CONFIG
+    schedule = InterventionSchedule.lockdown(virus.r0, 1, 1.8, days0, days_q_lifted, config.delta_r0, config.days_total)
+    reference = np.array(seir_model.solve(seir_model.model_changing_beta, POPULATION, config.init_infected, virus,
+                                          schedule, config)[1:])
+    row = seir_model.batch_params(POPULATION, virus, 1, 1.8, days0, days_q_lifted, config)
+    batch = np.array(seir_model.solve_batch(row, steps_per_day=steps_per_day, config=config)[1:])[:, 0]
+    return (np.abs(batch - reference).max(axis=1) / np.abs(reference).max(axis=1)).max()
+
+
+@pytest.mark.parametrize('days0, days_q_lifted', [(74, 149), (60.4, 100.7), (30.3, 200.2)])
+def test_batch_matches_solve_on_the_table_grid(days0, days_q_lifted):
+    assert deviation_from_solve(days0, days_q_lifted, 24) < 1e-5
+
+
+@pytest.mark.parametrize('steps_per_day', [2, 4])
+@pytest.mark.parametrize('days0, days_q_lifted', [(74, 149), (30.3, 200.2)])
+def test_batch_stays_close_to_solve_with_fewer_steps(days0, days_q_lifted, steps_per_day):
+    assert deviation_from_solve(days0, days_q_lifted, steps_per_day) < 1e-3
+
+
+def test_batch_steps_cover_whole_table_entries():
+    assert [seir_model.batch_steps(n) for n in (1, 2, 4, 5, 7, 24, 25)] == [1, 2, 4, 6, 8, 24, 48]
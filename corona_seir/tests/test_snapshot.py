@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+import pandas
+
+import snapshot
+from region_index import RegionIndex
+
+
+def index_of(deaths):
+    frame = pandas.DataFrame({'date': ['2020-03-01', '2020-03-02'], 'state': ['Oregon'] * 2, 'fips': [41] * 2,
+                              'cases': [3, 5], 'deaths': deaths})
+    return RegionIndex.from_frame(frame)
+
+
+def versions(path):
+    return sorted(name for name in os.listdir(path) if name.startswith(snapshot.VERSION_PREFIX))
+
+
+def test_rewrite_keeps_previous_version(tmp_path):
+    path = str(tmp_path)
+    snapshot.write_snapshot(index_of([0, 1]), path)
+    first = snapshot.current_version(path)
+    snapshot.write_snapshot(index_of([0, 2]), path)
+    second = snapshot.current_version(path)
+    # a reader that read CURRENT before the rewrite still finds its folder
+    assert versions(path) == sorted([first, second])
+    assert np.array_equal(snapshot._read_version(os.path.join(path, first)).lookup('Oregon')[2], [0, 1])
+    snapshot.write_snapshot(index_of([0, 3]), path)
+    assert first not in versions(path) and len(versions(path)) == 2
+
+
+def test_reader_retries_after_deleted_version(tmp_path, monkeypatch):
+    path = str(tmp_path)
+    snapshot.write_snapshot(index_of([0, 1]), path)
+    stale = snapshot.current_version(path)
+    snapshot.write_snapshot(index_of([0, 2]), path)
+    snapshot.write_snapshot(index_of([0, 3]), path)
+    # the first read of CURRENT returns a version two rewrites old, as for a reader paused right after it
+    reads = []
+    current_version = snapshot.current_version
+
+    def paused_reader(folder):
+        reads.append(folder)
+        return stale if len(reads) == 1 else current_version(folder)
+
+    monkeypatch.setattr(snapshot, 'current_version', paused_reader)
+    assert np.array_equal(snapshot.read_snapshot(path).lookup('Oregon')[2], [0, 3])
+    assert len(reads) == 2
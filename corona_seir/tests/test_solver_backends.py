@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+import solver_backends
+from corona_virus import CoronaVirus
+
+# Largest deviation from odeint per backend, relative to the peak of each compartment. About 3x the measured
+# deviation: the adaptive backends run at rtol 1e-6 (solve_ivp default LSODA 9e-6, BDF 4e-5, RK45 7e-5),
+# fixed_step at its default 4 steps per day (1.3e-7)
+TOLERANCES = {
+    'odeint': 1e-12,
+    'solve_ivp': 3e-5,
+    'solve_ivp_bdf': 1.5e-4,
+    'solve_ivp_rk45': 2e-4,
+    'fixed_step': 5e-7,
+}
+
+
+@pytest.mark.parametrize('name', sorted(solver_backends.BACKENDS))
+def test_backend_matches_odeint(name):
+    deviations = solver_backends.check_parity(names=[name])
+    assert deviations[name] < TOLERANCES[name]
+
+
+def test_fixed_step_is_rounded_to_the_table():
+    backend = solver_backends.FixedStepBackend(steps_per_day=4)
+    assert backend.steps_for(1) == 4
+    assert backend.steps_for(3) == 6
+    assert backend.steps_for(24) == 24
+    assert solver_backends.FixedStepBackend(steps_per_day=30).steps_for(24) == 48
+
+
+def test_fixed_step_converges_at_fourth_order():
+    virus = CoronaVirus()
+    table, steps_per_day = solver_backends.beta_table(virus)
+    params = solver_backends.parameter_vector(3.3e8, virus, steps_per_day)
+    y0 = np.array([3.3e8 - 1, 1, 0, 0], dtype='float64')
+    days = np.arange(200)
+    reference = solver_backends.SolveIvpBackend('DOP853', rtol=1e-12, atol=1e-6).solve(y0, days, params, table)
+    scale = np.abs(reference).max(axis=0)
+    errors = [(np.abs(solver_backends.FixedStepBackend(n).solve(y0, days, params, table) - reference) / scale).max()
+              for n in (1, 2, 4)]
+    # halving the step divides the error of a fourth order method by 16
+    assert errors[0] / errors[1] > 12
+    assert errors[1] / errors[2] > 12